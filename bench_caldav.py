@@ -0,0 +1,124 @@
+"""
+CalDAV client benchmark
+Load test of iCloudCalendarClient against the local fake server (fake_caldav.py)
+
+For growing calendar sizes (events per calendar, 20% recurring) every calendar
+operation the app runs is timed and its CalDAV round trips counted:
+
+- today:  get_today_events (cronograma generation)
+- week:   get_week_events(7)
+- detect: detect_new_events_in_shared_calendar (30 days of the shared calendar)
+- find:   find_event_by_uid (copy of a shared event, 60 days window)
+
+Each run uses a fresh client, as the app does, so discovery (3 PROPFINDs) is
+included. client ms is wall time minus the server's own time: HTTP, XML and
+iCalendar parsing on the client side.
+
+Limits, exit code 1 when exceeded:
+- round trips per operation (MAX_ROUND_TRIPS): they must not grow with the data
+- client ms: a fixed part (CALDAV_BENCH_MAX_BASE_MS, default 100) plus so much per
+  VEVENT instance returned (CALDAV_BENCH_MAX_MS_PER_EVENT, default 2)
+
+Usage: python3.11 bench_caldav.py [sizes] [repeats]
+       CALDAV_BENCH_LATENCY_MS=80 python3.11 bench_caldav.py 100,1000,5000 3
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Event detection writes to events_tracker.db: keep the real one out of it
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='bench_caldav_'))
+
+from calendar_client import iCloudCalendarClient
+from event_detector import detect_new_events_in_shared_calendar
+from fake_caldav import FakeCalDAVServer, synthetic_calendar, TIMEZONE
+
+SIZES = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [100, 1000, 5000]
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+LATENCY_MS = float(os.getenv('CALDAV_BENCH_LATENCY_MS', 0))
+MAX_BASE_MS = float(os.getenv('CALDAV_BENCH_MAX_BASE_MS', 100))
+MAX_MS_PER_EVENT = float(os.getenv('CALDAV_BENCH_MAX_MS_PER_EVENT', 2))
+
+SHARED_CALENDAR = "Casa Juana Doña"
+
+# Discovery (3 PROPFINDs) + one REPORT per calendar read
+MAX_ROUND_TRIPS = {'today': 4, 'week': 4, 'detect': 4, 'find': 4}
+
+
+def last_shared_uid():
+    """UID of an event near the end of find_event_by_uid's window (its worst case)"""
+    today = datetime.now(TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+    events = iCloudCalendarClient().get_events_from_calendar_range(
+        SHARED_CALENDAR, today + timedelta(days=50), today + timedelta(days=60))
+    return events[-1]['uid'] if events else 'missing'
+
+
+# Operation -> (setup, run): setup's result is given to run, untimed
+OPERATIONS = {
+    'today': (None, lambda _: iCloudCalendarClient().get_today_events()),
+    'week': (None, lambda _: iCloudCalendarClient().get_week_events(7)),
+    'detect': (None, lambda _: detect_new_events_in_shared_calendar(SHARED_CALENDAR, days_ahead=30)),
+    'find': (last_shared_uid, lambda uid: iCloudCalendarClient().find_event_by_uid(SHARED_CALENDAR, uid)),
+}
+
+
+def measure(server, setup, run):
+    """Best of REPEATS: (wall ms, server stats of that run)"""
+    best = None
+    for _ in range(REPEATS):
+        # The client logs every event: keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            arg = setup() if setup else None
+            server.reset_stats()
+            started = time.perf_counter()
+            run(arg)
+            wall_ms = (time.perf_counter() - started) * 1000
+        stats = server.stats()
+        if best is None or wall_ms < best[0]:
+            best = (wall_ms, stats)
+    return best
+
+
+if __name__ == '__main__':
+    print(f"\n⏱️  CalDAV client benchmark: sizes {SIZES} events per calendar, best of {REPEATS}, "
+          f"latency {LATENCY_MS:g} ms")
+
+    violations = []
+    for count in SIZES:
+        print(f"\n📅 {count} events per calendar (Calendario, {SHARED_CALENDAR})")
+        server = FakeCalDAVServer({
+            'Calendario': synthetic_calendar(count, seed=1),
+            SHARED_CALENDAR: synthetic_calendar(count, seed=2),
+        }, latency_ms=LATENCY_MS).start()
+        os.environ.update(ICLOUD_CALDAV_URL=server.url, ICLOUD_USERNAME='bench', ICLOUD_APP_PASSWORD='bench')
+
+        print(f"   {'operation':<8} {'requests':>8} {'instances':>9} {'wall':>10} {'server':>10} "
+              f"{'client':>10} {'ms/event':>9}")
+        for name, (setup, run) in OPERATIONS.items():
+            wall_ms, stats = measure(server, setup, run)
+            client_ms = max(wall_ms - stats['server_ms'] - stats['requests'] * LATENCY_MS, 0)
+            per_event = client_ms / stats['instances'] if stats['instances'] else 0
+            max_client_ms = MAX_BASE_MS + MAX_MS_PER_EVENT * stats['instances']
+            print(f"   {name:<8} {stats['requests']:>8} {stats['instances']:>9} {wall_ms:>8.1f}ms "
+                  f"{stats['server_ms']:>8.1f}ms {client_ms:>8.1f}ms {per_event:>9.3f}")
+
+            if stats['requests'] > MAX_ROUND_TRIPS[name]:
+                violations.append(f"{count} events: {name} made {stats['requests']} requests "
+                                  f"(max {MAX_ROUND_TRIPS[name]})")
+            if client_ms > max_client_ms:
+                violations.append(f"{count} events: {name} took {client_ms:.1f} ms on the client for "
+                                  f"{stats['instances']} events (max {max_client_ms:.1f})")
+        server.stop()
+
+    if violations:
+        print("\n❌ Limits exceeded:")
+        for line in violations:
+            print(f"   - {line}")
+        sys.exit(1)
+    print("\n✅ Round trips and parse time within limits")
@@ -0,0 +1,88 @@
+"""
+ICS export benchmark
+
+Publishes a synthetic plan (DAYS days x EVENTS_PER_DAY events, with long accented
+descriptions so line folding kicks in) into a throwaway data directory, then
+measures the multi-day feed export:
+
+- streamed to a file with write_ics (chunk by chunk)
+- built in memory with "".join (the old way)
+
+and reports throughput and peak Python memory (tracemalloc) for each.
+
+Usage: python3.11 bench_ics.py [days] [events_per_day]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Never touch the real databases
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_ics_')
+
+from ics_exporter import ICSExporter, iter_feed_ics, write_ics, fold_line
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 31
+EVENTS_PER_DAY = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+
+def publish_plan(start):
+    for day in range(DAYS):
+        date = (start + timedelta(days=day)).strftime("%Y-%m-%d")
+        exporter = ICSExporter()
+        for n in range(EVENTS_PER_DAY):
+            minute = 7 * 60 + n * 20
+            exporter.add_event(
+                title=f"Tarea {n}: revisión de presupuesto y planificación semanal",
+                start_time=f"{minute // 60 % 24:02d}:{minute % 60:02d}",
+                end_time=f"{(minute + 20) // 60 % 24:02d}:{(minute + 20) % 60:02d}",
+                description="organización, administración, gestión " * 4,
+                priority=f"P{n % 4 + 1}",
+                task_type="Intelectual",
+                url=f"https://todoist.com/showTask?id={day * 1000 + n}",
+                task_id=str(day * 1000 + n)
+            )
+        exporter.publish(date)
+
+
+def measure(label, run):
+    # Timed without tracemalloc (it slows allocation-heavy code several times over)
+    started = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    events = DAYS * EVENTS_PER_DAY
+    print(f"   {label:<22} {elapsed * 1000:8.1f} ms  {events / elapsed:10.0f} events/s  "
+          f"{size / elapsed / 1e6:6.1f} MB/s  peak {peak / 1e6:6.2f} MB")
+
+
+if __name__ == '__main__':
+    start = datetime.now().date()
+    since = start.strftime("%Y-%m-%d")
+    until = (start + timedelta(days=DAYS - 1)).strftime("%Y-%m-%d")
+
+    print(f"\n📅 Publishing {DAYS} days x {EVENTS_PER_DAY} events...")
+    publish_plan(start)
+
+    line = "DESCRIPTION:" + "organización, administración, gestión " * 6
+    rounds = 20000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fold_line(line)
+    print(f"\n🧵 fold_line: {rounds / (time.perf_counter() - started):,.0f} long lines/s")
+
+    output = os.path.join(os.environ['DATA_DIR'], 'bench.ics')
+
+    print(f"\n⏱️  Feed export {since} .. {until} (plan only):")
+    measure("streamed to file", lambda: write_ics(output, iter_feed_ics(since, until, include_shared=False)))
+    measure("joined in memory", lambda: len("".join(iter_feed_ics(since, until, include_shared=False))))
+
+    print(f"\n   Output: {os.path.getsize(output) / 1e6:.2f} MB in {output}")
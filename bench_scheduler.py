@@ -0,0 +1,261 @@
+"""
+Scheduler benchmark
+
+Generates synthetic days (Todoist-like tasks with a realistic mix of duration,
+block, type and priority labels, plus calendar events) of growing size and times
+every stage of a cronograma generation separately:
+
+- categorise: categorize_tasks (label parsing and grouping)
+- placement:  fixed blocks and the first-fit pass
+- optimiser:  branch and bound pass (time budgeted: its score is tracked, not its time)
+- consolidate: consolidate_schedule
+- render:     HTML table rows and the day's ICS
+
+Nothing is fetched: no Todoist, iCloud or databases. Every run is appended to a
+JSON history file (BENCH_HISTORY_FILE, default data/bench_scheduler_history.json)
+and compared with the previous run, so regressions show up run over run.
+
+Usage: python3.11 bench_scheduler.py [sizes] [repeats]
+       python3.11 bench_scheduler.py 10,100,1000,5000 5
+"""
+
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import schedule_engine as se
+from cronograma_html import render_schedule_rows
+from ics_exporter import ICSExporter
+from sqlite_store import db_path
+
+SIZES = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10, 50, 200, 1000, 5000]
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+HISTORY_FILE = os.getenv('BENCH_HISTORY_FILE', db_path('bench_scheduler_history.json'))
+
+# A stage is flagged when it is this much slower than in the previous run...
+REGRESSION_RATIO = 1.2
+# ...and by at least this many milliseconds (noise floor)
+REGRESSION_MIN_MS = 0.5
+
+OPTIMISER_BUDGET_MS = 300
+
+# (label, weight) mixes, roughly those of the real task list
+DURATION_MIX = [('5min', 15), ('15min', 20), ('20min', 10), ('30min', 25), ('1h', 15), ('2h', 5), (None, 10)]
+BLOCK_MIX = [(None, 40), ('por la mañana', 20), ('por la tarde', 18), ('por la noche', 5),
+             ('rutina administrativa matinal', 10), ('checks', 7)]
+TYPE_MIX = [('intelectual', 35), ('administrativo', 25), ('fisico', 15), (None, 25)]
+# Todoist priority: 1 = P4 (most tasks) ... 4 = P1
+PRIORITY_MIX = [(1, 50), (2, 25), (3, 15), (4, 10)]
+
+WORDS = ['Revisar', 'correo', 'Llamar', 'constructor', 'Leer', 'libro', 'ejercicio', 'espalda',
+         'presupuesto', 'gastos', 'visita', 'idealista', 'fondos', 'trading', 'beber', 'agua',
+         'informe', 'reunión', 'mantra', 'batería', 'planificación', 'semanal', 'factura', 'banco']
+
+EVENT_TITLES = ['📅 Reunión de equipo', '📅 Médico', '📅 Dentista', '📅 Llamada con cliente',
+                '📅 Recoger paquete', '📅 Gimnasio', '📅 Comida familiar', '📅 Clase']
+
+
+def _pick(rng, mix):
+    values, weights = zip(*mix)
+    return rng.choices(values, weights)[0]
+
+
+def synthetic_tasks(count, seed=0):
+    """Formatted Todoist tasks (as TodoistClient.format_tasks_for_display)"""
+    rng = random.Random(seed)
+    tasks = []
+    for n in range(count):
+        labels = [_pick(rng, DURATION_MIX), _pick(rng, BLOCK_MIX), _pick(rng, TYPE_MIX)]
+        priority = _pick(rng, PRIORITY_MIX)
+        task = {
+            'id': str(8000000000 + n),
+            'content': ' '.join(rng.sample(WORDS, rng.randint(2, 6))).capitalize(),
+            'description': '',
+            'priority': f"P{5 - priority}",
+            'priority_value': priority,
+            'labels': [label for label in labels if label],
+            'due_date': rng.choice([None, None, '2026-01-05', '2026-01-04']),
+            'due_time': None,
+            'project_id': '2200000000',
+            'url': f"https://todoist.com/showTask?id={8000000000 + n}",
+        }
+        # A few tasks come with a fixed time
+        if rng.random() < 0.05:
+            task['due_time'] = f"{rng.randint(8, 19):02d}:{rng.choice(['00', '30'])}"
+        tasks.append(task)
+    return tasks
+
+
+def synthetic_events(count, seed=0):
+    """Non-overlapping personal calendar events (as iCloudCalendarClient.get_today_events)"""
+    rng = random.Random(seed)
+    events = []
+    # Half-hour slots of the day, taken at random
+    slots = sorted(rng.sample(range(2, 27), min(count, 12)))
+    previous_end = 0
+    for slot in slots:
+        start = max(slot * 30, previous_end)
+        duration = rng.choice([30, 45, 60, 90])
+        end = min(start + duration, se.DAY_MINUTES)
+        if end <= start:
+            break
+        events.append({
+            'content': rng.choice(EVENT_TITLES),
+            'start_time': se.minute_to_time(start),
+            'end_time': se.minute_to_time(end),
+            'duration': end - start,
+            'type': 'Fija',
+            'priority': 'P1',
+            'labels': ['calendario'],
+            'source': 'calendar'
+        })
+        previous_end = end
+    return events
+
+
+def best_of(run, repeats=REPEATS):
+    """Fastest of several runs, in ms, and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = run()
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return round(best, 3), result
+
+
+def render(cronograma):
+    html = render_schedule_rows(cronograma)
+    exporter = ICSExporter()
+    for task in cronograma:
+        exporter.add_event(
+            title=task.get("content", "Sin título"),
+            start_time=task.get("start_time", "00:00"),
+            end_time=task.get("end_time", "00:00"),
+            description=" ".join(task.get("labels", [])),
+            priority=task.get("priority", "P4"),
+            task_type=task.get("type", "General"),
+            url=task.get("url", ""),
+            task_id=task.get("id", "")
+        )
+    return len(html) + len(exporter.generate_ics("2026-01-05"))
+
+
+def bench_size(count):
+    tasks = synthetic_tasks(count, seed=count)
+    events = synthetic_events(max(2, min(count // 20, 12)), seed=count)
+    result = {'tasks': count, 'events': len(events)}
+
+    # categorize_tasks annotates the tasks in place; running it again is harmless
+    result['categorise_ms'], groups = best_of(lambda: se.categorize_tasks(tasks, verbose=False))
+
+    def placement():
+        base = se.new_schedule()
+        pending = {id(task) for task in se.place_fixed_blocks(base, events, tasks, verbose=False)}
+        pending_groups = {name: [t for t in group if id(t) in pending] for name, group in groups.items()}
+        schedule = base.copy()
+        se.first_fit(schedule, pending_groups, verbose=False)
+        return base, pending_groups, schedule
+
+    result['placement_ms'], (base, pending_groups, first) = best_of(placement)
+
+    optimised, stats = se.optimise_schedule(base, pending_groups, OPTIMISER_BUDGET_MS, incumbent=first)
+
+    to_schedule = [task for group in pending_groups.values() for task in group]
+    first_metrics = se.schedule_metrics(first, to_schedule)
+    optimised_metrics = se.schedule_metrics(optimised, to_schedule)
+    result['optimiser_ms'] = stats['solve_ms']
+    result['optimiser_nodes'] = stats['nodes']
+    result['optimiser_complete'] = stats['complete']
+    result['first_fit_score'] = first_metrics['score']
+    result['optimised_score'] = optimised_metrics['score']
+
+    result['consolidate_ms'], cronograma = best_of(lambda: se.consolidate_schedule(optimised))
+    result['blocks'] = len(cronograma)
+    result['render_ms'], size = best_of(lambda: render(cronograma))
+    result['render_bytes'] = size
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_history():
+    if not os.path.exists(HISTORY_FILE):
+        return []
+    with open(HISTORY_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(history):
+    os.makedirs(os.path.dirname(os.path.abspath(HISTORY_FILE)), exist_ok=True)
+    tmp = HISTORY_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp, HISTORY_FILE)
+
+
+def regressions(previous, current):
+    """Stages slower (or optimiser scores lower) than in the previous run, per size"""
+    found = []
+    before = {result['tasks']: result for result in previous['results']}
+    for result in current['results']:
+        old = before.get(result['tasks'])
+        if not old:
+            continue
+        for stage in ('categorise_ms', 'placement_ms', 'consolidate_ms', 'render_ms'):
+            if (result[stage] > old[stage] * REGRESSION_RATIO
+                    and result[stage] - old[stage] >= REGRESSION_MIN_MS):
+                found.append(f"{result['tasks']} tasks: {stage} {old[stage]} -> {result[stage]}")
+        if result['optimised_score'] < old['optimised_score']:
+            found.append(f"{result['tasks']} tasks: optimised score "
+                         f"{old['optimised_score']} -> {result['optimised_score']}")
+    return found
+
+
+if __name__ == '__main__':
+    print(f"\n⏱️  Scheduler benchmark: sizes {SIZES}, best of {REPEATS}")
+    print(f"   {'tasks':>6} {'categorise':>11} {'placement':>10} {'optimiser':>10} "
+          f"{'consolidate':>12} {'render':>8}  score first -> optimised")
+
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'repeats': REPEATS,
+        'results': [],
+    }
+    for count in SIZES:
+        result = bench_size(count)
+        run['results'].append(result)
+        print(f"   {count:>6} {result['categorise_ms']:>9.2f}ms {result['placement_ms']:>8.2f}ms "
+              f"{result['optimiser_ms']:>8.1f}ms{'' if result['optimiser_complete'] else '*'}"
+              f"{result['consolidate_ms']:>11.3f}ms {result['render_ms']:>6.2f}ms  "
+              f"{result['first_fit_score']} -> {result['optimised_score']}")
+    print("   * optimiser stopped at its time budget")
+
+    history = load_history()
+    previous = next((entry for entry in reversed(history) if entry.get('repeats') == REPEATS), None)
+    history.append(run)
+    save_history(history)
+    print(f"\n💾 Run {len(history)} saved to {HISTORY_FILE}")
+
+    if previous:
+        found = regressions(previous, run)
+        if found:
+            print(f"⚠️  Regressions against run of {previous['timestamp']} ({previous.get('revision')}):")
+            for line in found:
+                print(f"   - {line}")
+        else:
+            print(f"✅ No regressions against run of {previous['timestamp']} ({previous.get('revision')})")
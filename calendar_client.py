@@ -21,8 +21,10 @@ class iCloudCalendarClient:
         """Initialize CalDAV client with iCloud credentials from environment variables"""
         self.username = os.getenv('ICLOUD_USERNAME')  # tu_email@icloud.com
         self.password = os.getenv('ICLOUD_APP_PASSWORD')  # Contraseña específica de app
-        self.caldav_url = "https://caldav.icloud.com/"
+        # Overridable to point the client at another server (fake_caldav.py for load tests)
+        self.caldav_url = os.getenv('ICLOUD_CALDAV_URL', "https://caldav.icloud.com/")
         self.timezone = pytz.timezone('Europe/Madrid')
+        self._calendar_list = None
         
         if not self.username or not self.password:
             print("⚠️  ADVERTENCIA: Credenciales de iCloud no configuradas")
@@ -42,6 +44,17 @@ class iCloudCalendarClient:
                 print(f"❌ Error al conectar con iCloud Calendar: {e}")
                 self.client = None
     
+    def _calendars(self):
+        """
+        Calendars of the account, discovered once per client
+        
+        Discovery costs three PROPFIND round trips (principal, calendar home and
+        calendar list), so every query of the same client reuses its result.
+        """
+        if self._calendar_list is None:
+            self._calendar_list = self.client.principal().calendars()
+        return self._calendar_list
+    
     def get_week_events(self, days=7):
         """
         Get all events from iCloud Calendar for the next N days
@@ -67,9 +80,7 @@ class iCloudCalendarClient:
             return {}
         
         try:
-            # Get principal and calendars
-            principal = self.client.principal()
-            calendars = principal.calendars()
+            calendars = self._calendars()
             
             # Define date range
             today = datetime.now(self.timezone).replace(hour=0, minute=0, second=0, microsecond=0)
@@ -96,8 +107,9 @@ class iCloudCalendarClient:
                     
                     for event in events:
                         try:
-                            # Parse iCalendar data
-                            cal = Calendar.from_ical(event.data)
+                            # Already parsed by caldav (expanding the search): event.data
+                            # would serialise it again just to be parsed a second time
+                            cal = event.icalendar_instance
                             
                             for component in cal.walk():
                                 if component.name == "VEVENT":
@@ -202,9 +214,7 @@ class iCloudCalendarClient:
             return []
         
         try:
-            # Get principal and calendars
-            principal = self.client.principal()
-            calendars = principal.calendars()
+            calendars = self._calendars()
             
             # Define target date's time range
             if target_date is None:
@@ -233,8 +243,9 @@ class iCloudCalendarClient:
                     
                     for event in events:
                         try:
-                            # Parse iCalendar data
-                            cal = Calendar.from_ical(event.data)
+                            # Already parsed by caldav (expanding the search): event.data
+                            # would serialise it again just to be parsed a second time
+                            cal = event.icalendar_instance
                             
                             for component in cal.walk():
                                 if component.name == "VEVENT":
@@ -290,7 +301,7 @@ class iCloudCalendarClient:
             print(f"❌ Error al obtener eventos del calendario: {e}")
             return []
     
-    def get_events_from_calendar_range(self, calendar_name, start_date, end_date):
+    def get_events_from_calendar_range(self, calendar_name, start_date, end_date, uid=None):
         """
         Get events from a specific calendar within a date range
         
@@ -298,6 +309,7 @@ class iCloudCalendarClient:
             calendar_name: Name of the calendar
             start_date: Start datetime
             end_date: End datetime
+            uid: Only the instances of this event (filtered by the server)
         
         Returns:
             List of events
@@ -308,17 +320,20 @@ class iCloudCalendarClient:
         events = []
         
         try:
-            principal = self.client.principal()
-            calendars = principal.calendars()
+            calendars = self._calendars()
             
             for calendar in calendars:
                 if calendar.name == calendar_name:
                     try:
-                        cal_events = calendar.date_search(start=start_date, end=end_date, expand=True)
+                        if uid:
+                            cal_events = calendar.search(event=True, uid=uid, start=start_date, end=end_date,
+                                                         expand=True, split_expanded=False)
+                        else:
+                            cal_events = calendar.date_search(start=start_date, end=end_date, expand=True)
                         
                         for event in cal_events:
                             try:
-                                cal = Calendar.from_ical(event.data)
+                                cal = event.icalendar_instance
                                 
                                 for component in cal.walk():
                                     if component.name == "VEVENT":
@@ -366,6 +381,27 @@ class iCloudCalendarClient:
         
         return events
     
+    def find_event_by_uid(self, calendar_name, uid, days_ahead=60):
+        """
+        Find an event by UID in a specific calendar within the next days
+        
+        One query over the whole window, filtered by UID on the server, which
+        also expands recurring events: the earliest instance is returned.
+        
+        Args:
+            calendar_name: Name of the calendar
+            uid: UID of the event
+            days_ahead: Days to search from today (default 60)
+        
+        Returns:
+            Event (as get_events_from_calendar_range) or None if not found
+        """
+        today = datetime.now(self.timezone).replace(hour=0, minute=0, second=0, microsecond=0)
+        events = self.get_events_from_calendar_range(calendar_name, today, today + timedelta(days=days_ahead), uid=uid)
+        # UID filters are substring matches (RFC 4791 text-match)
+        matches = [event for event in events if event['uid'] == uid]
+        return min(matches, key=lambda event: event['start_datetime']) if matches else None
+    
     def create_event(self, calendar_name, summary, start_datetime, end_datetime, description=""):
         """
         Create a new event in the specified calendar
@@ -385,8 +421,7 @@ class iCloudCalendarClient:
                 print("❌ Calendar client not initialized")
                 return False
             
-            principal = self.client.principal()
-            calendars = principal.calendars()
+            calendars = self._calendars()
             
             # Find the target calendar
             target_calendar = None
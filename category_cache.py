@@ -0,0 +1,210 @@
+"""
+Category Cache
+Caché persistente descripción → categoría para gastos
+
+Evita repetir la llamada a OpenAI para comercios recurrentes. Las descripciones se
+normalizan (minúsculas, sin acentos, sin importes) y las entradas menos usadas se
+descartan (LRU) al superar el tamaño máximo. Las correcciones del usuario tienen
+prioridad sobre las respuestas de la IA.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import sqlite_store
+
+DB_PATH = sqlite_store.db_path('category_cache.db')
+
+MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS category_cache (
+        clave TEXT PRIMARY KEY,
+        categoria TEXT NOT NULL,
+        fuente TEXT NOT NULL,
+        last_used TEXT NOT NULL
+    );
+    ''',
+]
+
+MAX_ENTRIES = int(os.getenv('CATEGORY_CACHE_SIZE', 2000))
+
+# Sources, by precedence
+FUENTE_USUARIO = 'usuario'
+FUENTE_IA = 'ia'
+
+_IMPORTE_RE = re.compile(r'\d+(?:[.,]\d+)?')
+_MONEDA_RE = re.compile(r'\b(?:euros?|eur|centimos?|cents?)\b|€')
+_NO_ALFANUM_RE = re.compile(r'[^a-z0-9ñ ]+')
+_ESPACIOS_RE = re.compile(r'\s+')
+
+
+def normalizar_descripcion(descripcion: str) -> str:
+    """
+    Normaliza una descripción para usarla como clave de caché
+
+    "Mercadona 25,50€" y "MERCADONA" producen la misma clave: "mercadona"
+    """
+    texto = descripcion.lower()
+    # Quitar acentos conservando la ñ
+    texto = texto.replace('ñ', '\x00')
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.replace('\x00', 'ñ')
+
+    texto = _IMPORTE_RE.sub(' ', texto)
+    texto = _MONEDA_RE.sub(' ', texto)
+    texto = _NO_ALFANUM_RE.sub(' ', texto)
+    return _ESPACIOS_RE.sub(' ', texto).strip()
+
+
+class CategoryCache:
+    """LRU cache in memory, persisted to SQLite"""
+
+    def __init__(self, db_path: str = DB_PATH, max_entries: int = MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (categoria, fuente)
+        self._touched = set()  # hits not yet persisted (written on next put)
+        self._lock = threading.Lock()
+
+        self._init_db()
+        self._load()
+
+    def _init_db(self):
+        sqlite_store.register_migrations(self.db_path, MIGRATIONS)
+        sqlite_store.get_connection(self.db_path)
+
+    def _load(self):
+        """Load entries, least recently used first"""
+        conn = sqlite_store.get_connection(self.db_path)
+        rows = conn.execute('''
+            SELECT clave, categoria, fuente FROM category_cache
+            ORDER BY last_used ASC
+        ''').fetchall()
+        for clave, categoria, fuente in rows:
+            self._entries[clave] = (categoria, fuente)
+
+        with self._lock:
+            evicted = self._evict()
+        if evicted:
+            with sqlite_store.transaction(self.db_path) as conn:
+                conn.executemany('DELETE FROM category_cache WHERE clave = ?', [(c,) for c in evicted])
+
+    def lookup(self, descripcion: str, count: bool = True) -> Optional[Tuple[str, str]]:
+        """
+        Look up a description (no database access)
+
+        Args:
+            count: Count the lookup as a hit or miss. With False the caller
+                reports it with record_lookup once it knows the cache decided.
+
+        Returns:
+            Tuple (categoria, fuente) or None
+        """
+        clave = normalizar_descripcion(descripcion)
+        if not clave:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(clave)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(clave)
+            self._touched.add(clave)
+            if count:
+                self.hits += 1
+            return entry
+
+    def record_lookup(self, hit: bool):
+        """Count a lookup made with count=False"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, descripcion: str) -> Optional[str]:
+        """Get the cached category for a description, or None"""
+        entry = self.lookup(descripcion)
+        return entry[0] if entry else None
+
+    def put(self, descripcion: str, categoria: str, fuente: str = FUENTE_IA):
+        """
+        Store a category for a description
+
+        An AI answer never overwrites a user correction.
+        """
+        clave = normalizar_descripcion(descripcion)
+        if not clave or not categoria:
+            return
+
+        with self._lock:
+            actual = self._entries.get(clave)
+            if actual and actual[1] == FUENTE_USUARIO and fuente != FUENTE_USUARIO:
+                return
+
+            self._entries[clave] = (categoria, fuente)
+            self._entries.move_to_end(clave)
+            evicted = self._evict()
+            touched = [c for c in self._touched if c in self._entries]
+            self._touched.clear()
+
+        now = datetime.now().isoformat()
+        with sqlite_store.transaction(self.db_path) as conn:
+            if touched:
+                conn.executemany('UPDATE category_cache SET last_used = ? WHERE clave = ?',
+                                 [(now, c) for c in touched])
+            conn.execute('''
+                INSERT INTO category_cache (clave, categoria, fuente, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(clave) DO UPDATE SET
+                    categoria = excluded.categoria,
+                    fuente = excluded.fuente,
+                    last_used = excluded.last_used
+            ''', (clave, categoria, fuente, now))
+            if evicted:
+                conn.executemany('DELETE FROM category_cache WHERE clave = ?', [(c,) for c in evicted])
+
+    def _evict(self):
+        """Drop least recently used entries over max_entries (lock must be held)"""
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            clave, _ = self._entries.popitem(last=False)
+            evicted.append(clave)
+        return evicted
+
+    def stats(self) -> Dict:
+        """Hit-rate statistics since process start"""
+        total = self.hits + self.misses
+        usuario = sum(1 for _, fuente in self._entries.values() if fuente == FUENTE_USUARIO)
+        return {
+            'entries': len(self._entries),
+            'user_corrections': usuario,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_category_cache() -> CategoryCache:
+    """Process-wide cache instance"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CategoryCache()
+    return _cache
@@ -1,51 +1,115 @@
 """
 Completed Tasks Database
 Manages local storage of completed tasks to maintain cronograma structure
+
+Completed tasks are kept as a long-term log. Every row carries its ISO week and
+month (indexed) and its labels are normalised into completed_task_labels, so
+per-week and per-label summaries are index lookups. Rows older than
+COMPLETED_TASKS_KEEP_MONTHS are moved to monthly gzip JSON-lines files in
+data/archive/ by the maintenance job, never on the generation path:
+
+    python3.11 completed_tasks_db.py maintenance
+    python3.11 completed_tasks_db.py stats
 """
 
-import sqlite3
+import gzip
+import json
+import os
+import sys
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-import os
 
-# Use current directory for both sandbox and Railway
-DB_PATH = os.path.join(os.getcwd(), 'data', 'completed_tasks.db')
+from sqlite_store import db_path, get_connection, transaction, register_migrations
 
-def init_db():
-    """Initialize the completed tasks database"""
-    # Ensure data directory exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS completed_tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            task_id TEXT NOT NULL,
-            content TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT NOT NULL,
-            priority TEXT,
-            labels TEXT,
-            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            date TEXT NOT NULL
+DB_PATH = db_path('completed_tasks.db')
+
+ARCHIVE_DIR = db_path('archive')
+
+# Months kept in the database before archiving (0 = never archive)
+KEEP_MONTHS = int(os.getenv('COMPLETED_TASKS_KEEP_MONTHS', 24))
+
+
+def _week_of(date: str) -> str:
+    """'2026-10-19' -> '2026-W43' (ISO week)"""
+    year, week, _ = datetime.strptime(date, "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _duration_minutes(start_time: str, end_time: str) -> Optional[int]:
+    """Minutes between two HH:MM times, None if unparseable"""
+    try:
+        start = datetime.strptime(start_time, "%H:%M")
+        end = datetime.strptime(end_time, "%H:%M")
+    except (TypeError, ValueError):
+        return None
+    minutes = int((end - start).total_seconds() // 60)
+    # Tasks ending after midnight
+    return minutes if minutes >= 0 else minutes + 24 * 60
+
+
+def _split_labels(labels_str: Optional[str]) -> List[str]:
+    return [label for label in (labels_str or '').split(',') if label]
+
+
+def _add_analytics_columns(conn):
+    """Week/month buckets, durations and a label table, backfilled from existing rows"""
+    # Databases left half-migrated by an earlier failed run already have some columns
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(completed_tasks)')}
+    for column, kind in (('week', 'TEXT'), ('month', 'TEXT'), ('duration_minutes', 'INTEGER')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE completed_tasks ADD COLUMN {column} {kind}')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS completed_task_labels (
+            completed_id INTEGER NOT NULL REFERENCES completed_tasks(id) ON DELETE CASCADE,
+            label TEXT NOT NULL,
+            PRIMARY KEY (completed_id, label)
         )
     ''')
-    
-    # Create index for faster queries
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_date 
-        ON completed_tasks(date)
-    ''')
-    
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_task_id_date 
-        ON completed_tasks(task_id, date)
-    ''')
-    
-    conn.commit()
-    conn.close()
+
+    rows = conn.execute('SELECT id, date, start_time, end_time, labels FROM completed_tasks').fetchall()
+    conn.executemany(
+        'UPDATE completed_tasks SET week = ?, month = ?, duration_minutes = ? WHERE id = ?',
+        [(_week_of(date), date[:7], _duration_minutes(start, end), row_id)
+         for row_id, date, start, end, _ in rows]
+    )
+    conn.executemany(
+        'INSERT OR IGNORE INTO completed_task_labels (completed_id, label) VALUES (?, ?)',
+        [(row_id, label) for row_id, _, _, _, labels in rows for label in _split_labels(labels)]
+    )
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_week ON completed_tasks(week)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_month ON completed_tasks(month)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_label ON completed_task_labels(label, completed_id)')
+
+
+register_migrations(DB_PATH, [
+    '''
+    CREATE TABLE IF NOT EXISTS completed_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        priority TEXT,
+        labels TEXT,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        date TEXT NOT NULL
+    );
+
+    -- Create index for faster queries
+    CREATE INDEX IF NOT EXISTS idx_date
+    ON completed_tasks(date);
+
+    CREATE INDEX IF NOT EXISTS idx_task_id_date
+    ON completed_tasks(task_id, date);
+    ''',
+    _add_analytics_columns,
+])
+
+def init_db():
+    """Initialize the completed tasks database"""
+    get_connection(DB_PATH)
     print("✅ Completed tasks database initialized")
 
 
@@ -73,30 +137,32 @@ def save_completed_task(
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
     
-    labels_str = ",".join(labels) if labels else ""
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Check if already exists (avoid duplicates)
-    cursor.execute('''
-        SELECT id FROM completed_tasks 
-        WHERE task_id = ? AND date = ?
-    ''', (task_id, date))
-    
-    if cursor.fetchone():
-        print(f"   ⚠️  Task {task_id} already marked as completed for {date}")
-        conn.close()
-        return
+    labels = [label for label in (labels or []) if label]
+    labels_str = ",".join(labels)
     
-    cursor.execute('''
-        INSERT INTO completed_tasks 
-        (task_id, content, start_time, end_time, priority, labels, date)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (task_id, content, start_time, end_time, priority, labels_str, date))
+    with transaction(DB_PATH, immediate=True) as conn:
+        # Check if already exists (avoid duplicates)
+        existing = conn.execute('''
+            SELECT id FROM completed_tasks 
+            WHERE task_id = ? AND date = ?
+        ''', (task_id, date)).fetchone()
+        
+        if existing:
+            print(f"   ⚠️  Task {task_id} already marked as completed for {date}")
+            return
+        
+        completed_id = conn.execute('''
+            INSERT INTO completed_tasks 
+            (task_id, content, start_time, end_time, priority, labels, date, week, month, duration_minutes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (task_id, content, start_time, end_time, priority, labels_str, date,
+              _week_of(date), date[:7], _duration_minutes(start_time, end_time))).lastrowid
+        
+        conn.executemany('''
+            INSERT OR IGNORE INTO completed_task_labels (completed_id, label)
+            VALUES (?, ?)
+        ''', [(completed_id, label) for label in labels])
     
-    conn.commit()
-    conn.close()
     print(f"   ✅ Saved completed task: {content} ({start_time}-{end_time})")
 
 
@@ -113,18 +179,13 @@ def get_completed_tasks_for_date(date: Optional[str] = None) -> List[Dict]:
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    conn = get_connection(DB_PATH)
+    rows = conn.execute('''
         SELECT task_id, content, start_time, end_time, priority, labels, completed_at
         FROM completed_tasks
         WHERE date = ?
         ORDER BY start_time
-    ''', (date,))
-    
-    rows = cursor.fetchall()
-    conn.close()
+    ''', (date,)).fetchall()
     
     completed_tasks = []
     for row in rows:
@@ -143,30 +204,167 @@ def get_completed_tasks_for_date(date: Optional[str] = None) -> List[Dict]:
     return completed_tasks
 
 
-def cleanup_old_tasks(days_to_keep: int = 7):
+def get_weekly_summary(weeks: int = 12) -> List[Dict]:
+    """
+    Completed tasks per ISO week
+    
+    Args:
+        weeks: Number of weeks back from the current one
+    
+    Returns:
+        List of {'week', 'tasks', 'minutes'}, oldest first
+    """
+    since = _week_of((datetime.now() - timedelta(weeks=weeks - 1)).strftime("%Y-%m-%d"))
+    
+    conn = get_connection(DB_PATH)
+    rows = conn.execute('''
+        SELECT week, COUNT(*), COALESCE(SUM(duration_minutes), 0)
+        FROM completed_tasks
+        WHERE week >= ?
+        GROUP BY week
+        ORDER BY week
+    ''', (since,)).fetchall()
+    
+    return [{'week': week, 'tasks': tasks, 'minutes': minutes} for week, tasks, minutes in rows]
+
+
+def get_label_summary(since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+    """
+    Completed tasks per label
+    
+    Args:
+        since: First date included (YYYY-MM-DD, defaults to 30 days ago)
+        until: Last date included (YYYY-MM-DD, defaults to today)
+    
+    Returns:
+        List of {'label', 'tasks', 'minutes'}, most frequent first
+    """
+    if since is None:
+        since = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    if until is None:
+        until = datetime.now().strftime("%Y-%m-%d")
+    
+    conn = get_connection(DB_PATH)
+    rows = conn.execute('''
+        SELECT l.label, COUNT(*), COALESCE(SUM(t.duration_minutes), 0)
+        FROM completed_task_labels l
+        JOIN completed_tasks t ON t.id = l.completed_id
+        WHERE t.date BETWEEN ? AND ?
+        GROUP BY l.label
+        ORDER BY COUNT(*) DESC, l.label
+    ''', (since, until)).fetchall()
+    
+    return [{'label': label, 'tasks': tasks, 'minutes': minutes} for label, tasks, minutes in rows]
+
+
+def _archived_ids(path: str) -> set:
+    """Database ids already in an archive file"""
+    if not os.path.exists(path):
+        return set()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return {json.loads(line).get('id') for line in f if line.strip()}
+
+
+def archive_old_tasks(keep_months: int = KEEP_MONTHS) -> int:
     """
-    Remove completed tasks older than specified days
+    Move completed tasks older than keep_months to monthly archive files
+    
+    Each month goes to ARCHIVE_DIR/completed_tasks-YYYY-MM.jsonl.gz (appended if it
+    already exists) and is deleted from the database only after the file is written.
+    Rows carry their database id, so a run whose delete failed after the file was
+    written does not archive the same rows twice.
     
     Args:
-        days_to_keep: Number of days to keep (default 7)
+        keep_months: Full months kept besides the current one (0 = keep everything)
+    
+    Returns:
+        Number of archived tasks
     """
-    cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).strftime("%Y-%m-%d")
+    if keep_months <= 0:
+        return 0
+    
+    today = datetime.now()
+    year, month = divmod(today.year * 12 + today.month - 1 - keep_months, 12)
+    cutoff_month = f"{year:04d}-{month + 1:02d}"
+    
+    conn = get_connection(DB_PATH)
+    months = [row[0] for row in conn.execute('''
+        SELECT DISTINCT month FROM completed_tasks
+        WHERE month < ?
+        ORDER BY month
+    ''', (cutoff_month,))]
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    archived = 0
+    for archive_month in months:
+        with transaction(DB_PATH, immediate=True) as conn:
+            rows = conn.execute('''
+                SELECT id, task_id, content, start_time, end_time, priority, labels,
+                       completed_at, date, week, duration_minutes
+                FROM completed_tasks
+                WHERE month = ?
+                ORDER BY date, start_time
+            ''', (archive_month,)).fetchall()
+            
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            path = os.path.join(ARCHIVE_DIR, f"completed_tasks-{archive_month}.jsonl.gz")
+            already_archived = _archived_ids(path)
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for row in rows:
+                    if row[0] in already_archived:
+                        continue
+                    f.write(json.dumps({
+                        'id': row[0],
+                        'task_id': row[1],
+                        'content': row[2],
+                        'start_time': row[3],
+                        'end_time': row[4],
+                        'priority': row[5],
+                        'labels': _split_labels(row[6]),
+                        'completed_at': row[7],
+                        'date': row[8],
+                        'week': row[9],
+                        'duration_minutes': row[10]
+                    }, ensure_ascii=False) + '\n')
+            
+            ids = [(row[0],) for row in rows]
+            conn.executemany('DELETE FROM completed_task_labels WHERE completed_id = ?', ids)
+            conn.executemany('DELETE FROM completed_tasks WHERE id = ?', ids)
+        
+        archived += len(rows)
+        print(f"   📦 Archived {len(rows)} completed tasks from {archive_month} -> {path}")
     
-    cursor.execute('''
-        DELETE FROM completed_tasks
-        WHERE date < ?
-    ''', (cutoff_date,))
+    return archived
+
+
+def run_maintenance(keep_months: int = KEEP_MONTHS) -> Dict:
+    """Scheduled job: archive old months and compact the database"""
+    archived = archive_old_tasks(keep_months)
     
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    conn = get_connection(DB_PATH)
+    conn.execute('PRAGMA optimize')
+    if archived:
+        conn.execute('VACUUM')
     
-    if deleted_count > 0:
-        print(f"   🗑️  Cleaned up {deleted_count} old completed tasks (older than {cutoff_date})")
+    remaining = conn.execute('SELECT COUNT(*) FROM completed_tasks').fetchone()[0]
+    print(f"✅ Completed tasks maintenance done: {archived} archived, {remaining} kept")
+    return {'archived': archived, 'remaining': remaining}
 
 
 # Initialize database on import
 init_db()
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    
+    if command == 'maintenance':
+        run_maintenance()
+    elif command == 'stats':
+        print("\n📊 Completed tasks per week:")
+        for row in get_weekly_summary():
+            print(f"   {row['week']}: {row['tasks']} tasks, {row['minutes']} min")
+        print("\n🏷️  Completed tasks per label (last 30 days):")
+        for row in get_label_summary():
+            print(f"   {row['label']}: {row['tasks']} tasks, {row['minutes']} min")
+    else:
+        print("Usage: python3.11 completed_tasks_db.py [maintenance|stats]")
+        sys.exit(1)
@@ -8,7 +8,8 @@ Features:
 - Morning rule: NO two physical tasks in a row. Must be 1 intellectual + 1 physical, or 2 intellectual + 1 physical
 - Priority order: P1 → P2 → P3 → P4
 - Administrative + morning tasks at end of morning block
-- Multi-pass scheduling to eliminate unassigned tasks and gaps
+- Multi-pass scheduling to eliminate unassigned tasks and gaps: first-fit, then a
+  branch-and-bound optimiser with a time budget (see schedule_engine.py)
 '''
 
 from todoist_client import TodoistClient
@@ -16,7 +17,11 @@ from calendar_client import iCloudCalendarClient
 from ics_exporter import ICSExporter
 from event_detector import detect_new_events_in_shared_calendar
 from events_db import get_new_events
+from cronograma_html import render_schedule_rows, get_emoji_for_task
+from schedule_engine import build_schedule, consolidate_schedule, FIXED_CONTENTS
+from run_trace import RunTrace
 from datetime import datetime, timedelta
+import atexit
 import json
 import os
 import sys
@@ -42,24 +47,33 @@ else:
     print(f"🕒 Generando cronograma para HOY: {target_date.strftime('%d/%m/%Y')}")
 print("="*80)
 
+# Per-stage timings, upstream calls and item counts (see run_trace.py, /debug/last-run)
+trace = RunTrace('cronograma_v7_5', target_date=target_date.strftime("%Y-%m-%d"), tomorrow=generate_for_tomorrow)
+atexit.register(trace.finish_at_exit)
+
 # Detect new events in shared calendar
 print("\n1️⃣ Detecting new events in shared calendar...")
+trace.stage('detect_events')
 new_events_detected = detect_new_events_in_shared_calendar("Casa Juana Doña", days_ahead=30)
 print(f"✅ Detected {len(new_events_detected)} new events")
 
 # Get pending new events from database
 new_events_pending = get_new_events()
 print(f"📋 Pending new events for review: {len(new_events_pending)}")
+trace.set(new=len(new_events_detected), pending=len(new_events_pending))
 
 # Get calendar events from PERSONAL calendar (highest priority)
 print("\n2️⃣ Fetching events from YOUR personal calendar...")
+trace.stage('calendar_events')
 # iCloud credentials are loaded from environment variables
 calendar_client = iCloudCalendarClient()
 calendar_events = calendar_client.get_today_events(target_date=target_date)
 print(f"✅ Found {len(calendar_events)} calendar events in your personal calendar")
+trace.set(events=len(calendar_events))
 
 # Get ALL active tasks from Todoist and filter by target date
 print("\n3️⃣ Fetching active tasks from Todoist...")
+trace.stage('todoist')
 todoist_client = TodoistClient(config.todoist_api_token)
 all_tasks = todoist_client.get_all_active_tasks()
 formatted_tasks = todoist_client.format_tasks_for_display(all_tasks)
@@ -80,17 +94,18 @@ for task in formatted_tasks:
 
 formatted_tasks = filtered_tasks
 print(f"✅ Found {len(formatted_tasks)} tasks for {target_date_str} (filtered from {len(all_tasks)} total)")
+trace.set(tasks=len(formatted_tasks), active=len(all_tasks))
 
 # Load completed tasks from local database
 print("\n   📋 Loading completed tasks from local database...")
-from completed_tasks_db import get_completed_tasks_for_date, cleanup_old_tasks
-
-# Clean up old completed tasks (older than 7 days)
-cleanup_old_tasks(days_to_keep=7)
+trace.stage('completed_tasks')
+from completed_tasks_db import get_completed_tasks_for_date
 
+# History is kept long-term; archiving runs as a scheduled job (completed_tasks_db.py maintenance)
 # Get completed tasks for today
 completed_tasks = get_completed_tasks_for_date(target_date_str)
 print(f"   ✅ Found {len(completed_tasks)} completed tasks for {target_date_str}")
+trace.set(completed=len(completed_tasks))
 
 if completed_tasks:
     for task in completed_tasks:
@@ -98,362 +113,37 @@ if completed_tasks:
 
 # Note: completed_tasks will be used later when generating the HTML schedule
 
-# --- Helper Functions ---
-time_labels = ["5min", "5 minutos", "10min", "10 minutos", "15min", "15 minutos",
-               "20min", "20 minutos", "30min", "30 minutos", "1h", "1 hora", "2h", "2 horas"]
-
-def has_label(task, label):
-    return label in task.get("labels", [])
-
-def has_checks_label(task):
-    """Check if task has any variant of the 'checks' label"""
-    labels = task.get("labels", [])
-    # Convert all labels to lowercase for case-insensitive comparison
-    labels_lower = [l.lower() for l in labels]
-    checks_variants = ["checks", "check", "cheks", "chek"]
-    return any(variant in labels_lower for variant in checks_variants)
-
-def get_duration_minutes(task):
-    labels = task.get("labels", [])
-    for label in labels:
-        if label in ["5min", "5 minutos"]: return 5
-        if label in ["10min", "10 minutos"]: return 10
-        if label in ["15min", "15 minutos"]: return 15
-        if label in ["20min", "20 minutos"]: return 20
-        if label in ["30min", "30 minutos"]: return 30
-        if label in ["1h", "1 hora"]: return 60
-        if label in ["2h", "2 horas"]: return 120
-    
-    # Default duration: 5 min for checks tasks, 20 min for others
-    if has_checks_label(task):
-        return 5
-    return 20
-
-def get_task_type_from_labels(task):
-    labels = task.get("labels", [])
-    if "fisico" in labels: return "Física"
-    if "administrativo" in labels: return "Administrativa"
-    if "intelectual" in labels: return "Intelectual"
-    return "General" # Default type
-
-def get_priority_value(task):
-    """Get numeric priority value for sorting (lower is higher priority)"""
-    priority = task.get("priority_value", 1)  # Use priority_value from formatted tasks
-    if isinstance(priority, str):
-        return {"P1": 1, "P2": 2, "P3": 3, "P4": 4}.get(priority, 4)
-    # Todoist uses 4=urgent, 3=high, 2=medium, 1=low
-    # We need to sort by this value (higher number = higher priority)
-    # So we return negative to sort correctly
-    return 5 - priority  # Convert: 4→1, 3→2, 2→3, 1→4
-
-def sort_by_priority(tasks):
-    return sorted(tasks, key=lambda t: (get_priority_value(t), get_duration_minutes(t), t.get("due_date") or "9999-99-99"))
-
-# --- Task Categorization ---
+# --- Task Categorization and Cronograma Generation ---
 
 print("\n4️⃣ Categorizing and sorting tasks...")
+trace.stage('schedule')
 
-# Add type and duration to each task dictionary for easier access
-for task in formatted_tasks:
-    task["duration"] = get_duration_minutes(task)
-    task["type"] = get_task_type_from_labels(task)
-
-# Separate tasks into dedicated lists based on rules
-# PRIORITY 1: Checks tasks - these ALWAYS go to rutina administrativa, regardless of other labels
-cheks_tasks = sort_by_priority([t for t in formatted_tasks if has_checks_label(t)])
-print(f"   🔍 Found {len(cheks_tasks)} tasks with checks labels")
-if cheks_tasks:
-    for task in cheks_tasks:
-        print(f"      - {task['content']} (labels: {task.get('labels', [])})")
-
-# PRIORITY 2: Other time-specific tasks (excluding those already in checks)
-rutina_tasks = sort_by_priority([t for t in formatted_tasks 
-                                 if has_label(t, "rutina administrativa matinal") 
-                                 and not has_checks_label(t)])
-manana_tasks = sort_by_priority([t for t in formatted_tasks 
-                                 if has_label(t, "por la mañana") 
-                                 and not has_checks_label(t)])
-tarde_tasks = sort_by_priority([t for t in formatted_tasks 
-                               if has_label(t, "por la tarde") 
-                               and not has_checks_label(t)])
-noche_tasks = sort_by_priority([t for t in formatted_tasks 
-                               if has_label(t, "por la noche") 
-                               and not has_checks_label(t)])
-
-# Flexible tasks are those not in any specific time block and not checks
-time_restricted_base = {"rutina administrativa matinal", "por la mañana", "por la tarde", "por la noche"}
-flexible_tasks = sort_by_priority([t for t in formatted_tasks 
-                                   if not set(t.get("labels", [])).intersection(time_restricted_base) 
-                                   and not has_checks_label(t)])
-
-# --- Cronograma Generation ---
-
-print("\n5️⃣ Generating cronograma with Morning Alternation Rule...")
-
-# Pass 1: Build the schedule with all tasks
-schedule = {}
-for i in range(840): # 14 hours * 60 minutes
-    schedule[i] = None
-
-def add_task_to_schedule_at(task, start_minute):
-    """Add a task at a specific minute, skipping calendar events"""
-    duration = task["duration"]
-    for i in range(start_minute, start_minute + duration):
-        # Don't overwrite calendar events (they have 'content' starting with emoji)
-        if schedule[i] is None or (isinstance(schedule[i], dict) and not schedule[i].get('content', '').startswith('📅')):
-            schedule[i] = task
-    return start_minute + duration
-
-# Fixed blocks - Calendar events have HIGHEST priority
-print("   Adding calendar events as fixed blocks...")
-for event in calendar_events:
-    # Convert time to minutes from 07:00
-    start_hour, start_min = map(int, event['start_time'].split(':'))
-    start_minute = (start_hour - 7) * 60 + start_min
-    
-    # Only add if within our schedule range (07:00-21:00)
-    if 0 <= start_minute < 840:
-        duration = event['duration']
-        for i in range(start_minute, min(start_minute + duration, 840)):
-            schedule[i] = event
-        print(f"      ✅ {event['start_time']}-{event['end_time']}: {event['content']}")
-
-# Fixed blocks - Desayunar and Comer
-for i in range(20): schedule[i] = {"content": "Desayunar", "type": "Fija", "priority": "P-", "duration": 20, "url": "", "labels": []}
-for i in range(420, 480): schedule[i] = {"content": "Comer", "type": "Fija", "priority": "P-", "duration": 60, "url": "", "labels": []}
-
-# NEW: Schedule tasks with specific due_time first (like calendar events)
-print("\n   Scheduling tasks with specific due_time...")
-tasks_with_time = [t for t in formatted_tasks if t.get('due_time')]
-tasks_without_time = [t for t in formatted_tasks if not t.get('due_time')]
-
-for task in tasks_with_time:
-    due_time = task['due_time']
-    try:
-        # Convert due_time to minutes from 07:00
-        hour, minute = map(int, due_time.split(':'))
-        start_minute = (hour - 7) * 60 + minute
-        
-        # Only schedule if within range (07:00-21:00)
-        if 0 <= start_minute < 840:
-            duration = task['duration']
-            
-            # Check if the time slot is available
-            slot_available = all(schedule[i] is None for i in range(start_minute, min(start_minute + duration, 840)))
-            
-            if slot_available:
-                # Schedule at the specific time
-                for i in range(start_minute, min(start_minute + duration, 840)):
-                    schedule[i] = task
-                print(f"      ✅ {due_time}: {task['content']} (horario fijo)")
-            else:
-                # Conflict detected, will be scheduled sequentially later
-                print(f"      ⚠️ {due_time}: {task['content']} (conflicto, se programará secuencialmente)")
-                # Add back to the list for sequential scheduling
-                tasks_without_time.append(task)
-        else:
-            print(f"      ⚠️ {due_time}: {task['content']} (fuera de rango 07:00-21:00)")
-            tasks_without_time.append(task)
-    except Exception as e:
-        print(f"      ❌ Error procesando {task['content']}: {e}")
-        tasks_without_time.append(task)
-
-# Update task lists to only include tasks without time (or those that couldn't be scheduled)
-rutina_tasks = [t for t in rutina_tasks if t in tasks_without_time]
-cheks_tasks = [t for t in cheks_tasks if t in tasks_without_time]
-manana_tasks = [t for t in manana_tasks if t in tasks_without_time]
-tarde_tasks = [t for t in tarde_tasks if t in tasks_without_time]
-noche_tasks = [t for t in noche_tasks if t in tasks_without_time]
-
-# Sequential blocks
-current_minute = 20
-for task in rutina_tasks:
-    current_minute = add_task_to_schedule_at(task, current_minute)
-for task in cheks_tasks:
-    current_minute = add_task_to_schedule_at(task, current_minute)
-
-# Morning tasks with special alternation rule
-# Rule: NO two physical tasks in a row. Must be 1 intellectual + 1 physical, or 2 intellectual + 1 physical
-print("\n   Applying morning alternation rule...")
-
-# Separate morning tasks by type
-morning_fisica = [t for t in manana_tasks if t["type"] == "Física"]
-morning_intelectual = [t for t in manana_tasks if t["type"] == "Intelectual"]
-morning_other = [t for t in manana_tasks if t["type"] not in ["Física", "Intelectual"]]
-
-# Build morning schedule with strict alternation
-# Strategy: Distribute physical tasks evenly, always separated by 1-2 intellectual tasks
-morning_schedule = []
-fisica_idx = 0
-intelectual_idx = 0
-
-num_fisica = len(morning_fisica)
-num_intelectual = len(morning_intelectual)
-
-# Calculate how many intellectual tasks should go between each physical task
-if num_fisica > 0:
-    intelectual_per_fisica = num_intelectual // num_fisica
-    extra_intelectual = num_intelectual % num_fisica
-else:
-    intelectual_per_fisica = 0
-    extra_intelectual = num_intelectual
-
-print(f"   Distribution: {num_intelectual} intelectual / {num_fisica} física = {intelectual_per_fisica} per física + {extra_intelectual} extra")
-
-# Interleave tasks
-while fisica_idx < num_fisica:
-    # Add 1 or 2 intellectual tasks before each physical
-    tasks_to_add = max(1, min(2, intelectual_per_fisica))
-    
-    for _ in range(tasks_to_add):
-        if intelectual_idx < num_intelectual:
-            morning_schedule.append(morning_intelectual[intelectual_idx])
-            intelectual_idx += 1
-    
-    # Add one physical task
-    morning_schedule.append(morning_fisica[fisica_idx])
-    fisica_idx += 1
-
-# Add any remaining intellectual tasks at the end
-while intelectual_idx < num_intelectual:
-    morning_schedule.append(morning_intelectual[intelectual_idx])
-    intelectual_idx += 1
-
-print(f"   Morning schedule: {len(morning_schedule)} tasks")
-print(f"   Sequence: {' → '.join([t['type'] for t in morning_schedule])}")
-
-# Place morning tasks sequentially in the morning block
-morning_start = current_minute
-for task in morning_schedule:
-    duration = task["duration"]
-    if current_minute + duration <= 420: # Ensure it fits before lunch
-        current_minute = add_task_to_schedule_at(task, current_minute)
-    else:
-        print(f"   ⚠️ Task '{task['content']}' doesn't fit in morning block")
-
-# Place other morning tasks (General, Administrativa) in remaining morning slots
-for task in morning_other:
-    duration = task["duration"]
-    placed = False
-    for i in range(morning_start, 420 - duration + 1):
-        if all(schedule[j] is None for j in range(i, i + duration)):
-            add_task_to_schedule_at(task, i)
-            placed = True
-            break
-    if not placed:
-        print(f"   ⚠️ Could not place morning task: {task['content']}")
-
-# Afternoon tasks
-for task in tarde_tasks:
-    duration = task["duration"]
-    placed = False
-    for i in range(480, 780 - duration + 1):
-        if all(schedule[j] is None for j in range(i, i + duration)):
-            add_task_to_schedule_at(task, i)
-            placed = True
-            break
-
-# Night tasks
-for task in noche_tasks:
-    duration = task["duration"]
-    placed = False
-    for i in range(780, 840 - duration + 1):
-        if all(schedule[j] is None for j in range(i, i + duration)):
-            add_task_to_schedule_at(task, i)
-            placed = True
-            break
-
-# Flexible tasks
-for task in flexible_tasks:
-    duration = task["duration"]
-    placed = False
-    for i in range(840 - duration + 1):
-        if all(schedule[j] is None for j in range(i, i + duration)):
-            add_task_to_schedule_at(task, i)
-            placed = True
-            break
-
-# Insert completed tasks into schedule
-print("\n   📋 Inserting completed tasks into schedule...")
-for completed_task in completed_tasks:
-    try:
-        # Parse start and end times
-        start_hour, start_min = map(int, completed_task['start_time'].split(':'))
-        end_hour, end_min = map(int, completed_task['end_time'].split(':'))
-        
-        # Convert to minutes from 07:00
-        start_minute = (start_hour - 7) * 60 + start_min
-        end_minute = (end_hour - 7) * 60 + end_min
-        
-        # Only insert if within schedule range
-        if 0 <= start_minute < 840 and 0 <= end_minute <= 840:
-            # Insert completed task into schedule
-            for i in range(start_minute, end_minute):
-                schedule[i] = {
-                    'id': completed_task['id'],
-                    'content': completed_task['content'],
-                    'priority_value': 1,  # Default
-                    'labels': completed_task['labels'],
-                    'url': '',
-                    'completed': True,  # Mark as completed
-                    'duration': end_minute - start_minute
-                }
-            print(f"      ✅ Inserted: {completed_task['start_time']}-{completed_task['end_time']}: {completed_task['content']}")
-    except Exception as e:
-        print(f"      ❌ Error inserting completed task: {e}")
+# Fixed blocks, V7.5 first-fit rules and the optimising pass live in schedule_engine
+schedule, schedule_report = build_schedule(formatted_tasks, calendar_events, completed_tasks)
 
 # Pass 2: Consolidate schedule into a list of events
-final_cronograma = []
-i = 0
-while i < 840:
-    start_minute = i
-    task = schedule[i]
-
-    # Group consecutive identical tasks or free slots
-    while i < 840 and schedule[i] == task:
-        i += 1
-    
-    end_minute = i
-    duration = end_minute - start_minute
-
-    start_time = (datetime.strptime("07:00", "%H:%M") + timedelta(minutes=start_minute)).strftime("%H:%M")
-    end_time = (datetime.strptime("07:00", "%H:%M") + timedelta(minutes=end_minute)).strftime("%H:%M")
-
-    if task is None:
-        # This is a free block
-        final_cronograma.append({
-            "content": "Tiempo libre",
-            "type": "General",
-            "priority": "P4",
-            "duration": duration,
-            "url": "",
-            "labels": [],
-            "start_time": start_time,
-            "end_time": end_time
-        })
-    else:
-        # This is a scheduled task
-        task_details = dict(task)
-        task_details["start_time"] = start_time
-        task_details["end_time"] = end_time
-        # Overwrite duration to the actual consolidated block duration
-        task_details["duration"] = duration 
-        # Convert Todoist priority to P1-P4 display format
-        # Todoist: 4=urgent, 3=high, 2=medium, 1=low
-        # Display: P1=urgent, P2=high, P3=medium, P4=low
-        todoist_priority = task.get("priority_value", 1)
-        display_priority = 5 - todoist_priority  # Convert: 4→P1, 3→P2, 2→P3, 1→P4
-        task_details["priority"] = f"P{display_priority}"
-        final_cronograma.append(task_details)
+final_cronograma = consolidate_schedule(schedule)
+trace.set(blocks=len(final_cronograma))
+
+# Keep the plan with its inputs for what-if previews (/cronograma/simular)
+trace.stage('save_plan')
+try:
+    from schedules_db import save_day_schedule
+    save_day_schedule(target_date_str, formatted_tasks, calendar_events, completed_tasks,
+                      final_cronograma, schedule_report)
+except Exception as e:
+    print(f"   ⚠️  Could not store the day plan: {e}")
+    trace.error_in_stage(e)
 
 # --- Identify Unassigned Tasks ---
 
 print("\n5️⃣ Identifying unassigned tasks...")
+trace.stage('unassigned')
 
 # Collect all tasks that were scheduled
 scheduled_task_ids = set()
-for minute, task in schedule.items():
-    if task and isinstance(task, dict) and task.get("content") not in ["Desayunar", "Comer", "Tiempo libre"]:
+for task in schedule.scheduled_entries():
+    if task.get("content") not in FIXED_CONTENTS:
         task_id = task.get("id") or task.get("content")
         if task_id:
             scheduled_task_ids.add(task_id)
@@ -499,112 +189,29 @@ for task in all_tasks:  # Use all_tasks from Todoist API (before filtering)
 # Sort by date
 tasks_with_date.sort(key=lambda t: t["due_date"])
 print(f"   Tasks with FUTURE date (not recurring, not scheduled): {len(tasks_with_date)}")
+trace.set(unassigned=len(unassigned_tasks), future=len(tasks_with_date))
 
 # --- Generate HTML ---
 
 print("\n6️⃣ Generating final HTML...")
 
-def get_time_block_color(start_time):
-    """Determine time block and return background color based on start time"""
-    hour = int(start_time.split(':')[0])
-    minute = int(start_time.split(':')[1])
-    time_minutes = hour * 60 + minute
-    
-    # Define time blocks (in minutes from midnight)
-    desayuno_start = 7 * 60  # 07:00
-    desayuno_end = 7 * 60 + 20  # 07:20
-    
-    rutina_admin_start = 7 * 60 + 20  # 07:20
-    rutina_admin_end = 9 * 60 + 40  # 09:40
-    
-    manana_start = 9 * 60 + 40  # 09:40
-    manana_end = 14 * 60  # 14:00
-    
-    comida_start = 14 * 60  # 14:00
-    comida_end = 15 * 60  # 15:00
-    
-    tarde_start = 15 * 60  # 15:00
-    tarde_end = 20 * 60  # 20:00
-    
-    noche_start = 20 * 60  # 20:00
-    noche_end = 21 * 60  # 21:00
-    
-    # Assign colors based on time block
-    if desayuno_start <= time_minutes < desayuno_end:
-        return '#fffaf5', 'Desayuno'  # Very light peach
-    elif rutina_admin_start <= time_minutes < rutina_admin_end:
-        return '#f0f7ff', 'Rutina administrativa matinal'  # Very light blue
-    elif manana_start <= time_minutes < manana_end:
-        return '#f8fcf5', 'Por la mañana'  # Very light green
-    elif comida_start <= time_minutes < comida_end:
-        return '#fffef0', 'Comida'  # Very light yellow
-    elif tarde_start <= time_minutes < tarde_end:
-        return '#fef8fa', 'Por la tarde'  # Very light pink
-    elif noche_start <= time_minutes < noche_end:
-        return '#f8f7fc', 'Noche'  # Very light purple
-    else:
-        return '#ffffff', 'Otro'  # White for any other time
-
-def get_emoji_for_task(content, task_type):
-    """Select appropriate emoji based on task content and type"""
-    content_lower = content.lower()
-    
-    # Check content keywords first
-    if any(word in content_lower for word in ['desayun', 'comer', 'cenar', 'comida']):
-        return '🍽️'
-    if any(word in content_lower for word in ['agua', 'beber', 'hidrat']):
-        return '💧'
-    if any(word in content_lower for word in ['email', 'correo', 'gmail']):
-        return '📧'
-    if any(word in content_lower for word in ['leer', 'lectura', 'libro', 'padre rico']):
-        return '📚'
-    if any(word in content_lower for word in ['tradear', 'trading', 'replay', 'tesla', 'nvidia', 'analisis']):
-        return '📈'
-    if any(word in content_lower for word in ['fondos', 'fondear', 'dinero', 'pago', 'interbroker']):
-        return '💰'
-    if any(word in content_lower for word in ['espalda', 'hombro', 'pecho', 'ejercicio', 'físico']):
-        return '💪'
-    if any(word in content_lower for word in ['bateria', 'música', 'instrumento']):
-        return '🥁'
-    if any(word in content_lower for word in ['gracias', 'dios', 'mantra', 'recordatorio']):
-        return '🙏'
-    if any(word in content_lower for word in ['control', 'gastos', 'presupuesto']):
-        return '💳'
-    if any(word in content_lower for word in ['visita', 'idealista', 'garage', 'plaza']):
-        return '🏠'
-    if any(word in content_lower for word in ['checks', 'check', 'revisar']):
-        return '✅'
-    if any(word in content_lower for word in ['constructor', 'contacto', 'llamar']):
-        return '📞'
-    if any(word in content_lower for word in ['libre', 'descanso']):
-        return '⏸️'
-    
-    # Fallback to task type
-    if task_type == 'Física':
-        return '💪'
-    elif task_type == 'Intelectual':
-        return '🧠'
-    elif task_type == 'Administrativa':
-        return '📋'
-    elif task_type == 'Fija':
-        return '📌'
-    else:
-        return '📝'
-
 # Load Idealista data
 idealista_section = ''
 firefly_section = ''
 
+trace.stage('idealista')
 try:
-    from idealista_postgres import get_idealista_comparison
+    from idealista_postgres import get_idealista_data
     
+    # Changes against the previous scrape are computed once, when /update-idealista stores it
     print("🔍 Cargando datos de Idealista con comparación")
-    current_data, previous_data = get_idealista_comparison()
+    current_data = get_idealista_data()
     
     if current_data and current_data.get('properties'):
         properties_html = ''
         current_props = {p.get('propertyId'): p for p in current_data.get('properties', [])}
-        previous_props = {p.get('propertyId'): p for p in previous_data.get('properties', [])} if previous_data else {}
+        current_date = current_data.get('timestamp_madrid') or current_data.get('timestamp', 'Hoy')
+        prev_date = current_data.get('previous_timestamp') or 'Anterior'
         
         for prop_id, current_prop in current_props.items():
             prop_name = current_prop.get('propertyName', f'Propiedad {prop_id}')
@@ -613,20 +220,27 @@ try:
             current_visitas = current_prop.get('visitas', 0)
             current_favoritos = current_prop.get('favoritos', 0)
             current_mensajes = current_prop.get('mensajes', 0)
-            current_date = current_data.get('timestamp', 'Hoy')
+            
+            changes = current_prop.get('changes') or {}
+            previous = current_prop.get('previous')
+            if 'previous' not in current_prop and changes:
+                # Snapshot stored before previous values were kept: previous = current - change
+                previous = {
+                    'visitas': current_visitas - changes.get('visitas', 0),
+                    'favoritos': current_favoritos - changes.get('favoritos', 0),
+                    'mensajes': current_mensajes - changes.get('mensajes', 0)
+                }
             
             # Previous values and comparison
-            if prop_id in previous_props:
-                prev_prop = previous_props[prop_id]
-                prev_visitas = prev_prop.get('visitas', 0)
-                prev_favoritos = prev_prop.get('favoritos', 0)
-                prev_mensajes = prev_prop.get('mensajes', 0)
-                prev_date = previous_data.get('timestamp', 'Anterior')
+            if previous:
+                prev_visitas = previous.get('visitas', 0)
+                prev_favoritos = previous.get('favoritos', 0)
+                prev_mensajes = previous.get('mensajes', 0)
                 
-                # Calculate differences
-                diff_visitas = current_visitas - prev_visitas
-                diff_favoritos = current_favoritos - prev_favoritos
-                diff_mensajes = current_mensajes - prev_mensajes
+                # Differences stored at ingest
+                diff_visitas = changes.get('visitas', current_visitas - prev_visitas)
+                diff_favoritos = changes.get('favoritos', current_favoritos - prev_favoritos)
+                diff_mensajes = changes.get('mensajes', current_mensajes - prev_mensajes)
                 
                 # Calculate percentages
                 pct_visitas = (diff_visitas / prev_visitas * 100) if prev_visitas > 0 else 0
@@ -693,8 +307,10 @@ try:
 </div>
 '''
         print(f"✅ Sección de Idealista con comparación generada correctamente")
+        trace.set(properties=len(current_props))
 except Exception as e:
     print(f"⚠️ Error loading Idealista data: {e}")
+    trace.error_in_stage(e)
     idealista_section = f'''
 <div class="card" style="background: #fff3cd; border-left: 5px solid #ffc107;">
     <div class="section-title">⚠️ DEBUG: Error cargando Idealista</div>
@@ -705,6 +321,7 @@ except Exception as e:
 '''
 
 # Load Firefly III data
+trace.stage('firefly')
 try:
     from firefly_client import FireflyClient
     from datetime import datetime
@@ -900,6 +517,7 @@ function toggleExtraordinaryDetail() {{
 '''
 except Exception as e:
     print(f"⚠️ Error loading Firefly data: {e}")
+    trace.error_in_stage(e)
     import traceback
     traceback.print_exc()
     import os
@@ -908,6 +526,8 @@ except Exception as e:
     print(f"DEBUG: FIREFLY_TOKEN length = {len(os.getenv('FIREFLY_TOKEN', ''))}")
     firefly_section = ''
 
+trace.stage('render_html')
+
 # Generate new events section HTML FIRST
 if new_events_pending:
     new_events_html = '''
@@ -1057,99 +677,7 @@ function showSuccessMessage(message) {
 else:
     new_events_section = ''
 
-html_rows = ""
-for task in final_cronograma:
-    priority = task.get("priority", "P4")
-    priority_class = f"priority-{priority.lower()}"
-    task_type = task.get("type", "General")
-    type_class = f"type-{task_type.replace(' ', '-')}"
-    duration = task.get("duration", 1)
-    
-    # Map duration to height class
-    if duration <= 5:
-        height_class = "h-5"
-    elif duration <= 10:
-        height_class = "h-10"
-    elif duration <= 15:
-        height_class = "h-15"
-    elif duration <= 20:
-        height_class = "h-20"
-    elif duration <= 30:
-        height_class = "h-30"
-    else:
-        height_class = "h-60"
-    
-    # Get emoji for task
-    content = task.get("content", "")
-    emoji = get_emoji_for_task(content, task_type)
-    
-    # Truncate long titles and add tooltip
-    if len(content) > 50:
-        truncated_content = content[:47] + "..."
-        content_escaped = content.replace('"', '&quot;').replace("'", '&#39;')
-        content_html = f'{emoji} <span class="truncate" data-full-text="{content_escaped}">{truncated_content}</span>'
-    else:
-        content_html = f'{emoji} {content}'
-    
-    # Add link to Todoist if task has ID, or custom URL if provided
-    task_id = task.get("id")
-    if task.get("url"):
-        url = task["url"]
-        content_html = f'<a href="{url}" target="_blank">{content_html}</a>'
-    elif task_id:
-        # Generate Todoist URL from task ID
-        todoist_url = f"https://todoist.com/app/task/{task_id}"
-        content_html = f'<a href="{todoist_url}" target="_blank" style="color: #64748b; text-decoration: none;">{content_html}</a>'
-    
-    # Generate labels HTML
-    labels = task.get("labels", [])
-    labels_html = ''.join(f'<span class="label">{l}</span>' for l in labels)
-    labels_container = f'<div class="labels-container">{labels_html}</div>' if labels_html else ''
-    
-    # Get time block color
-    time_color, time_block_name = get_time_block_color(task["start_time"])
-    
-    # Format time range with different sizes - wrapped in badge
-    time_range_html = f'<span class="time-badge"><span class="time-start">{task["start_time"]}</span><span class="time-separator">-</span><span class="time-end">{task["end_time"]}</span></span>'
-    
-    # Create priority badge
-    priority_num = priority.lower().replace('p', '')
-    priority_badge_html = f'<span class="priority-badge {priority.lower()}">{priority}</span>'
-    
-    # Check if task is completed
-    is_completed = task.get("completed", False)
-    
-    # Add checkbox only for Todoist tasks (not calendar events or fixed blocks)
-    task_id = task.get("id")
-    if task_id and task.get("source") != "calendar" and content not in ["Desayunar", "Comer", "Tiempo libre"]:
-        if is_completed:
-            # Completed task: checked and disabled checkbox
-            checkbox_html = f'<input type="checkbox" class="task-checkbox" checked disabled title="Tarea completada">'
-        else:
-            # Active task: normal checkbox with data attributes
-            # Escape content for HTML attribute
-            content_escaped = content.replace('"', '&quot;').replace("'", '&#39;')
-            labels_json = json.dumps(task.get("labels", [])).replace('"', '&quot;')
-            checkbox_html = f'<input type="checkbox" class="task-checkbox" data-task-id="{task_id}" data-content="{content_escaped}" data-start-time="{task["start_time"]}" data-end-time="{task["end_time"]}" data-priority="{priority}" data-labels="{labels_json}" title="Marcar como completada">'
-    else:
-        checkbox_html = ''
-    
-    # Add completed-task class if task is completed
-    completed_class = "completed-task" if is_completed else ""
-    
-    # Check if task has "check" or "checks" label
-    has_check_label = any(label.lower() in ['check', 'checks'] for label in labels)
-    check_class = "has-check-label" if has_check_label else ""
-    
-    html_rows += f'''        <tr class="{priority_class} {height_class} {completed_class} {check_class}">
-          <td class="checkbox-col">{checkbox_html}</td>
-          <td class="time-col" style="background-color: {time_color};">{time_range_html}</td>
-          <td class="activity-col">{content_html}</td>
-          <td class="priority-cell priority-col">{priority_badge_html}</td>
-          <td class="duration-col" style="background-color: {time_color};"><span class="duration-badge">{duration} min</span></td>
-          <td class="labels-col">{labels_container}</td>
-        </tr>
-'''
+html_rows = render_schedule_rows(final_cronograma)
 
 # Generate unassigned tasks HTML
 if unassigned_tasks:
@@ -2072,13 +1600,17 @@ base_dir = os.path.dirname(os.path.abspath(__file__))
 output_file = os.path.join(base_dir, f"cronograma_v7_5_{timestamp}.html")
 with open(output_file, "w", encoding="utf-8") as f:
     f.write(full_html)
+trace.add_artifact(output_file)
 
 print(f"\n✅ Cronograma V7.5 guardado en:")
 print(f"   {output_file}")
 
 # --- Generate ICS (iCalendar) file ---
 
+trace.set(blocks=len(final_cronograma), bytes=len(full_html))
+
 print("\n6️⃣ Generating ICS file for calendar import...")
+trace.stage('ics')
 
 ics_exporter = ICSExporter()
 
@@ -2091,13 +1623,25 @@ for task in final_cronograma:
         description=" ".join(task.get("labels", [])),
         priority=task.get("priority", "P4"),
         task_type=task.get("type", "General"),
-        url=task.get("url", "")
+        url=task.get("url", ""),
+        task_id=task.get("id", "")
     )
 
 # Save ICS file with target date
 target_date_str = target_date.strftime("%Y-%m-%d")
+
+# Update the /calendar.ics subscription feed (stable UIDs, SEQUENCE bumps on changes)
+try:
+    feed_changes = ics_exporter.publish(date=target_date_str)
+    print(f"   📡 Calendar feed: {feed_changes['added']} new, {feed_changes['changed']} changed, "
+          f"{feed_changes['cancelled']} cancelled, {feed_changes['unchanged']} unchanged")
+except Exception as e:
+    print(f"   ⚠️  Could not update calendar feed: {e}")
+    trace.error_in_stage(e)
+
 ics_output_file = os.path.join(base_dir, f"cronograma_v7_5_{timestamp}.ics")
 ics_exporter.save_to_file(ics_output_file, date=target_date_str)
+trace.add_artifact(ics_output_file)
 
 print(f"\n✅ Archivo ICS guardado en:")
 print(f"   {ics_output_file}")
@@ -2109,6 +1653,7 @@ print("="*80)
 
 # ========== INJECT DRAG & DROP FUNCTIONALITY ==========
 print("\n🎯 Injecting drag & drop functionality...")
+trace.stage('drag_drop')
 from bs4 import BeautifulSoup
 
 # Read the generated HTML
@@ -2356,3 +1901,6 @@ with open(output_file, 'w', encoding='utf-8') as f:
 
 print(f"✅ Drag & drop functionality injected successfully!")
 print(f"   Modified HTML saved to: {output_file}")
+
+trace.finish()
+print("\n" + trace.summary())
@@ -0,0 +1,159 @@
+'''
+Cronograma HTML
+Rendering of the consolidated schedule into the cronograma table rows
+
+Extracted from cronograma_generator_v7_5 so the rendering can be benchmarked
+(bench_scheduler.py) without running the whole generation.
+'''
+
+import json
+from typing import Dict, List
+
+from keyword_matcher import KeywordMatcher, BOUNDARY_PREFIX, BOUNDARY_WORD
+from schedule_rules import SCHEDULE_RULES
+
+
+def get_time_block_color(start_time):
+    """Determine time block and return background color based on start time"""
+    # Blocks and colours are declared in schedule_rules.BLOCKS
+    return SCHEDULE_RULES.block_at(start_time)
+
+# Content keywords → emoji, checked in order and compiled once into a single regex.
+# Meals are whole words: 'comer' must not match 'comercial'
+EMOJI_MATCHER = KeywordMatcher([
+    ('🍽️', ['desayuno', 'desayunar', 'comer', 'cenar', 'comida'], BOUNDARY_WORD),
+    ('💧', ['agua', 'beber', 'hidrat']),
+    ('📧', ['email', 'correo', 'gmail']),
+    ('📚', ['leer', 'lectura', 'libro', 'padre rico']),
+    ('📈', ['tradear', 'trading', 'replay', 'tesla', 'nvidia', 'analisis']),
+    ('💰', ['fondos', 'fondear', 'dinero', 'pago', 'interbroker']),
+    ('💪', ['espalda', 'hombro', 'pecho', 'ejercicio', 'físico']),
+    ('🥁', ['bateria', 'música', 'instrumento']),
+    ('🙏', ['gracias', 'dios', 'mantra', 'recordatorio']),
+    ('💳', ['control', 'gastos', 'presupuesto']),
+    ('🏠', ['visita', 'idealista', 'garage', 'plaza']),
+    ('✅', ['checks', 'check', 'revisar']),
+    ('📞', ['constructor', 'contacto', 'llamar']),
+    ('⏸️', ['libre', 'descanso']),
+], boundary=BOUNDARY_PREFIX, plurals=True)
+
+TYPE_EMOJIS = {
+    'Física': '💪',
+    'Intelectual': '🧠',
+    'Administrativa': '📋',
+    'Fija': '📌'
+}
+
+def get_emoji_for_task(content, task_type):
+    """Select appropriate emoji based on task content and type"""
+    # Check content keywords first
+    emoji = EMOJI_MATCHER.match(content)
+    if emoji:
+        return emoji
+
+    # Fallback to task type
+    return TYPE_EMOJIS.get(task_type, '📝')
+
+
+ROW_TEMPLATE = '''        <tr class="{priority_class} {height_class} {completed_class} {check_class}">
+          <td class="checkbox-col">{checkbox_html}</td>
+          <td class="time-col" style="background-color: {time_color};">{time_range_html}</td>
+          <td class="activity-col">{content_html}</td>
+          <td class="priority-cell priority-col">{priority_badge_html}</td>
+          <td class="duration-col" style="background-color: {time_color};"><span class="duration-badge">{duration} min</span></td>
+          <td class="labels-col">{labels_container}</td>
+        </tr>
+'''
+
+
+def render_task_row(task: Dict) -> str:
+    """Table row (<tr>) of one consolidated cronograma block"""
+    priority = task.get("priority", "P4")
+    priority_class = f"priority-{priority.lower()}"
+    duration = task.get("duration", 1)
+
+    # Map duration to height class
+    if duration <= 5:
+        height_class = "h-5"
+    elif duration <= 10:
+        height_class = "h-10"
+    elif duration <= 15:
+        height_class = "h-15"
+    elif duration <= 20:
+        height_class = "h-20"
+    elif duration <= 30:
+        height_class = "h-30"
+    else:
+        height_class = "h-60"
+
+    # Get emoji for task
+    content = task.get("content", "")
+    emoji = get_emoji_for_task(content, task.get("type", "General"))
+
+    # Truncate long titles and add tooltip
+    if len(content) > 50:
+        truncated_content = content[:47] + "..."
+        content_escaped = content.replace('"', '&quot;').replace("'", '&#39;')
+        content_html = f'{emoji} <span class="truncate" data-full-text="{content_escaped}">{truncated_content}</span>'
+    else:
+        content_html = f'{emoji} {content}'
+
+    # Add link to Todoist if task has ID, or custom URL if provided
+    task_id = task.get("id")
+    if task.get("url"):
+        url = task["url"]
+        content_html = f'<a href="{url}" target="_blank">{content_html}</a>'
+    elif task_id:
+        # Generate Todoist URL from task ID
+        todoist_url = f"https://todoist.com/app/task/{task_id}"
+        content_html = f'<a href="{todoist_url}" target="_blank" style="color: #64748b; text-decoration: none;">{content_html}</a>'
+
+    # Generate labels HTML
+    labels = task.get("labels", [])
+    labels_html = ''.join(f'<span class="label">{l}</span>' for l in labels)
+    labels_container = f'<div class="labels-container">{labels_html}</div>' if labels_html else ''
+
+    # Get time block color
+    time_color, _ = get_time_block_color(task["start_time"])
+
+    # Format time range with different sizes - wrapped in badge
+    time_range_html = f'<span class="time-badge"><span class="time-start">{task["start_time"]}</span><span class="time-separator">-</span><span class="time-end">{task["end_time"]}</span></span>'
+
+    # Create priority badge
+    priority_badge_html = f'<span class="priority-badge {priority.lower()}">{priority}</span>'
+
+    # Check if task is completed
+    is_completed = task.get("completed", False)
+
+    # Add checkbox only for Todoist tasks (not calendar events or fixed blocks)
+    if task_id and task.get("source") != "calendar" and content not in ["Desayunar", "Comer", "Tiempo libre"]:
+        if is_completed:
+            # Completed task: checked and disabled checkbox
+            checkbox_html = f'<input type="checkbox" class="task-checkbox" checked disabled title="Tarea completada">'
+        else:
+            # Active task: normal checkbox with data attributes
+            # Escape content for HTML attribute
+            content_escaped = content.replace('"', '&quot;').replace("'", '&#39;')
+            labels_json = json.dumps(task.get("labels", [])).replace('"', '&quot;')
+            checkbox_html = f'<input type="checkbox" class="task-checkbox" data-task-id="{task_id}" data-content="{content_escaped}" data-start-time="{task["start_time"]}" data-end-time="{task["end_time"]}" data-priority="{priority}" data-labels="{labels_json}" title="Marcar como completada">'
+    else:
+        checkbox_html = ''
+
+    # Add completed-task class if task is completed
+    completed_class = "completed-task" if is_completed else ""
+
+    # Check if task has "check" or "checks" label
+    has_check_label = any(label.lower() in ['check', 'checks'] for label in labels)
+    check_class = "has-check-label" if has_check_label else ""
+
+    return ROW_TEMPLATE.format(
+        priority_class=priority_class, height_class=height_class, completed_class=completed_class,
+        check_class=check_class, checkbox_html=checkbox_html, time_color=time_color,
+        time_range_html=time_range_html, content_html=content_html,
+        priority_badge_html=priority_badge_html, duration=duration, labels_container=labels_container
+    )
+
+
+def render_schedule_rows(cronograma: List[Dict]) -> str:
+    """Table rows of the whole consolidated cronograma"""
+    return "".join(render_task_row(task) for task in cronograma)
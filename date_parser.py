@@ -0,0 +1,131 @@
+"""
+Date Parser
+Extracción de fechas en español a partir de texto de voz
+
+Una única expresión regular precompilada reconoce todas las formas admitidas:
+- Relativas: "hoy", "esta mañana", "ayer", "anteayer" / "ante ayer", "mañana",
+  "pasado mañana"
+- Días de la semana: "el lunes" (el último lunes, hoy incluido), "el lunes pasado",
+  "el próximo lunes" / "el lunes que viene"
+- Día y mes: "10 diciembre", "15 de febrero", "1 de enero de 2026", "10 diciembre 2026"
+- Numéricas: "10/12/2026", "10-12-2026"
+- Solo mes: "febrero", "marzo de 2026" (día 1 del mes)
+
+Si no se indica el año, una fecha ya pasada este año se interpreta en el año siguiente.
+"""
+
+import re
+from datetime import datetime, date, timedelta
+from typing import Optional, Tuple
+
+MESES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
+    'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
+}
+
+DIAS_SEMANA = {
+    'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2, 'jueves': 3,
+    'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6
+}
+
+# Días de desplazamiento respecto a hoy
+RELATIVOS = {
+    'hoy': 0, 'esta mañana': 0, 'ayer': -1, 'anteayer': -2, 'ante ayer': -2,
+    'mañana': 1, 'pasado mañana': 2
+}
+
+_MES = '|'.join(MESES)
+_DIA_SEMANA = '|'.join(sorted(DIAS_SEMANA, key=len, reverse=True))
+
+FECHA_RE = re.compile(
+    r'(?<!\w)(?:'
+    # 10/12/2026, 10-12-2026
+    r'(?P<num_dia>\d{1,2})[/-](?P<num_mes>\d{1,2})[/-](?P<num_anio>\d{4})'
+    # 10 diciembre, 15 de febrero, 1 de enero de 2026, 10 diciembre 2026
+    r'|(?P<dia>\d{1,2})\s+(?:de\s+)?(?P<mes>' + _MES + r')(?:\s+(?:de\s+|del\s+)?(?P<anio>\d{4}))?'
+    # pasado mañana, esta mañana, anteayer, ante ayer, ayer, hoy, mañana
+    # ("de la mañana" / "por la mañana" es una hora del día, no una fecha)
+    r'|(?P<relativo>pasado\s+mañana|esta\s+mañana|anteayer|ante\s+ayer|ayer|hoy|(?<!la )mañana)'
+    # el lunes, el lunes pasado, el próximo lunes, el lunes que viene
+    r'|(?:el\s+)?(?:(?P<proximo>próximo|proximo)\s+)?(?P<dia_semana>' + _DIA_SEMANA + r')'
+    r'(?:\s+(?P<sentido>pasado|que\s+viene))?'
+    # febrero, marzo de 2026
+    r'|(?P<solo_mes>' + _MES + r')(?:\s+(?:de\s+|del\s+)?(?P<solo_mes_anio>\d{4}))?'
+    r')(?!\w)',
+    re.IGNORECASE
+)
+
+_ESPACIOS_RE = re.compile(r'\s+')
+
+
+def _anio_por_defecto(mes: int, dia: int, hoy: date) -> int:
+    """Año para una fecha sin año: si ya pasó este año, el siguiente"""
+    if mes < hoy.month or (mes == hoy.month and dia < hoy.day):
+        return hoy.year + 1
+    return hoy.year
+
+
+def _resolver(match, hoy: date) -> date:
+    """Convert a FECHA_RE match into a date (ValueError if the date is invalid)"""
+    grupos = match.groupdict()
+
+    if grupos['num_dia']:
+        return date(int(grupos['num_anio']), int(grupos['num_mes']), int(grupos['num_dia']))
+
+    if grupos['dia']:
+        dia = int(grupos['dia'])
+        mes = MESES[grupos['mes'].lower()]
+        anio = int(grupos['anio']) if grupos['anio'] else _anio_por_defecto(mes, dia, hoy)
+        return date(anio, mes, dia)
+
+    if grupos['relativo']:
+        clave = _ESPACIOS_RE.sub(' ', grupos['relativo'].lower())
+        return hoy + timedelta(days=RELATIVOS[clave])
+
+    if grupos['dia_semana']:
+        objetivo = DIAS_SEMANA[grupos['dia_semana'].lower()]
+        sentido = (grupos['sentido'] or '').lower()
+        if grupos['proximo'] or sentido.startswith('que'):
+            # Próxima ocurrencia, nunca hoy
+            return hoy + timedelta(days=(objetivo - hoy.weekday() - 1) % 7 + 1)
+        if sentido == 'pasado':
+            # Ocurrencia anterior, nunca hoy
+            return hoy - timedelta(days=(hoy.weekday() - objetivo - 1) % 7 + 1)
+        # Sin indicación: el último (un gasto suele ser pasado), hoy incluido
+        return hoy - timedelta(days=(hoy.weekday() - objetivo) % 7)
+
+    mes = MESES[grupos['solo_mes'].lower()]
+    if grupos['solo_mes_anio']:
+        return date(int(grupos['solo_mes_anio']), mes, 1)
+    anio = hoy.year + 1 if mes < hoy.month else hoy.year
+    return date(anio, mes, 1)
+
+
+def extraer_fecha(texto: str, hoy: Optional[date] = None) -> Tuple[Optional[str], str]:
+    """
+    Extrae la primera fecha del texto
+
+    Args:
+        texto: Texto de voz, p. ej. "25.50 Mercadona ayer"
+        hoy: Fecha de referencia (por defecto, hoy)
+
+    Returns:
+        Tuple (fecha 'YYYY-MM-DD' o None, texto sin la expresión de fecha)
+    """
+    if hoy is None:
+        hoy = datetime.now().date()
+    elif isinstance(hoy, datetime):
+        hoy = hoy.date()
+
+    for match in FECHA_RE.finditer(texto):
+        try:
+            fecha = _resolver(match, hoy)
+        except ValueError:
+            # "31 febrero", "50 enero"...: no es una fecha, seguir buscando
+            continue
+
+        texto_limpio = texto[:match.start()] + ' ' + texto[match.end():]
+        return fecha.strftime('%Y-%m-%d'), _ESPACIOS_RE.sub(' ', texto_limpio).strip()
+
+    return None, texto
@@ -3,7 +3,7 @@ Detector for new events in shared calendar
 """
 
 from calendar_client import iCloudCalendarClient
-from events_db import add_new_event, get_all_known_uids
+from events_db import upsert_events
 from datetime import datetime, timedelta
 import pytz
 
@@ -30,53 +30,26 @@ def detect_new_events_in_shared_calendar(calendar_name="Casa Juana Doña", days_
     
     print(f"   Searching from {today.date()} to {end_date.date()}")
     
-    # Get all events from the shared calendar
-    all_events = []
-    current_date = today
-    
-    while current_date < end_date:
-        next_date = current_date + timedelta(days=1)
-        daily_events = client.get_events_from_calendar_range(
-            calendar_name, 
-            current_date, 
-            next_date
-        )
-        all_events.extend(daily_events)
-        current_date = next_date
+    # One CalDAV query for the whole window
+    all_events = client.get_events_from_calendar_range(calendar_name, today, end_date)
     
     print(f"   Found {len(all_events)} total events in shared calendar")
     
-    # Get all known UIDs from database
-    known_uids = get_all_known_uids()
-    print(f"   Known events in database: {len(known_uids)}")
+    # Store the whole scan in one transaction
+    result = upsert_events(all_events, calendar_source=calendar_name, window=(today, end_date))
+    new_events = result['new']
     
-    # Detect new events
-    new_events = []
-    for event in all_events:
-        uid = event['uid']
-        
-        if uid not in known_uids:
-            # This is a new event!
-            new_events.append(event)
-            
-            # Add to database
-            success = add_new_event(
-                uid=uid,
-                summary=event['summary'],
-                start_time=event['start_time'],
-                end_time=event['end_time'],
-                date=event['date'],
-                calendar_source=calendar_name
-            )
-            
-            if success:
-                print(f"   ✅ New event detected: {event['summary']} ({event['date']} {event['start_time']})")
-            else:
-                print(f"   ⚠️  Event already in DB: {event['summary']}")
+    for event in new_events:
+        print(f"   ✅ New event detected: {event['summary']} ({event['date']} {event['start_time']})")
+    for event in result['updated']:
+        print(f"   🔄 Event moved/renamed: {event['summary']} ({event['date']} {event['start_time']})")
+    for event in result['cancelled']:
+        print(f"   ❌ Event cancelled: {event['summary']} ({event['date']} {event['start_time']})")
     
     print(f"\n📊 Detection summary:")
     print(f"   Total events in calendar: {len(all_events)}")
     print(f"   New events detected: {len(new_events)}")
+    print(f"   Moved/renamed: {len(result['updated'])} | Cancelled: {len(result['cancelled'])}")
     
     return new_events
 
@@ -6,101 +6,272 @@ import sqlite3
 from datetime import datetime
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent / 'events_tracker.db'
+from sqlite_store import db_path, get_connection, transaction, register_migrations, adopt_legacy_file
+
+DB_PATH = db_path('events_tracker.db')
+
+# The database used to live next to the code
+LEGACY_DB_PATH = Path(__file__).parent / 'events_tracker.db'
+
+register_migrations(DB_PATH, [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        uid TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        date TEXT NOT NULL,
+        detected_at TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'new',
+        copied_at TEXT,
+        calendar_source TEXT NOT NULL
+    );
+    """,
+    # Track every sighting so moved and cancelled events can be detected
+    """
+    ALTER TABLE events ADD COLUMN start_at TEXT;
+    ALTER TABLE events ADD COLUMN last_seen TEXT;
+    ALTER TABLE events ADD COLUMN updated_at TEXT;
+    ALTER TABLE events ADD COLUMN cancelled_at TEXT;
+    CREATE INDEX IF NOT EXISTS idx_events_source_start ON events(calendar_source, start_at);
+    """,
+])
+
+# Local start time, sortable: 'YYYY-MM-DD HH:MM'
+START_AT_FORMAT = '%Y-%m-%d %H:%M'
 
 def init_database():
     """Initialize the events tracking database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS events (
-            uid TEXT PRIMARY KEY,
-            summary TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT NOT NULL,
-            date TEXT NOT NULL,
-            detected_at TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'new',
-            copied_at TEXT,
-            calendar_source TEXT NOT NULL
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    adopt_legacy_file(LEGACY_DB_PATH, DB_PATH)
+    get_connection(DB_PATH)
     print("✅ Database initialized")
 
 def add_new_event(uid, summary, start_time, end_time, date, calendar_source="Casa Juana Doña"):
     """Add a new event to the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
-            INSERT INTO events (uid, summary, start_time, end_time, date, detected_at, status, calendar_source)
-            VALUES (?, ?, ?, ?, ?, ?, 'new', ?)
-        """, (uid, summary, start_time, end_time, date, datetime.now().isoformat(), calendar_source))
-        
-        conn.commit()
+        with transaction(DB_PATH) as conn:
+            conn.execute("""
+                INSERT INTO events (uid, summary, start_time, end_time, date, detected_at, status, calendar_source)
+                VALUES (?, ?, ?, ?, ?, ?, 'new', ?)
+            """, (uid, summary, start_time, end_time, date, datetime.now().isoformat(), calendar_source))
         return True
     except sqlite3.IntegrityError:
         # Event already exists
         return False
-    finally:
-        conn.close()
+
+def _pick_occurrence(occurrences, stored, window_start):
+    """
+    The occurrence of a UID to store, and whether it counts as a change
+
+    Recurring events expanded in the window share their UID. The stored
+    occurrence is kept while it is still in the scan; once it falls behind the
+    window the series rolls forward to its next occurrence, which is not a move
+    unless its summary or times differ.
+    """
+    if stored is None:
+        return occurrences[0], False
+
+    summary, start_time, end_time, date, start_at = stored
+    for event in occurrences:
+        if _start_at(event) == start_at:
+            break
+    else:
+        event = occurrences[0]
+
+    fields = (event['summary'], event['start_time'], event['end_time'])
+    if fields != (summary, start_time, end_time):
+        return event, True
+    rolled_forward = window_start and start_at and start_at < window_start
+    return event, event['date'] != date and not rolled_forward
+
+def _start_at(event):
+    start = event.get('start_datetime')
+    return start.strftime(START_AT_FORMAT) if start else None
+
+def upsert_events(events, calendar_source="Casa Juana Doña", window=None):
+    """
+    Store one scan of a calendar in a single transaction
+
+    New events are inserted with status 'new'; known ones get their last_seen
+    refreshed and, if their summary or time changed, updated_at. Statuses
+    (new/copied/ignored) are never overwritten.
+
+    Args:
+        events: Events as returned by iCloudCalendarClient (uid, summary,
+                start_time, end_time, date, start_datetime)
+        calendar_source: Calendar the events come from
+        window: Optional (start, end) datetimes that were scanned. Known events
+                starting inside it that were not seen are marked cancelled, and
+                recurring events whose stored occurrence is before it roll
+                forward without counting as moved.
+                Cancellations are skipped when the scan returned no events (a
+                failed fetch looks the same as an empty calendar).
+
+    Returns:
+        Dict with 'new', 'updated' and 'cancelled' event lists and 'seen' count
+    """
+    seen_at = datetime.now().isoformat()
+    window_start = window[0].strftime(START_AT_FORMAT) if window else None
+
+    occurrences = {}
+    for event in sorted(events, key=lambda e: e['start_datetime'].timestamp() if e.get('start_datetime') else float('inf')):
+        occurrences.setdefault(event['uid'], []).append(event)
+
+    with transaction(DB_PATH, immediate=True) as conn:
+        known = {
+            row[0]: row[1:]
+            for row in conn.execute("""
+                SELECT uid, summary, start_time, end_time, date, start_at
+                FROM events WHERE calendar_source = ?
+            """, (calendar_source,))
+        }
+
+        by_uid = {}
+        changed = set()
+        rows = []
+        for uid, instances in occurrences.items():
+            event, moved = _pick_occurrence(instances, known.get(uid), window_start)
+            by_uid[uid] = event
+            if moved:
+                changed.add(uid)
+            rows.append((
+                uid, event['summary'], event['start_time'], event['end_time'], event['date'],
+                _start_at(event), seen_at, calendar_source, moved
+            ))
+
+        conn.executemany("""
+            INSERT INTO events
+                (uid, summary, start_time, end_time, date, start_at, detected_at, last_seen, status, calendar_source)
+            VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?7, 'new', ?8)
+            ON CONFLICT(uid) DO UPDATE SET
+                updated_at = CASE WHEN ?9 THEN excluded.last_seen ELSE events.updated_at END,
+                summary = excluded.summary,
+                start_time = excluded.start_time,
+                end_time = excluded.end_time,
+                date = excluded.date,
+                start_at = excluded.start_at,
+                last_seen = excluded.last_seen,
+                cancelled_at = NULL
+        """, rows)
+
+        cancelled = []
+        if window and rows:
+            window_end = window[1].strftime(START_AT_FORMAT)
+            cancelled = [
+                {'uid': row[0], 'summary': row[1], 'start_time': row[2], 'end_time': row[3], 'date': row[4]}
+                for row in conn.execute("""
+                    SELECT uid, summary, start_time, end_time, date FROM events
+                    WHERE calendar_source = ? AND cancelled_at IS NULL
+                      AND start_at >= ? AND start_at < ? AND last_seen < ?
+                """, (calendar_source, window_start, window_end, seen_at))
+            ]
+            conn.executemany(
+                "UPDATE events SET cancelled_at = ? WHERE uid = ?",
+                [(seen_at, event['uid']) for event in cancelled]
+            )
+
+    return {
+        'new': [e for uid, e in by_uid.items() if uid not in known],
+        'updated': [e for uid, e in by_uid.items() if uid in changed],
+        'cancelled': cancelled,
+        'seen': len(by_uid)
+    }
+
+def get_changed_events(since):
+    """Events moved or cancelled after since (ISO timestamp)"""
+    conn = get_connection(DB_PATH)
+    cursor = conn.execute("""
+        SELECT uid, summary, start_time, end_time, date, status, updated_at, cancelled_at
+        FROM events
+        WHERE updated_at >= ? OR cancelled_at >= ?
+        ORDER BY start_at
+    """, (since, since))
+
+    return [
+        {
+            'uid': row[0],
+            'summary': row[1],
+            'start_time': row[2],
+            'end_time': row[3],
+            'date': row[4],
+            'status': row[5],
+            'updated_at': row[6],
+            'cancelled_at': row[7]
+        }
+        for row in cursor.fetchall()
+    ]
+
+def _start_at_range(since, until):
+    """YYYY-MM-DD inclusive range -> start_at bounds"""
+    return since, f"{until} 99:99"
+
+def iter_copied_events(since, until):
+    """Events copied to the personal calendar starting between since and until (YYYY-MM-DD)"""
+    conn = get_connection(DB_PATH)
+    cursor = conn.execute("""
+        SELECT uid, summary, start_time, end_time, start_at, calendar_source,
+               copied_at, updated_at, cancelled_at
+        FROM events
+        WHERE status = 'copied' AND start_at BETWEEN ? AND ?
+        ORDER BY start_at
+    """, _start_at_range(since, until))
+
+    for row in cursor:
+        yield {
+            'uid': row[0],
+            'summary': row[1],
+            'start_time': row[2],
+            'end_time': row[3],
+            'start_at': row[4],
+            'calendar_source': row[5],
+            'copied_at': row[6],
+            'updated_at': row[7],
+            'cancelled_at': row[8]
+        }
+
+def get_copied_events_version(since, until):
+    """(count, latest change) of the copied events in a range, for feed ETags"""
+    conn = get_connection(DB_PATH)
+    return conn.execute("""
+        SELECT COUNT(*), MAX(MAX(COALESCE(copied_at, ''), COALESCE(updated_at, ''), COALESCE(cancelled_at, '')))
+        FROM events
+        WHERE status = 'copied' AND start_at BETWEEN ? AND ?
+    """, _start_at_range(since, until)).fetchone()
 
 def get_event_status(uid):
     """Get the status of an event"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT status FROM events WHERE uid = ?", (uid,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    conn = get_connection(DB_PATH)
+    result = conn.execute("SELECT status FROM events WHERE uid = ?", (uid,)).fetchone()
     return result[0] if result else None
 
 def mark_event_copied(uid):
     """Mark an event as copied"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE events 
-        SET status = 'copied', copied_at = ?
-        WHERE uid = ?
-    """, (datetime.now().isoformat(), uid))
-    
-    conn.commit()
-    conn.close()
+    with transaction(DB_PATH) as conn:
+        conn.execute("""
+            UPDATE events
+            SET status = 'copied', copied_at = ?
+            WHERE uid = ?
+        """, (datetime.now().isoformat(), uid))
 
 def mark_event_ignored(uid):
     """Mark an event as ignored"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE events 
-        SET status = 'ignored'
-        WHERE uid = ?
-    """, (uid,))
-    
-    conn.commit()
-    conn.close()
+    with transaction(DB_PATH) as conn:
+        conn.execute("""
+            UPDATE events
+            SET status = 'ignored'
+            WHERE uid = ?
+        """, (uid,))
 
 def get_new_events():
-    """Get all events with status 'new'"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    """Get all events with status 'new' (not cancelled)"""
+    conn = get_connection(DB_PATH)
+    cursor = conn.execute("""
         SELECT uid, summary, start_time, end_time, date, detected_at
         FROM events
-        WHERE status = 'new'
+        WHERE status = 'new' AND cancelled_at IS NULL
         ORDER BY date ASC, start_time ASC
     """)
-    
+
     events = []
     for row in cursor.fetchall():
         events.append({
@@ -111,20 +282,13 @@ def get_new_events():
             'date': row[4],
             'detected_at': row[5]
         })
-    
-    conn.close()
+
     return events
 
 def get_all_known_uids():
     """Get all UIDs that are already in the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT uid FROM events")
-    uids = [row[0] for row in cursor.fetchall()]
-    
-    conn.close()
-    return set(uids)
+    conn = get_connection(DB_PATH)
+    return {row[0] for row in conn.execute("SELECT uid FROM events")}
 
 # Auto-initialize database on import
 init_database()
@@ -0,0 +1,392 @@
+"""
+Expense Batch
+Registro de muchos gastos en una sola petición (/registrar-gastos-batch)
+
+Acepta textos sueltos ("25.50 Mercadona"), líneas pegadas de un extracto bancario
+("15/10/2026 MERCADONA -25,50"), un CSV o una lista de gastos ya estructurados.
+Todo se analiza en local (sin IA para la extracción), cada descripción distinta se
+categoriza una sola vez y los envíos a Firefly III se hacen en paralelo.
+"""
+
+import csv
+import hashlib
+import io
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from category_cache import normalizar_descripcion
+from expense_utils import (
+    aprender_categoria_usuario,
+    categoria_indicada_en_texto,
+    categorizar_gasto,
+    extraer_gasto_local,
+    registrar_en_firefly
+)
+
+MAX_ITEMS = int(os.getenv('EXPENSE_BATCH_MAX_ITEMS', 500))
+
+# Concurrent POSTs to Firefly III
+MAX_WORKERS = int(os.getenv('EXPENSE_BATCH_WORKERS', 4))
+
+# Estados por gasto
+ESTADO_REGISTRADO = 'registrado'
+ESTADO_ENCOLADO = 'encolado'
+ESTADO_DUPLICADO = 'duplicado'
+ESTADO_OMITIDO = 'omitido'
+ESTADO_ERROR = 'error'
+
+# Cabeceras CSV reconocidas (normalizadas con normalizar_descripcion)
+COLUMNAS_CSV = {
+    'fecha': ['fecha', 'date', 'fecha valor', 'f valor', 'fecha operacion', 'fecha contable'],
+    'descripcion': ['descripcion', 'concepto', 'description', 'detalle', 'movimiento', 'comercio'],
+    'monto': ['importe', 'monto', 'amount', 'cantidad', 'importe eur'],
+    'categoria': ['categoria', 'category'],
+}
+
+FORMATOS_FECHA = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y']
+
+# "15/10/2026 MERCADONA -25,50 €"
+_LINEA_EXTRACTO_RE = re.compile(
+    r'^(?P<fecha>\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2})\s+'
+    r'(?P<descripcion>.+?)\s+'
+    r'(?P<monto>[-+]?\d[\d.,]*)\s*(?:€|eur|euros)?$',
+    re.IGNORECASE
+)
+
+
+def parsear_importe(valor) -> Optional[float]:
+    """
+    Convierte un importe en float admitiendo formato español
+
+    "25,50" -> 25.5, "-1.234,56" -> -1234.56, "1,234.56" -> 1234.56
+    """
+    if isinstance(valor, (int, float)):
+        return float(valor)
+
+    texto = str(valor).strip().replace('€', '').replace(' ', '')
+    if not texto:
+        return None
+
+    if ',' in texto and '.' in texto:
+        # El último separador es el decimal
+        if texto.rfind(',') > texto.rfind('.'):
+            texto = texto.replace('.', '').replace(',', '.')
+        else:
+            texto = texto.replace(',', '')
+    elif ',' in texto:
+        texto = texto.replace(',', '.')
+    elif texto.count('.') > 1:
+        texto = texto.replace('.', '')
+
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+def normalizar_fecha(valor) -> Optional[str]:
+    """Convierte una fecha de extracto/CSV a 'YYYY-MM-DD' (None si no es válida)"""
+    texto = str(valor or '').strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def _entrada(indice: int, origen, **datos) -> Dict:
+    return {'indice': indice, 'entrada': origen, **datos}
+
+
+def _parsear_texto(indice: int, texto: str) -> Dict:
+    """Una línea de texto: formato de voz o línea de extracto bancario"""
+    texto = texto.strip()
+
+    match = _LINEA_EXTRACTO_RE.match(texto)
+    if match:
+        fecha = normalizar_fecha(match.group('fecha'))
+        monto = parsear_importe(match.group('monto'))
+        if fecha and monto is not None:
+            return _entrada(indice, texto, monto=monto, descripcion=match.group('descripcion').strip(),
+                            fecha=fecha, categoria_manual=None, tags=[], extracto=True)
+
+    (monto, descripcion, fecha, categoria_manual, tags), _ = extraer_gasto_local(texto)
+    if monto is None:
+        return _entrada(indice, texto, error='No se pudo extraer monto y descripción. Formato esperado: "25.50 Mercadona"')
+
+    return _entrada(indice, texto, monto=monto, descripcion=descripcion, fecha=fecha,
+                    categoria_manual=categoria_manual,
+                    categoria_usuario=categoria_indicada_en_texto(texto, categoria_manual), tags=tags)
+
+
+def _parsear_csv(contenido: str, indice_inicial: int = 0) -> Tuple[List[Dict], Optional[str]]:
+    """Filas de un CSV con cabecera (separador , ; o tabulador)"""
+    try:
+        dialecto = csv.Sniffer().sniff(contenido[:2048], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+
+    lector = csv.reader(io.StringIO(contenido), dialecto)
+    filas = [fila for fila in lector if any(celda.strip() for celda in fila)]
+    if not filas:
+        return [], 'El CSV está vacío'
+
+    cabecera = [normalizar_descripcion(c) for c in filas[0]]
+    columnas = {}
+    for campo, alias in COLUMNAS_CSV.items():
+        for posicion, nombre in enumerate(cabecera):
+            if nombre in alias:
+                columnas[campo] = posicion
+                break
+
+    if 'monto' not in columnas or 'descripcion' not in columnas:
+        return [], 'El CSV necesita columnas de importe y descripción (p. ej. "fecha;concepto;importe")'
+
+    def celda(fila, campo):
+        posicion = columnas.get(campo)
+        return fila[posicion].strip() if posicion is not None and posicion < len(fila) else ''
+
+    entradas = []
+    for numero, fila in enumerate(filas[1:]):
+        indice = indice_inicial + numero
+        origen = dialecto.delimiter.join(fila)
+        monto = parsear_importe(celda(fila, 'monto'))
+        descripcion = celda(fila, 'descripcion')
+        fecha_texto = celda(fila, 'fecha')
+        fecha = normalizar_fecha(fecha_texto) if fecha_texto else None
+
+        if monto is None or not descripcion:
+            entradas.append(_entrada(indice, origen, error='Fila sin importe o descripción válidos'))
+        elif fecha_texto and fecha is None:
+            entradas.append(_entrada(indice, origen, error=f'Fecha no válida: {fecha_texto}'))
+        else:
+            entradas.append(_entrada(indice, origen, monto=monto, descripcion=descripcion, fecha=fecha,
+                                     categoria_manual=celda(fila, 'categoria').capitalize() or None,
+                                     tags=[], extracto=True))
+
+    return entradas, None
+
+
+def _parsear_estructurado(indice: int, gasto: Dict) -> Dict:
+    """Un gasto ya estructurado: {"monto": 25.5, "descripcion": "Mercadona", ...}"""
+    monto = parsear_importe(gasto.get('monto', ''))
+    descripcion = str(gasto.get('descripcion') or '').strip()
+    if monto is None or not descripcion:
+        return _entrada(indice, gasto, error='Faltan "monto" o "descripcion"')
+
+    fecha = gasto.get('fecha')
+    if fecha and normalizar_fecha(fecha) is None:
+        return _entrada(indice, gasto, error=f'Fecha no válida: {fecha}')
+
+    return _entrada(indice, gasto, monto=monto, descripcion=descripcion,
+                    fecha=normalizar_fecha(fecha) if fecha else None,
+                    categoria_manual=(gasto.get('categoria') or '').capitalize() or None,
+                    categoria_usuario=bool(gasto.get('categoria')), tags=gasto.get('tags', []))
+
+
+def parsear_lote(data: Dict) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Analiza el body de /registrar-gastos-batch
+
+    Acepta cualquier combinación de:
+        "textos": ["25.50 Mercadona", "60 gasolina ayer"]
+        "texto": "una línea por gasto\\n15/10/2026 MERCADONA -25,50"
+        "csv": "fecha;concepto;importe\\n15/10/2026;MERCADONA;-25,50"
+        "gastos": [{"monto": 25.5, "descripcion": "Mercadona", "fecha": "2026-10-15"}]
+
+    En extractos (líneas con fecha inicial o CSV) los cargos son importes negativos:
+    si hay alguno, los importes positivos del extracto son ingresos y se omiten.
+
+    Returns:
+        Tuple (entradas, error)
+    """
+    textos = list(data.get('textos') or [])
+    if data.get('texto'):
+        textos.extend(data['texto'].splitlines())
+    textos = [t for t in textos if isinstance(t, str) and t.strip()]
+
+    entradas = [_parsear_texto(i, t) for i, t in enumerate(textos)]
+
+    if data.get('csv'):
+        filas, error = _parsear_csv(data['csv'], len(entradas))
+        if error:
+            return [], error
+        entradas.extend(filas)
+
+    for gasto in data.get('gastos') or []:
+        entradas.append(_parsear_estructurado(len(entradas), gasto if isinstance(gasto, dict) else {}))
+
+    if not entradas:
+        return [], 'Faltan datos. Envía "textos", "texto", "csv" o "gastos"'
+    if len(entradas) > MAX_ITEMS:
+        return [], f'Demasiados gastos en un lote ({len(entradas)}, máximo {MAX_ITEMS})'
+
+    validas = [e for e in entradas if 'error' not in e]
+    hay_cargos = any(e.get('extracto') and e['monto'] < 0 for e in validas)
+    for entrada in validas:
+        if hay_cargos and entrada.get('extracto') and entrada['monto'] > 0:
+            entrada['omitido'] = 'Ingreso (importe positivo en un extracto)'
+        entrada['monto'] = abs(entrada['monto'])
+        if entrada['monto'] == 0:
+            entrada['error'] = 'Importe cero'
+
+    return entradas, None
+
+
+def _clave_idempotencia(entrada: Dict, ocurrencia: int, clave_lote: Optional[str]) -> str:
+    """
+    Clave por gasto: derivada de la del lote si se envió; si no, del contenido en
+    extractos y CSV, y aleatoria en textos y gastos estructurados
+
+    Con la clave por contenido, volver a subir el mismo extracto no duplica gastos;
+    dos gastos idénticos en el mismo lote se distinguen por su número de ocurrencia.
+    Un texto como "3 café" se repite de verdad de un lote a otro, así que no se
+    deduplica por contenido.
+    """
+    if clave_lote:
+        return f"{clave_lote}-{entrada['indice']}"
+    if not entrada.get('extracto'):
+        return 'lote-' + uuid.uuid4().hex[:24]
+    contenido = f"{entrada['fecha']}|{entrada['monto']:.2f}|{entrada['descripcion'].lower()}|{ocurrencia}"
+    return 'lote-' + hashlib.sha1(contenido.encode('utf-8')).hexdigest()[:24]
+
+
+def preparar_lote(entradas: List[Dict], clave_lote: Optional[str] = None) -> int:
+    """
+    Categoriza las entradas válidas y completa cada una con su 'gasto'
+
+    Cada descripción distinta (normalizada) se categoriza una sola vez.
+
+    Returns:
+        Número de categorizaciones realizadas
+    """
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    categorias = {}
+    ocurrencias = {}
+
+    for entrada in entradas:
+        if 'error' in entrada or 'omitido' in entrada:
+            continue
+
+        descripcion = entrada['descripcion']
+        tags = entrada['tags'] or []
+        clave = normalizar_descripcion(descripcion) or descripcion.lower()
+
+        if entrada['categoria_manual']:
+            categoria, metodo = entrada['categoria_manual'], 'manual'
+        else:
+            if clave not in categorias:
+                categorias[clave] = categorizar_gasto(descripcion)
+            categoria, metodo = categorias[clave]
+
+        entrada['fecha'] = entrada['fecha'] or hoy
+        firma = (entrada['fecha'], round(entrada['monto'], 2), descripcion.lower())
+        ocurrencias[firma] = ocurrencias.get(firma, 0) + 1
+
+        entrada['idempotency_key'] = _clave_idempotencia(entrada, ocurrencias[firma], clave_lote)
+        entrada['gasto'] = {
+            'monto': entrada['monto'],
+            'descripcion': descripcion,
+            'descripcion_firefly': f"{descripcion} [EXTRAORDINARIO]" if 'Extraordinario' in tags else descripcion,
+            'fecha': entrada['fecha'],
+            'categoria': categoria,
+            'metodo_categorizacion': metodo,
+            'categoria_usuario': entrada.get('categoria_usuario', False),
+            'tags': tags
+        }
+
+    return len(categorias)
+
+
+def _enviar(entrada: Dict) -> Tuple[str, Optional[str]]:
+    gasto = entrada['gasto']
+    exito, resultado = registrar_en_firefly(
+        gasto['monto'],
+        gasto['descripcion_firefly'],
+        gasto['categoria'],
+        gasto['fecha'],
+        gasto['tags'],
+        external_id=entrada['idempotency_key']
+    )
+    if exito:
+        aprender_categoria_usuario(gasto)
+        return ESTADO_REGISTRADO, None
+    if 'duplicate' in str(resultado).lower():
+        return ESTADO_DUPLICADO, None
+    return ESTADO_ERROR, f'Error al registrar en Firefly III: {resultado}'
+
+
+def registrar_lote(data: Dict, modo_async: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Analiza, categoriza y registra un lote de gastos
+
+    Args:
+        data: Body de /registrar-gastos-batch (ver parsear_lote)
+        modo_async: Encolar cada gasto en expense_queue en vez de enviarlo ya
+
+    Returns:
+        Tuple (resumen con resultados por gasto, error)
+    """
+    inicio = time.time()
+
+    entradas, error = parsear_lote(data)
+    if error:
+        return None, error
+
+    categorizaciones = preparar_lote(entradas, data.get('idempotency_key'))
+    pendientes = [e for e in entradas if 'gasto' in e]
+
+    if modo_async:
+        from expense_queue import enqueue_expense
+        for entrada in pendientes:
+            _, creado = enqueue_expense({'gasto': entrada['gasto']}, entrada['idempotency_key'])
+            entrada['estado'] = ESTADO_ENCOLADO if creado else ESTADO_DUPLICADO
+    elif pendientes:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(pendientes)))) as executor:
+            for entrada, (estado, error_envio) in zip(pendientes, executor.map(_enviar, pendientes)):
+                entrada['estado'] = estado
+                if error_envio:
+                    entrada['error'] = error_envio
+
+    resultados = []
+    por_estado = {}
+    for entrada in entradas:
+        if 'estado' not in entrada:
+            entrada['estado'] = ESTADO_OMITIDO if 'omitido' in entrada else ESTADO_ERROR
+        por_estado[entrada['estado']] = por_estado.get(entrada['estado'], 0) + 1
+
+        resultado = {
+            'indice': entrada['indice'],
+            'entrada': entrada['entrada'],
+            'estado': entrada['estado']
+        }
+        if 'gasto' in entrada:
+            gasto = entrada['gasto']
+            resultado.update({
+                'monto': gasto['monto'],
+                'descripcion': gasto['descripcion'],
+                'categoria': gasto['categoria'],
+                'fecha': gasto['fecha'],
+                'tags': gasto['tags'],
+                'metodo_categorizacion': gasto['metodo_categorizacion'],
+                'idempotency_key': entrada['idempotency_key']
+            })
+        if 'error' in entrada:
+            resultado['error'] = entrada['error']
+        if 'omitido' in entrada:
+            resultado['motivo'] = entrada['omitido']
+        resultados.append(resultado)
+
+    return {
+        'total': len(entradas),
+        'por_estado': por_estado,
+        'categorizaciones': categorizaciones,
+        'segundos': round(time.time() - inicio, 3),
+        'resultados': resultados
+    }, None
@@ -0,0 +1,294 @@
+"""
+Expense Queue
+Cola persistente (SQLite) para registrar gastos en segundo plano.
+
+/registrar-gasto en modo asíncrono guarda aquí el gasto y responde al momento;
+un hilo trabajador lo procesa (extracción, categorización y POST a Firefly III)
+con reintentos y una clave de idempotencia por gasto.
+"""
+
+import sqlite3
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Callable
+
+from sqlite_store import db_path, get_connection, transaction, register_migrations
+
+DB_PATH = db_path('expense_queue.db')
+
+# Retry policy
+MAX_ATTEMPTS = int(os.getenv('EXPENSE_QUEUE_MAX_ATTEMPTS', 8))
+BASE_BACKOFF_SECONDS = 15
+MAX_BACKOFF_SECONDS = 3600
+
+# Worker wakes up at least this often to retry failed items
+POLL_INTERVAL_SECONDS = int(os.getenv('EXPENSE_QUEUE_POLL_SECONDS', 30))
+
+# An item claimed longer ago than this was left behind by a worker that died or
+# restarted mid-post, and is claimed again
+STALE_CLAIM_MINUTES = int(os.getenv('EXPENSE_QUEUE_STALE_MINUTES', 10))
+
+_wake_event = threading.Event()
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+register_migrations(DB_PATH, [
+    '''
+    CREATE TABLE IF NOT EXISTS expense_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TEXT NOT NULL,
+        last_error TEXT,
+        result TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_queue_status_next
+    ON expense_queue(status, next_attempt_at);
+    ''',
+    # When the worker took the item, to recover claims of a dead worker by age
+    '''
+    ALTER TABLE expense_queue ADD COLUMN claimed_at TEXT;
+    ''',
+])
+
+
+def init_db():
+    """Initialize the expense queue database"""
+    get_connection(DB_PATH)
+
+
+def enqueue_expense(payload: Dict, idempotency_key: Optional[str] = None):
+    """
+    Store an expense request in the queue
+
+    Args:
+        payload: Request body as received by /registrar-gasto
+        idempotency_key: Client-provided key (Siri retries reuse it). Generated if missing.
+
+    Returns:
+        Tuple (item dict, created) - created is False if the key was already queued
+    """
+    if not idempotency_key:
+        idempotency_key = uuid.uuid4().hex
+
+    now = _now()
+
+    try:
+        with transaction(DB_PATH) as conn:
+            conn.execute('''
+                INSERT INTO expense_queue
+                (idempotency_key, payload, status, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, 'pending', ?, ?, ?)
+            ''', (idempotency_key, json.dumps(payload, ensure_ascii=False), now, now, now))
+        created = True
+    except sqlite3.IntegrityError:
+        # Same key already queued: do not register the expense twice
+        created = False
+
+    if created:
+        wake_worker()
+
+    return get_expense_status(idempotency_key), created
+
+
+def claim_next_expense() -> Optional[Dict]:
+    """
+    Atomically take the next due item and mark it as 'processing'
+
+    Items stuck in 'processing' for STALE_CLAIM_MINUTES (their worker died) are
+    taken again. A fresh claim is never reset: another process's worker may be
+    posting it right now.
+
+    Returns:
+        Item dict or None if nothing is due
+    """
+    now = _now()
+    stale = (datetime.now() - timedelta(minutes=STALE_CLAIM_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+    with transaction(DB_PATH, immediate=True) as conn:
+        row = conn.execute('''
+            SELECT id, idempotency_key, payload, attempts, created_at
+            FROM expense_queue
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'processing' AND COALESCE(claimed_at, updated_at) < ?)
+            ORDER BY id
+            LIMIT 1
+        ''', (now, stale)).fetchone()
+
+        if not row:
+            return None
+
+        conn.execute('''
+            UPDATE expense_queue
+            SET status = 'processing', attempts = attempts + 1, claimed_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', (now, now, row[0]))
+
+    return {
+        'id': row[0],
+        'idempotency_key': row[1],
+        'payload': json.loads(row[2]),
+        'attempts': row[3] + 1,
+        'created_at': row[4]
+    }
+
+
+def update_expense_payload(item_id: int, payload: Dict):
+    """Persist the parsed expense so retries skip extraction/categorization"""
+    with transaction(DB_PATH) as conn:
+        conn.execute('''
+            UPDATE expense_queue SET payload = ?, updated_at = ? WHERE id = ?
+        ''', (json.dumps(payload, ensure_ascii=False), _now(), item_id))
+
+
+def mark_expense_done(item_id: int, result=None):
+    """Mark an item as registered in Firefly III"""
+    with transaction(DB_PATH) as conn:
+        conn.execute('''
+            UPDATE expense_queue
+            SET status = 'done', result = ?, last_error = NULL, updated_at = ?
+            WHERE id = ?
+        ''', (json.dumps(result, ensure_ascii=False, default=str), _now(), item_id))
+
+
+def mark_expense_failed(item_id: int, attempts: int, error: str, permanent: bool = False):
+    """
+    Record a failed attempt and schedule a retry with exponential backoff
+
+    Args:
+        item_id: Queue item ID
+        attempts: Attempts made so far (including this one)
+        error: Error message
+        permanent: If True (e.g. unparseable text), do not retry
+    """
+    if permanent or attempts >= MAX_ATTEMPTS:
+        status = 'failed'
+        next_attempt = _now()
+    else:
+        status = 'pending'
+        delay = min(BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)), MAX_BACKOFF_SECONDS)
+        next_attempt = (datetime.now() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+
+    with transaction(DB_PATH) as conn:
+        conn.execute('''
+            UPDATE expense_queue
+            SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', (status, str(error)[:1000], next_attempt, _now(), item_id))
+
+
+def _row_to_item(row) -> Dict:
+    item_id, key, payload, status, attempts, next_attempt_at, last_error, result, created_at, updated_at = row
+    return {
+        'id': item_id,
+        'idempotency_key': key,
+        'payload': json.loads(payload),
+        'status': status,
+        'attempts': attempts,
+        'next_attempt_at': next_attempt_at,
+        'last_error': last_error,
+        'result': json.loads(result) if result else None,
+        'created_at': created_at,
+        'updated_at': updated_at
+    }
+
+
+def get_expense_status(idempotency_key: str) -> Optional[Dict]:
+    """Get a queue item by its idempotency key"""
+    conn = get_connection(DB_PATH)
+    row = conn.execute('''
+        SELECT id, idempotency_key, payload, status, attempts, next_attempt_at,
+               last_error, result, created_at, updated_at
+        FROM expense_queue
+        WHERE idempotency_key = ?
+    ''', (idempotency_key,)).fetchone()
+
+    return _row_to_item(row) if row else None
+
+
+def get_queue_stats(recent_failed: int = 10) -> Dict:
+    """Get item counts by status and the most recent permanent failures"""
+    cursor = get_connection(DB_PATH).cursor()
+
+    cursor.execute('SELECT status, COUNT(*) FROM expense_queue GROUP BY status')
+    counts = {status: count for status, count in cursor.fetchall()}
+
+    cursor.execute('''
+        SELECT id, idempotency_key, payload, status, attempts, next_attempt_at,
+               last_error, result, created_at, updated_at
+        FROM expense_queue
+        WHERE status = 'failed'
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (recent_failed,))
+    failed = [_row_to_item(row) for row in cursor.fetchall()]
+
+    return {
+        'pending': counts.get('pending', 0),
+        'processing': counts.get('processing', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'recent_failed': failed
+    }
+
+
+# ========== BACKGROUND WORKER ==========
+
+def wake_worker():
+    """Wake the worker up so a new item is processed immediately"""
+    _wake_event.set()
+
+
+def start_worker(process_fn: Callable[[Dict], None], poll_interval: int = POLL_INTERVAL_SECONDS):
+    """
+    Start the background worker thread (only once per process)
+
+    Args:
+        process_fn: Called with each claimed item. It must mark the item as
+                    done/failed; exceptions are recorded as a failed attempt.
+        poll_interval: Seconds between checks for due retries
+    """
+    global _worker_thread
+
+    with _worker_lock:
+        if _worker_thread and _worker_thread.is_alive():
+            return _worker_thread
+
+        def _run():
+            print("🧵 Expense queue worker started")
+            while True:
+                try:
+                    while True:
+                        item = claim_next_expense()
+                        if not item:
+                            break
+                        try:
+                            process_fn(item)
+                        except Exception as e:
+                            print(f"   ❌ Error processing queued expense {item['id']}: {e}")
+                            mark_expense_failed(item['id'], item['attempts'], str(e))
+                except Exception as e:
+                    print(f"   ❌ Expense queue worker error: {e}")
+
+                _wake_event.wait(poll_interval)
+                _wake_event.clear()
+
+        _worker_thread = threading.Thread(target=_run, name='expense-queue-worker', daemon=True)
+        _worker_thread.start()
+        return _worker_thread
+
+
+# Initialize database on import
+init_db()
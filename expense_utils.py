@@ -3,17 +3,26 @@ Utilidades para categorización y registro de gastos
 """
 import re
 import requests
+import threading
+import time
 from datetime import datetime
 import os
 
+from keyword_matcher import KeywordMatcher, BOUNDARY_WORD
+from date_parser import extraer_fecha, MESES
+from firefly_catalog import get_firefly_catalog
+
 
 # Mapa de números en texto a dígitos
 NUMEROS_TEXTO = {
     'cero': 0, 'uno': 1, 'dos': 2, 'tres': 3, 'cuatro': 4,
     'cinco': 5, 'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9,
     'diez': 10, 'once': 11, 'doce': 12, 'trece': 13, 'catorce': 14,
-    'quince': 15, 'dieciséis': 16, 'diecisiete': 17, 'dieciocho': 18,
-    'diecinueve': 19, 'veinte': 20, 'treinta': 30, 'cuarenta': 40,
+    'quince': 15, 'dieciséis': 16, 'dieciseis': 16, 'diecisiete': 17, 'dieciocho': 18,
+    'diecinueve': 19, 'veinte': 20,
+    'veintiuno': 21, 'veintiún': 21, 'veintidós': 22, 'veintidos': 22, 'veintitrés': 23, 'veintitres': 23,
+    'veinticuatro': 24, 'veinticinco': 25, 'veintiséis': 26, 'veintiseis': 26,
+    'veintisiete': 27, 'veintiocho': 28, 'veintinueve': 29, 'treinta': 30, 'cuarenta': 40,
     'cincuenta': 50, 'sesenta': 60, 'setenta': 70, 'ochenta': 80,
     'noventa': 90, 'cien': 100, 'ciento': 100, 'doscientos': 200,
     'trescientos': 300, 'cuatrocientos': 400, 'quinientos': 500,
@@ -21,6 +30,10 @@ NUMEROS_TEXTO = {
     'novecientos': 900, 'mil': 1000
 }
 
+# Cuentas de Firefly III para los gastos registrados
+CUENTA_ORIGEN = "Fernando Garrido"
+CUENTA_DESTINO = "Cash"
+
 # Categorías conocidas para gastos (basadas en Firefly III)
 CATEGORIAS_CONOCIDAS = {
     'comida': ['mercadona', 'lidl', 'carrefour', 'supermercado', 'restaurante', 'comida', 'cena', 'almuerzo', 'desayuno', 'bar', 'cafetería'],
@@ -37,16 +50,17 @@ CATEGORIAS_CONOCIDAS = {
 }
 
 
+# Todas las palabras clave compiladas en una sola expresión (palabras completas, admite plurales)
+_CATEGORIAS_MATCHER = KeywordMatcher(
+    [(categoria.capitalize(), palabras) for categoria, palabras in CATEGORIAS_CONOCIDAS.items()],
+    boundary=BOUNDARY_WORD,
+    plurals=True
+)
+
+
 def categorizar_con_reglas(descripcion):
     """Categoriza usando reglas simples basadas en palabras clave"""
-    descripcion_lower = descripcion.lower()
-    
-    for categoria, palabras_clave in CATEGORIAS_CONOCIDAS.items():
-        for palabra in palabras_clave:
-            if palabra in descripcion_lower:
-                return categoria.capitalize()
-    
-    return None
+    return _CATEGORIAS_MATCHER.match(descripcion)
 
 
 def categorizar_con_ia(descripcion):
@@ -99,25 +113,78 @@ Responde SOLO con el nombre de la categoría, nada más."""
 
 
 def categorizar_gasto(descripcion):
-    """Categoriza un gasto usando reglas primero, luego IA si es necesario"""
+    """
+    Categoriza un gasto usando reglas primero, luego la caché y la IA si es necesario
+
+    Las correcciones del usuario guardadas en la caché tienen prioridad sobre las reglas.
+    Aciertos y fallos de la caché solo cuentan cuando las reglas no bastan.
+    """
+    from category_cache import get_category_cache, FUENTE_USUARIO
+    cache = get_category_cache()
+    en_cache = cache.lookup(descripcion, count=False)
+    
+    if en_cache and en_cache[1] == FUENTE_USUARIO:
+        cache.record_lookup(hit=True)
+        return en_cache[0], 'cache'
+    
     # Intentar con reglas simples primero
     categoria = categorizar_con_reglas(descripcion)
     
     if categoria:
         return categoria, 'reglas'
     
+    # Respuesta de la IA ya conocida para este comercio
+    cache.record_lookup(hit=bool(en_cache))
+    if en_cache:
+        return en_cache[0], 'cache'
+    
     # Si no funciona, usar IA
     categoria = categorizar_con_ia(descripcion)
     
     if categoria:
+        # Solo cachear respuestas válidas, no texto libre del modelo
+        if categoria.lower() in CATEGORIAS_CONOCIDAS or categoria == 'Otros':
+            cache.put(descripcion, categoria)
         return categoria, 'ia'
     
     # Si nada funciona, usar categoría por defecto
     return 'Otros', 'default'
 
 
-def registrar_en_firefly(monto, descripcion, categoria, fecha=None, tags=None):
-    """Registra el gasto en Firefly III con soporte para tags"""
+def registrar_correccion_categoria(descripcion, categoria):
+    """Guarda la categoría indicada por el usuario para que los próximos gastos iguales la usen"""
+    from category_cache import get_category_cache, FUENTE_USUARIO
+    get_category_cache().put(descripcion, categoria, FUENTE_USUARIO)
+
+
+def categoria_indicada_en_texto(texto, categoria):
+    """
+    True si categoria es la que el usuario escribió en el texto ("categoría Ocio")
+
+    Solo cuenta una categoría conocida: cualquier otra palabra tras "categoría" puede
+    ser parte de la descripción. Una categoría devuelta por la IA no cuenta.
+    """
+    indicada, _ = extraer_categoria_manual(texto)
+    return (bool(indicada) and indicada == categoria
+            and (indicada.lower() in CATEGORIAS_CONOCIDAS or indicada == 'Otros'))
+
+
+def aprender_categoria_usuario(gasto):
+    """
+    Tras registrar un gasto en Firefly III, guarda su categoría como corrección del
+    usuario si la indicó él (campo "categoria" o "categoría X" en el texto)
+    """
+    if gasto.get('categoria_usuario'):
+        registrar_correccion_categoria(gasto['descripcion'], gasto['categoria'])
+
+
+def registrar_en_firefly(monto, descripcion, categoria, fecha=None, tags=None, external_id=None):
+    """
+    Registra el gasto en Firefly III con soporte para tags
+
+    Si se pasa external_id (clave de idempotencia), se guarda en la transacción y
+    Firefly rechaza un segundo envío idéntico, de modo que los reintentos no duplican gastos.
+    """
     try:
         from config import get_config
         config = get_config()
@@ -132,23 +199,39 @@ def registrar_en_firefly(monto, descripcion, categoria, fecha=None, tags=None):
         if fecha is None:
             fecha = datetime.now().strftime('%Y-%m-%d')
         
-        # Construir transaccion
+        # Construir transaccion (con IDs del catálogo local si se conocen, así
+        # Firefly no tiene que resolver los nombres)
+        catalogo = get_firefly_catalog(firefly_url, firefly_token)
         transaction = {
             "type": "withdrawal",
             "date": fecha,
             "amount": str(monto),
             "description": descripcion,
-            "source_name": "Fernando Garrido",
-            "destination_name": "Cash",
-            "category_name": categoria
+            "destination_name": CUENTA_DESTINO
         }
         
+        origen_id = catalogo.find_id('accounts', CUENTA_ORIGEN, refresh_on_miss=False, tipo='asset')
+        if origen_id:
+            transaction["source_id"] = origen_id
+        else:
+            transaction["source_name"] = CUENTA_ORIGEN
+        
+        # Una categoría nueva la crea Firefly al registrar: no recargar el catálogo por ella
+        categoria_id = catalogo.find_id('categories', categoria, refresh_on_miss=False)
+        if categoria_id:
+            transaction["category_id"] = categoria_id
+        else:
+            transaction["category_name"] = categoria
+        
         # Agregar tags si existen
         if tags and len(tags) > 0:
             transaction["tags"] = tags
         
+        if external_id:
+            transaction["external_id"] = external_id
+        
         payload = {
-            "error_if_duplicate_hash": False,
+            "error_if_duplicate_hash": bool(external_id),
             "apply_rules": True,
             "fire_webhooks": True,
             "transactions": [transaction]
@@ -166,7 +249,10 @@ def registrar_en_firefly(monto, descripcion, categoria, fecha=None, tags=None):
         )
         
         if response.status_code in [200, 201]:
-            return True, response.json()
+            resultado = response.json()
+            if not categoria_id:
+                _aprender_categoria(catalogo, resultado)
+            return True, resultado
         else:
             return False, f"Error {response.status_code}: {response.text}"
             
@@ -174,6 +260,16 @@ def registrar_en_firefly(monto, descripcion, categoria, fecha=None, tags=None):
         return False, str(e)
 
 
+def _aprender_categoria(catalogo, respuesta):
+    """Añade al catálogo la categoría que Firefly resolvió (o creó) para la transacción"""
+    try:
+        split = respuesta['data']['attributes']['transactions'][0]
+        if split.get('category_id') and split.get('category_name'):
+            catalogo.add('categories', split['category_id'], split['category_name'])
+    except (KeyError, IndexError, TypeError):
+        pass
+
+
 def extraer_tags_del_texto(texto):
     """Extrae tags del texto (principalmente 'extraordinario')"""
     import re
@@ -191,96 +287,9 @@ def extraer_tags_del_texto(texto):
     return tags, texto_limpio
 
 
-def extraer_fecha_del_texto(texto):
-    """Extrae fecha del texto si está presente"""
-    from datetime import datetime, timedelta
-    import re
-    
-    texto_lower = texto.lower()
-    hoy = datetime.now()
-    
-    # Detectar "ayer"
-    if 'ayer' in texto_lower:
-        fecha = hoy - timedelta(days=1)
-        texto_limpio = re.sub(r'\bayer\b', '', texto, flags=re.IGNORECASE).strip()
-        return fecha.strftime('%Y-%m-%d'), texto_limpio
-    
-    # Detectar "anteayer"
-    if 'anteayer' in texto_lower or 'ante ayer' in texto_lower:
-        fecha = hoy - timedelta(days=2)
-        texto_limpio = re.sub(r'\b(anteayer|ante ayer)\b', '', texto, flags=re.IGNORECASE).strip()
-        return fecha.strftime('%Y-%m-%d'), texto_limpio
-    
-    # Detectar formato "10 diciembre", "15 enero", "1 de enero de 2026", etc.
-    meses = {
-        'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
-        'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
-        'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
-    }
-    
-    for mes_nombre, mes_num in meses.items():
-        # Buscar patrón "día de mes de año" (ej: "1 de enero de 2026")
-        pattern = rf'\b(\d{{1,2}})\s+de\s+{mes_nombre}\s+de\s+(\d{{4}})\b'
-        match = re.search(pattern, texto_lower)
-        if match:
-            dia = int(match.group(1))
-            año = int(match.group(2))
-            fecha = datetime(año, mes_num, dia)
-            texto_limpio = re.sub(pattern, '', texto, flags=re.IGNORECASE).strip()
-            return fecha.strftime('%Y-%m-%d'), texto_limpio
-        
-        # Buscar patrón "día mes año" (ej: "10 diciembre 2026")
-        pattern = rf'\b(\d{{1,2}})\s+{mes_nombre}\s+(\d{{4}})\b'
-        match = re.search(pattern, texto_lower)
-        if match:
-            dia = int(match.group(1))
-            año = int(match.group(2))
-            fecha = datetime(año, mes_num, dia)
-            texto_limpio = re.sub(pattern, '', texto, flags=re.IGNORECASE).strip()
-            return fecha.strftime('%Y-%m-%d'), texto_limpio
-        
-        # Buscar patrón "día mes" (ej: "10 diciembre")
-        pattern = rf'\b(\d{{1,2}})\s+{mes_nombre}\b'
-        match = re.search(pattern, texto_lower)
-        if match:
-            dia = int(match.group(1))
-            año = hoy.year
-            # Si el mes ya pasó este año, asumir año siguiente
-            if mes_num < hoy.month or (mes_num == hoy.month and dia < hoy.day):
-                año = hoy.year + 1
-            fecha = datetime(año, mes_num, dia)
-            texto_limpio = re.sub(pattern, '', texto, flags=re.IGNORECASE).strip()
-            return fecha.strftime('%Y-%m-%d'), texto_limpio
-    
-    # Detectar formato "DD/MM/YYYY" o "DD-MM-YYYY"
-    match = re.search(r'\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b', texto)
-    if match:
-        dia, mes, año = match.groups()
-        try:
-            fecha = datetime(int(año), int(mes), int(dia))
-            texto_limpio = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b', '', texto).strip()
-            return fecha.strftime('%Y-%m-%d'), texto_limpio
-        except:
-            pass
-    
-    # Detectar solo el mes (sin día) - retorna el 1 del mes
-    for mes_nombre, mes_num in meses.items():
-        # Buscar patrón solo mes (ej: "febrero", "marzo")
-        pattern = rf'^{mes_nombre}$|\b{mes_nombre}\b(?!\s+de|\s+\d)'
-        match = re.search(pattern, texto_lower)
-        if match:
-            dia = 1  # Primer día del mes
-            año = hoy.year
-            # Si el mes ya pasó este año, asumir año siguiente
-            if mes_num < hoy.month:
-                año = hoy.year + 1
-            fecha = datetime(año, mes_num, dia)
-            # Remover el mes del texto
-            texto_limpio = re.sub(rf'\b{mes_nombre}\b', '', texto, flags=re.IGNORECASE).strip()
-            return fecha.strftime('%Y-%m-%d'), texto_limpio
-    
-    # Si no se detecta fecha, devolver None y texto original
-    return None, texto
+def extraer_fecha_del_texto(texto, hoy=None):
+    """Extrae fecha del texto si está presente (ver date_parser; hoy: fecha de referencia)"""
+    return extraer_fecha(texto, hoy)
 
 
 def extraer_categoria_manual(texto):
@@ -297,7 +306,7 @@ def extraer_categoria_manual(texto):
     return None, texto
 
 
-def extraer_datos_con_ia(texto):
+def extraer_datos_con_ia(texto, hoy=None):
     """Usa ChatGPT para extraer monto, descripción, fecha, categoría y tags del texto"""
     # Primero extraer tags (extraordinario) del texto
     tags, texto_sin_tags = extraer_tags_del_texto(texto)
@@ -305,11 +314,11 @@ def extraer_datos_con_ia(texto):
     
     if not openai_api_key:
         # Si no hay API key, usar método tradicional
-        return extraer_monto_descripcion_regex(texto)
+        return extraer_monto_descripcion_regex(texto, hoy)
     
     try:
         from datetime import datetime
-        hoy = datetime.now().strftime('%Y-%m-%d')
+        hoy = (hoy or datetime.now()).strftime('%Y-%m-%d')
         
         categorias_str = ', '.join([cat.capitalize() for cat in CATEGORIAS_CONOCIDAS.keys()])
         
@@ -376,10 +385,10 @@ Si no se menciona categoría, usa null."""
         print(f"Error en IA para extracción: {e}")
     
     # Si falla IA, usar método tradicional
-    return extraer_monto_descripcion_regex(texto)
+    return extraer_monto_descripcion_regex(texto, hoy)
 
 
-def extraer_monto_descripcion_regex(texto):
+def extraer_monto_descripcion_regex(texto, hoy=None):
     """Extrae monto, descripción, fecha, categoría y tags del texto de voz usando regex"""
     # Primero extraer tags si existen (ej: extraordinario)
     tags, texto = extraer_tags_del_texto(texto)
@@ -388,7 +397,7 @@ def extraer_monto_descripcion_regex(texto):
     categoria_manual, texto = extraer_categoria_manual(texto)
     
     # Luego extraer fecha si existe
-    fecha, texto = extraer_fecha_del_texto(texto)
+    fecha, texto = extraer_fecha_del_texto(texto, hoy)
     
     # Buscar patrón: número (con o sin decimales) seguido de texto
     # Ejemplos: "25.50 Mercadona", "60 gasolina", "150 restaurante con Cris"
@@ -410,18 +419,346 @@ def extraer_monto_descripcion_regex(texto):
     return None, None, None, None, []
 
 
-def extraer_monto_descripcion(texto):
-    """Extrae monto, descripción, fecha y categoría del texto (usa IA si está disponible)"""
-    return extraer_datos_con_ia(texto)
+# Por debajo de esta confianza el parser local deja paso a la IA
+CONFIANZA_MINIMA = float(os.getenv('EXPENSE_PARSER_MIN_CONFIDENCE', 0.6))
 
+_MONEDA = {'euro', 'euros', 'eur', '€'}
+_CENTIMOS = {'céntimo', 'céntimos', 'centimo', 'centimos', 'cent', 'cents'}
+_PREPOSICIONES = {'de', 'del', 'en', 'para'}
+# "dos cafés y un croissant": el número inicial eran unidades, no el importe
+_ARTICULOS = {'un', 'una'}
+_NUMERO_RE = re.compile(r'\d+(?:[.,]\d{1,2})?')
+_IMPORTE_FINAL_RE = re.compile(r'^(.+?)\s+(\d+(?:[.,]\d{1,2})?)\s*(?:€|euros?|eur)?$', re.IGNORECASE)
 
-# ========== FUNCIONES PARA PRESUPUESTOS ==========
+# Confianza base según cómo se expresó el importe
+_CONFIANZA_FORMA = {'digitos': 0.95, 'palabras': 0.85, 'final': 0.75}
 
-MESES = {
-    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
-    'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
-    'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
-}
+
+def _leer_numero_hablado(tokens, i):
+    """
+    Lee un número escrito con palabras desde tokens[i] ("treinta y cinco", "mil doscientos")
+
+    Un número no puede seguir a otro de su mismo orden ("dos cincuenta" son dos
+    números: 2 y 50), así se pueden detectar los céntimos sin "euros" ni "con".
+
+    Returns:
+        Tuple (valor o None, índice siguiente)
+    """
+    total = 0
+    actual = 0
+    limite = float('inf')
+    inicio = i
+
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'y' and i > inicio and i + 1 < len(tokens) and tokens[i + 1] in NUMEROS_TEXTO:
+            i += 1
+            continue
+        valor = NUMEROS_TEXTO.get(token)
+        if valor is None or valor >= limite:
+            break
+
+        if valor == 1000:
+            total += (actual or 1) * 1000
+            actual = 0
+            limite = 1000
+        else:
+            actual += valor
+            if valor >= 100:
+                limite = 100
+            elif valor >= 20 and valor % 10 == 0:
+                limite = 10
+            else:
+                limite = 1
+        i += 1
+
+    if i == inicio:
+        return None, inicio
+    return total + actual, i
+
+
+def _leer_cantidad(tokens, i):
+    """Cantidad en cifras o palabras en tokens[i]: (valor, índice siguiente, forma)"""
+    if i >= len(tokens):
+        return None, i, None
+    if _NUMERO_RE.fullmatch(tokens[i]):
+        return float(tokens[i].replace(',', '.')), i + 1, 'digitos'
+    valor, siguiente = _leer_numero_hablado(tokens, i)
+    if valor is not None:
+        return float(valor), siguiente, 'palabras'
+    return None, i, None
+
+
+def extraer_importe(texto):
+    """
+    Extrae el importe del principio del texto
+
+    Entiende "25.50", "25,50€", "25 euros con 50", "dos euros cincuenta",
+    "treinta y cinco con veinte" o "ciento veinte euros".
+
+    Returns:
+        Tuple (monto o None, texto restante, forma: 'digitos' | 'palabras' | None)
+    """
+    texto = re.sub(r'(\d)€', r'\1 €', texto.strip())
+    originales = texto.split()
+    tokens = [t.lower() for t in originales]
+
+    monto, i, forma = _leer_cantidad(tokens, 0)
+    if monto is None:
+        return None, texto, None
+
+    # Solo céntimos: "cincuenta céntimos", "80 cents"
+    if i < len(tokens) and tokens[i] in _CENTIMOS:
+        return round(monto / 100, 2), ' '.join(originales[i + 1:]), forma
+
+    moneda = i < len(tokens) and tokens[i] in _MONEDA
+    if moneda:
+        i += 1
+    con = i < len(tokens) and tokens[i] == 'con'
+
+    # Céntimos: "25 euros 50", "25 con 50", "dos cincuenta"
+    if monto == int(monto) and (moneda or con or forma == 'palabras'):
+        centimos, j, forma_centimos = _leer_cantidad(tokens, i + 1 if con else i)
+        if (centimos is not None and centimos < 100 and centimos == int(centimos)
+                and (moneda or con or forma_centimos == 'palabras')):
+            monto += centimos / 100
+            i = j
+            if i < len(tokens) and tokens[i] in _CENTIMOS:
+                i += 1
+
+    if not moneda and i < len(tokens) and tokens[i] in _MONEDA:
+        i += 1
+
+    return round(monto, 2), ' '.join(originales[i:]), forma
+
+
+def extraer_gasto_local(texto, hoy=None):
+    """
+    Extrae monto, descripción, fecha, categoría y tags sin llamar a la IA
+
+    hoy es la fecha de referencia de "ayer", "el lunes"... (por defecto, hoy)
+
+    Returns:
+        Tuple ((monto, descripcion, fecha, categoria, tags), confianza 0-1)
+    """
+    tags, resto = extraer_tags_del_texto(texto)
+    categoria_manual, resto = extraer_categoria_manual(resto)
+    fecha, resto = extraer_fecha_del_texto(resto, hoy)
+
+    monto, descripcion, forma = extraer_importe(resto)
+    if monto is None:
+        # "Mercadona 25.50"
+        match = _IMPORTE_FINAL_RE.match(resto.strip())
+        if match:
+            monto = float(match.group(2).replace(',', '.'))
+            descripcion, forma = match.group(1), 'final'
+
+    palabras = descripcion.split() if monto is not None else []
+    while palabras and palabras[0].lower() in _PREPOSICIONES:
+        palabras.pop(0)
+    descripcion = ' '.join(palabras)
+
+    if monto is None or monto <= 0 or not descripcion:
+        return (None, None, None, None, []), 0.0
+
+    confianza = _CONFIANZA_FORMA[forma]
+    if re.search(r'\d', descripcion):
+        # Cifras sueltas en la descripción: importe o fecha mal entendidos
+        confianza -= 0.4
+    if any(p.lower() in NUMEROS_TEXTO for p in palabras):
+        confianza -= 0.3
+    elif forma == 'palabras' and any(p.lower() in _ARTICULOS for p in palabras):
+        confianza -= 0.3
+    if len(palabras) > 6:
+        confianza -= 0.2
+
+    return (monto, descripcion, fecha, categoria_manual, tags), round(max(confianza, 0.0), 2)
+
+
+_metricas_parser = {}
+_metricas_lock = threading.Lock()
+
+
+def _registrar_latencia(ruta, inicio):
+    """Acumula la latencia de una extracción por ruta (local / ia)"""
+    ms = (time.perf_counter() - inicio) * 1000
+    with _metricas_lock:
+        metrica = _metricas_parser.setdefault(ruta, {'llamadas': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        metrica['llamadas'] += 1
+        metrica['total_ms'] += ms
+        metrica['max_ms'] = max(metrica['max_ms'], ms)
+
+
+def obtener_metricas_parser():
+    """Llamadas y latencia (media y máxima, en ms) por ruta de extracción"""
+    with _metricas_lock:
+        return {
+            'confianza_minima': CONFIANZA_MINIMA,
+            'rutas': {
+                ruta: {
+                    'llamadas': m['llamadas'],
+                    'media_ms': round(m['total_ms'] / m['llamadas'], 2),
+                    'max_ms': round(m['max_ms'], 2)
+                }
+                for ruta, m in _metricas_parser.items()
+            }
+        }
+
+
+def extraer_monto_descripcion(texto, hoy=None):
+    """
+    Extrae monto, descripción, fecha, categoría y tags del texto
+
+    Primero con el parser local; solo si la confianza es baja se consulta la IA.
+    hoy es la fecha de referencia de las fechas relativas (por defecto, hoy).
+    """
+    inicio = time.perf_counter()
+    datos, confianza = extraer_gasto_local(texto, hoy)
+
+    if confianza >= CONFIANZA_MINIMA:
+        _registrar_latencia('local', inicio)
+        return datos
+
+    if not os.getenv('OPENAI_API_KEY', ''):
+        _registrar_latencia('local_baja_confianza', inicio)
+        return datos
+
+    print(f"   🤖 Confianza local {confianza} < {CONFIANZA_MINIMA}, extrayendo con IA")
+    datos = extraer_datos_con_ia(texto, hoy)
+    _registrar_latencia('ia', inicio)
+    return datos
+
+
+def preparar_gasto(data, hoy=None):
+    """
+    Extrae y categoriza un gasto a partir del body de /registrar-gasto
+
+    Acepta {"texto": "25.50 Mercadona"} o {"monto": 25.50, "descripcion": "Mercadona", ...}
+
+    hoy: fecha de referencia de las fechas relativas ("ayer", "el lunes"...). Si se
+    indica (gastos encolados: el día en que se encolaron), un gasto sin fecha queda
+    con esa fecha en vez de la del momento en que se registre en Firefly.
+
+    Devuelve (gasto, error): gasto es un dict listo para registrar_en_firefly
+    y error un mensaje para el usuario si los datos no son válidos.
+    """
+    fecha_gasto = None
+    categoria_manual = None
+    categoria_usuario = False
+    tags_gasto = []
+
+    # Opción 1: Texto completo (desde Siri)
+    if 'texto' in data:
+        resultado_extraccion = extraer_monto_descripcion(data['texto'], hoy)
+
+        # Manejar ambos casos: con o sin tags
+        if len(resultado_extraccion) == 5:
+            monto, descripcion, fecha_gasto, categoria_manual, tags_gasto = resultado_extraccion
+        else:
+            monto, descripcion, fecha_gasto, categoria_manual = resultado_extraccion
+            tags_gasto = []
+
+        # Validar que si hay tag "extraordinario", debe haber fecha
+        if 'Extraordinario' in tags_gasto and fecha_gasto is None:
+            return None, 'Los gastos extraordinarios DEBEN incluir fecha. Ejemplo: "500 viaje extraordinario 15 febrero"'
+
+        if monto is None or descripcion is None:
+            return None, 'No se pudo extraer monto y descripción del texto. Formato esperado: "25.50 Mercadona"'
+
+        categoria_usuario = categoria_indicada_en_texto(data['texto'], categoria_manual)
+
+    # Opción 2: Monto y descripción separados
+    elif 'monto' in data and 'descripcion' in data:
+        monto = float(data['monto'])
+        descripcion = data['descripcion']
+        fecha_gasto = data.get('fecha')  # Opcional
+        categoria_manual = data.get('categoria')  # Opcional
+        categoria_usuario = bool(categoria_manual)
+        tags_gasto = data.get('tags', [])  # Opcional
+
+    else:
+        return None, 'Faltan datos. Envía "texto" o "monto" + "descripcion"'
+
+    if fecha_gasto is None and hoy is not None:
+        fecha_gasto = hoy.strftime('%Y-%m-%d')
+
+    # Agregar tag a la descripción si existe
+    descripcion_con_tag = descripcion
+    if 'Extraordinario' in tags_gasto:
+        descripcion_con_tag = f"{descripcion} [EXTRAORDINARIO]"
+
+    # Categorizar (usar categoría manual si existe, sino categorizar automáticamente).
+    # La corrección del usuario se aprende al registrarse el gasto (aprender_categoria_usuario)
+    if categoria_manual:
+        categoria = categoria_manual
+        metodo = 'manual'
+    else:
+        categoria, metodo = categorizar_gasto(descripcion)
+
+    return {
+        'monto': monto,
+        'descripcion': descripcion,
+        'descripcion_firefly': descripcion_con_tag,
+        'fecha': fecha_gasto,
+        'categoria': categoria,
+        'metodo_categorizacion': metodo,
+        'categoria_usuario': categoria_usuario,
+        'tags': tags_gasto
+    }, None
+
+
+def procesar_gasto_encolado(item):
+    """
+    Procesa un gasto de la cola asíncrona (expense_queue)
+
+    La primera vez extrae y categoriza el texto y guarda el resultado en la cola;
+    los reintentos solo repiten el envío a Firefly III con la misma clave de idempotencia.
+    Las fechas ("ayer", "el lunes" o ninguna) se resuelven respecto al día en que se
+    encoló el gasto, no al del intento, y se guardan ya concretas.
+    """
+    from expense_queue import update_expense_payload, mark_expense_done, mark_expense_failed
+
+    payload = item['payload']
+    gasto = payload.get('gasto')
+    encolado = datetime.strptime(item['created_at'], '%Y-%m-%d %H:%M:%S')
+
+    if gasto is None:
+        gasto, error = preparar_gasto(payload, hoy=encolado)
+        if error:
+            print(f"   ❌ Gasto encolado {item['id']} inválido: {error}")
+            mark_expense_failed(item['id'], item['attempts'], error, permanent=True)
+            return
+        payload['gasto'] = gasto
+        update_expense_payload(item['id'], payload)
+    elif gasto['fecha'] is None:
+        # Encolado antes de que se guardara la fecha concreta
+        gasto['fecha'] = encolado.strftime('%Y-%m-%d')
+        update_expense_payload(item['id'], payload)
+
+    exito, resultado = registrar_en_firefly(
+        gasto['monto'],
+        gasto['descripcion_firefly'],
+        gasto['categoria'],
+        gasto['fecha'],
+        gasto['tags'],
+        external_id=item['idempotency_key']
+    )
+
+    if exito:
+        print(f"   ✅ Gasto encolado {item['id']} registrado: {gasto['monto']} EUR - {gasto['descripcion']}")
+        aprender_categoria_usuario(gasto)
+        mark_expense_done(item['id'], {'gasto': gasto, 'firefly_response': resultado})
+    elif 'duplicate' in str(resultado).lower():
+        # Un intento anterior llegó a Firefly aunque no recibimos respuesta
+        print(f"   ✅ Gasto encolado {item['id']} ya estaba registrado en Firefly III")
+        aprender_categoria_usuario(gasto)
+        mark_expense_done(item['id'], {'gasto': gasto, 'firefly_response': 'duplicado'})
+    else:
+        print(f"   ⚠️ Gasto encolado {item['id']} no registrado (intento {item['attempts']}): {resultado}")
+        mark_expense_failed(item['id'], item['attempts'], resultado)
+
+
+# ========== FUNCIONES PARA PRESUPUESTOS ==========
 
 def extraer_presupuesto_datos(texto):
     """
@@ -488,18 +825,11 @@ def buscar_o_crear_budget(concepto):
             'Accept': 'application/json'
         }
         
-        # 1. Buscar si ya existe el budget
-        response = requests.get(
-            f'{firefly_url}/api/v1/budgets',
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            budgets = response.json().get('data', [])
-            for budget in budgets:
-                if budget['attributes']['name'].lower() == concepto.lower():
-                    return budget['id'], None
+        # 1. Buscar si ya existe el budget (catálogo local, se recarga si no aparece)
+        catalogo = get_firefly_catalog(firefly_url, firefly_token)
+        budget_id = catalogo.find_id('budgets', concepto)
+        if budget_id:
+            return budget_id, None
         
         # 2. Si no existe, crear el budget
         payload = {
@@ -516,6 +846,7 @@ def buscar_o_crear_budget(concepto):
         
         if response.status_code in [200, 201]:
             budget_id = response.json()['data']['id']
+            catalogo.add('budgets', budget_id, concepto)
             return budget_id, None
         else:
             return None, f"Error al crear budget: {response.status_code} - {response.text}"
@@ -0,0 +1,498 @@
+"""
+Fake CalDAV Server
+Local stand-in for iCloud Calendar, to load-test iCloudCalendarClient
+
+Serves configurable calendars (thousands of VEVENTs, recurring ones included)
+over the subset of CalDAV the caldav library uses:
+
+- PROPFIND: current-user-principal, calendar-home-set and the calendar list
+- REPORT calendar-query with a time-range and/or a UID text-match, honouring
+  <expand>: recurring events (RRULE, EXDATE) are expanded server side into
+  instances with RECURRENCE-ID, in UTC, as iCloud does
+- PUT / GET / DELETE of single events (create_event)
+
+Every request is counted per method, with the time spent serving it, so a
+client run can be measured in round trips (bench_caldav.py):
+
+    server = FakeCalDAVServer({'Calendario': synthetic_calendar(5000)}).start()
+    os.environ['ICLOUD_CALDAV_URL'] = server.url
+    ...
+    server.stats()  # {'requests': 4, 'PROPFIND': 3, 'REPORT': 1, 'objects': 40, 'instances': 52, 'server_ms': ...}
+
+Standalone (stats at /_stats, /_stats?reset=1 to reset them):
+
+    python3.11 fake_caldav.py [events] [port] [latency_ms]
+    ICLOUD_CALDAV_URL=http://127.0.0.1:5232/ ICLOUD_USERNAME=x ICLOUD_APP_PASSWORD=x python3.11 get_today_events.py
+
+No authentication: any credentials are accepted.
+"""
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import pytz
+from dateutil.rrule import rruleset, rrulestr
+from icalendar import Calendar
+
+DAV = 'DAV:'
+CALDAV = 'urn:ietf:params:xml:ns:caldav'
+
+PRINCIPAL_PATH = '/principals/user/'
+HOME_PATH = '/calendars/user/'
+
+# Recurrence properties replaced by the instances when expanding
+RECURRENCE_PROPS = {'DTSTART', 'DTEND', 'DURATION', 'RRULE', 'RDATE', 'EXDATE', 'EXRULE', 'RECURRENCE-ID'}
+
+TIMEZONE = pytz.timezone('Europe/Madrid')
+
+SUMMARIES = ['Reunión de equipo', 'Médico', 'Dentista', 'Llamada con cliente', 'Recoger paquete',
+             'Gimnasio', 'Comida familiar', 'Clase de inglés', 'Visita piso', 'Revisión coche',
+             'Cumpleaños', 'Limpieza', 'Fontanero', 'Entrega llaves']
+
+
+def _ical_time(dt, all_day=False) -> str:
+    if all_day:
+        return dt.strftime('%Y%m%d')
+    return dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _parse_ical_time(value: str) -> datetime:
+    return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+
+
+def _as_datetime(value) -> datetime:
+    """Aware datetime of a DTSTART/DTEND value (dates at midnight UTC, floating times in Madrid)"""
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    if value.tzinfo is None:
+        return TIMEZONE.localize(value)
+    return value
+
+
+def _content_lines(ical: str) -> List[str]:
+    """Unfolded content lines"""
+    return re.sub(r'\r?\n[ \t]', '', ical).splitlines()
+
+
+class StoredEvent:
+    """One calendar object resource (a VEVENT and its recurrence rule)"""
+
+    __slots__ = ('uid', 'ical', 'etag', 'start', 'duration', 'all_day', 'rule', 'lines')
+
+    def __init__(self, ical: str):
+        component = next(c for c in Calendar.from_ical(ical).walk() if c.name == 'VEVENT')
+        self.uid = str(component['uid'])
+        self.ical = ical
+        self.etag = f'"{abs(hash(ical))}"'
+
+        dtstart = component['dtstart'].dt
+        self.all_day = not isinstance(dtstart, datetime)
+        self.start = _as_datetime(dtstart)
+        if component.get('dtend'):
+            self.duration = _as_datetime(component['dtend'].dt) - self.start
+        elif component.get('duration'):
+            self.duration = component['duration'].dt
+        else:
+            self.duration = timedelta(days=1) if self.all_day else timedelta(0)
+
+        self.rule = None
+        self.lines = None
+        if component.get('rrule'):
+            # Expanded on wall-clock times, so instances keep their hour across DST changes
+            self.rule = rruleset()
+            rule = component['rrule'].to_ical().decode()
+            rule = re.sub(r'UNTIL=(\d{8}T\d{6})Z',
+                          lambda m: 'UNTIL=' + self._wall(_parse_ical_time(m.group(1) + 'Z')).strftime('%Y%m%dT%H%M%S'),
+                          rule)
+            self.rule.rrule(rrulestr(rule, dtstart=self._wall(self.start)))
+            # DTSTART is always an instance, even off the rule (RFC 5545)
+            self.rule.rdate(self._wall(self.start))
+            exdates = component.get('exdate', [])
+            for exdate in exdates if isinstance(exdates, list) else [exdates]:
+                for value in exdate.dts:
+                    self.rule.exdate(self._wall(_as_datetime(value.dt)))
+            # VEVENT lines kept in every instance
+            lines = _content_lines(component.to_ical().decode())
+            self.lines = [line for line in lines[1:-1]
+                          if re.split('[;:]', line, 1)[0].upper() not in RECURRENCE_PROPS]
+
+    def _wall(self, dt: datetime) -> datetime:
+        """Naive wall-clock time in the event's timezone"""
+        return dt.astimezone(self.start.tzinfo).replace(tzinfo=None)
+
+    def _localize(self, wall: datetime) -> datetime:
+        tz = self.start.tzinfo
+        return tz.localize(wall) if hasattr(tz, 'localize') else wall.replace(tzinfo=tz)
+
+    def instances(self, start: datetime, end: datetime) -> List[datetime]:
+        """Start of every occurrence overlapping [start, end)"""
+        if self.rule is None:
+            occurrences = [self.start]
+        else:
+            occurrences = [self._localize(wall) for wall in
+                           self.rule.between(self._wall(start - self.duration), self._wall(end), inc=True)]
+        return [occurrence for occurrence in occurrences
+                if occurrence < end and (occurrence + self.duration > start
+                                         or (not self.duration and occurrence >= start))]
+
+    def expanded(self, occurrences: List[datetime]) -> str:
+        """The resource with its occurrences as separate VEVENTs (RFC 4791 expand)"""
+        if self.rule is None:
+            return self.ical
+        parts = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//fake_caldav//EN']
+        value = ';VALUE=DATE' if self.all_day else ''
+        for occurrence in occurrences:
+            parts.append('BEGIN:VEVENT')
+            parts.extend(self.lines)
+            parts.append(f'RECURRENCE-ID{value}:{_ical_time(occurrence, self.all_day)}')
+            parts.append(f'DTSTART{value}:{_ical_time(occurrence, self.all_day)}')
+            parts.append(f'DTEND{value}:{_ical_time(occurrence + self.duration, self.all_day)}')
+            parts.append('END:VEVENT')
+        parts.append('END:VCALENDAR')
+        return '\r\n'.join(parts) + '\r\n'
+
+
+class FakeCalendar:
+    def __init__(self, name: str, slug: str, events: List[str]):
+        self.name = name
+        self.path = f'{HOME_PATH}{slug}/'
+        self.events: Dict[str, StoredEvent] = {}
+        for ical in events:
+            self.put(ical)
+
+    def put(self, ical: str, href: Optional[str] = None) -> StoredEvent:
+        event = StoredEvent(ical)
+        self.events[href or f'{event.uid}.ics'] = event
+        return event
+
+    def query(self, start: Optional[datetime], end: Optional[datetime], expand: bool, uid: Optional[str] = None):
+        """(href, calendar-data) of the events overlapping the range (and whose UID contains uid)"""
+        for href, event in self.events.items():
+            if uid is not None and uid.lower() not in event.uid.lower():
+                continue
+            if start is None or end is None:
+                yield href, event.ical
+                continue
+            occurrences = event.instances(start, end)
+            if occurrences:
+                yield href, event.expanded(occurrences) if expand else event.ical
+
+
+def synthetic_calendar(count: int, seed: int = 0, recurring: float = 0.2, days: int = 180,
+                       today: Optional[date] = None) -> List[str]:
+    """
+    Calendar of `count` events spread over +-days around today
+
+    A share (`recurring`) are recurring: daily or weekly (on one or two
+    weekdays), bounded by COUNT or UNTIL, some with an EXDATE. A few are all-day.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.now(TIMEZONE).date()
+    events = []
+    for n in range(count):
+        day = today + timedelta(days=rng.randint(-days, days))
+        summary = rng.choice(SUMMARIES)
+        lines = [f'UID:fake-{seed}-{n}@fake-caldav', f'SUMMARY:{summary}', 'DTSTAMP:20260101T000000Z']
+
+        if rng.random() < 0.03:
+            lines += [f'DTSTART;VALUE=DATE:{day:%Y%m%d}', f'DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}']
+        else:
+            start = datetime.combine(day, datetime.min.time()).replace(hour=rng.randint(7, 20),
+                                                                      minute=rng.choice([0, 15, 30, 45]))
+            end = start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120]))
+            lines += [f'DTSTART;TZID=Europe/Madrid:{start:%Y%m%dT%H%M%S}',
+                      f'DTEND;TZID=Europe/Madrid:{end:%Y%m%dT%H%M%S}']
+
+            if rng.random() < recurring:
+                if rng.random() < 0.4:
+                    rule = 'FREQ=DAILY'
+                    span = rng.randint(3, 30)
+                else:
+                    weekdays = rng.sample(['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'], rng.choice([1, 1, 2]))
+                    rule = f"FREQ=WEEKLY;BYDAY={','.join(weekdays)}"
+                    span = rng.randint(4, 52)
+                if rng.random() < 0.5:
+                    rule += f';COUNT={span}'
+                else:
+                    until = TIMEZONE.localize(start + timedelta(days=span * (1 if 'DAILY' in rule else 7)))
+                    rule += f';UNTIL={_ical_time(until)}'
+                lines.append(f'RRULE:{rule}')
+                if rng.random() < 0.2:
+                    skipped = start + timedelta(days=1 if 'DAILY' in rule else 7)
+                    lines.append(f'EXDATE;TZID=Europe/Madrid:{skipped:%Y%m%dT%H%M%S}')
+
+        events.append('\r\n'.join(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//fake_caldav//EN',
+                                   'BEGIN:VEVENT'] + lines + ['END:VEVENT', 'END:VCALENDAR']) + '\r\n')
+    return events
+
+
+def _multistatus(responses: List[str]) -> bytes:
+    return (f'<?xml version="1.0" encoding="utf-8"?>\n<d:multistatus xmlns:d="{DAV}" xmlns:c="{CALDAV}">'
+            + ''.join(responses) + '</d:multistatus>').encode('utf-8')
+
+
+def _response(href: str, found: Dict[str, str], missing: List[str] = ()) -> str:
+    """One <response> with the found properties (tag -> XML) and the missing ones"""
+    propstats = []
+    if found:
+        propstats.append(f"<d:propstat><d:prop>{''.join(found.values())}</d:prop>"
+                         f"<d:status>HTTP/1.1 200 OK</d:status></d:propstat>")
+    if missing:
+        props = ''.join(f'<x:{tag.split("}")[1]} xmlns:x="{tag[1:].split("}")[0]}"/>' for tag in missing)
+        propstats.append(f"<d:propstat><d:prop>{props}</d:prop>"
+                         f"<d:status>HTTP/1.1 404 Not Found</d:status></d:propstat>")
+    return f"<d:response><d:href>{quote(href)}</d:href>{''.join(propstats)}</d:response>"
+
+
+class FakeCalDAVServer:
+    """Threaded CalDAV server on localhost with request counters"""
+
+    def __init__(self, calendars: Dict[str, List[str]], port: int = 0, latency_ms: float = 0):
+        """
+        Args:
+            calendars: Calendar display name -> events (iCalendar texts)
+            port: Port to listen on (0: any free port)
+            latency_ms: Delay added to every request (network round trip)
+        """
+        self.calendars = {
+            f"{HOME_PATH}cal{n}/": FakeCalendar(name, f"cal{n}", events)
+            for n, (name, events) in enumerate(calendars.items())
+        }
+        self.latency_ms = latency_ms
+        self._counts = Counter()
+        self._server_ms = 0.0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/"
+
+    def start(self) -> 'FakeCalDAVServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self) -> Dict:
+        """
+        Requests served (total and per method), calendar objects and VEVENT
+        instances returned by REPORTs, and time spent serving them
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            server_ms = self._server_ms
+        return {'requests': sum(n for key, n in counts.items() if key.isupper()),
+                'objects': 0, 'instances': 0, **counts, 'server_ms': round(server_ms, 2)}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+            self._server_ms = 0.0
+
+    def _count(self, method: str, elapsed_ms: float):
+        with self._lock:
+            self._counts[method] += 1
+            self._server_ms += elapsed_ms
+
+    # --- Resources -------------------------------------------------------
+
+    def _find(self, path: str):
+        """(calendar, event href) of a path; either may be None"""
+        for calendar_path, calendar in self.calendars.items():
+            if path == calendar_path:
+                return calendar, None
+            if path.startswith(calendar_path):
+                return calendar, path[len(calendar_path):]
+        return None, None
+
+    def _properties(self, path: str) -> Dict[str, str]:
+        """Properties of a resource (Clark tag -> XML)"""
+        props = {
+            f'{{{DAV}}}current-user-principal':
+                f'<d:current-user-principal><d:href>{PRINCIPAL_PATH}</d:href></d:current-user-principal>',
+            f'{{{CALDAV}}}calendar-home-set':
+                f'<c:calendar-home-set><d:href>{HOME_PATH}</d:href></c:calendar-home-set>',
+        }
+        calendar, href = self._find(path)
+        if calendar and href:
+            props[f'{{{DAV}}}getetag'] = f'<d:getetag>{calendar.events[href].etag}</d:getetag>'
+            props[f'{{{DAV}}}resourcetype'] = '<d:resourcetype/>'
+        elif calendar:
+            props[f'{{{DAV}}}resourcetype'] = '<d:resourcetype><d:collection/><c:calendar/></d:resourcetype>'
+            props[f'{{{DAV}}}displayname'] = f'<d:displayname>{escape(calendar.name)}</d:displayname>'
+            props[f'{{{CALDAV}}}supported-calendar-component-set'] = (
+                '<c:supported-calendar-component-set><c:comp name="VEVENT"/></c:supported-calendar-component-set>')
+        else:
+            props[f'{{{DAV}}}resourcetype'] = '<d:resourcetype><d:collection/></d:resourcetype>'
+        return props
+
+    def propfind(self, path: str, body: bytes, depth: str) -> bytes:
+        requested = None
+        if body:
+            prop = ET.fromstring(body).find(f'{{{DAV}}}prop')
+            if prop is not None:
+                requested = [child.tag for child in prop]
+
+        paths = [path]
+        if depth == '1':
+            if path == HOME_PATH:
+                paths += list(self.calendars)
+            elif path in self.calendars:
+                paths += [path + href for href in self.calendars[path].events]
+
+        responses = []
+        for resource in paths:
+            props = self._properties(resource)
+            if requested is None:
+                responses.append(_response(resource, props))
+            else:
+                responses.append(_response(resource, {tag: props[tag] for tag in requested if tag in props},
+                                           [tag for tag in requested if tag not in props]))
+        return _multistatus(responses)
+
+    def report(self, path: str, body: bytes) -> bytes:
+        calendar = self.calendars.get(path)
+        if calendar is None:
+            return _multistatus([])
+        query = ET.fromstring(body)
+
+        # Only VEVENT queries match anything here
+        names = [comp.get('name') for comp in query.iter(f'{{{CALDAV}}}comp-filter')]
+        if len(names) > 1 and names[1] != 'VEVENT':
+            return _multistatus([])
+
+        start = end = None
+        time_range = query.find(f'.//{{{CALDAV}}}time-range')
+        if time_range is not None:
+            start = _parse_ical_time(time_range.get('start'))
+            end = _parse_ical_time(time_range.get('end'))
+        expand = query.find(f'.//{{{CALDAV}}}expand') is not None
+        uid = None
+        for prop_filter in query.iter(f'{{{CALDAV}}}prop-filter'):
+            text_match = prop_filter.find(f'{{{CALDAV}}}text-match')
+            if prop_filter.get('name', '').upper() == 'UID' and text_match is not None:
+                uid = text_match.text or ''
+
+        responses = []
+        instances = 0
+        for href, data in calendar.query(start, end, expand, uid):
+            instances += data.count('BEGIN:VEVENT')
+            responses.append(_response(path + href, {
+                'etag': f'<d:getetag>{calendar.events[href].etag}</d:getetag>',
+                'data': f'<c:calendar-data>{escape(data)}</c:calendar-data>',
+            }))
+        with self._lock:
+            self._counts['objects'] += len(responses)
+            self._counts['instances'] += instances
+        return _multistatus(responses)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes: without this, delayed ACKs
+            # add ~40 ms to every keep-alive request
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b'', content_type: str = 'application/xml; charset=utf-8',
+                      headers: Optional[Dict[str, str]] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _serve(self):
+                parts = urlsplit(self.path)
+                path = unquote(parts.path)
+                if path == '/_stats':
+                    if 'reset' in parse_qs(parts.query):
+                        server.reset_stats()
+                    return self._send(200, json.dumps(server.stats()).encode(), 'application/json')
+
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                started = time.perf_counter()
+                response = self._dispatch(path, self._body())
+                # Counted before answering, so the client never sees its request uncounted
+                server._count(self.command, (time.perf_counter() - started) * 1000)
+                self._send(*response)
+
+            def _dispatch(self, path: str, body: bytes) -> tuple:
+                """Response to a request: _send arguments"""
+                method = self.command
+                if method == 'PROPFIND':
+                    if path not in ('/', PRINCIPAL_PATH, HOME_PATH) and server._find(path) == (None, None):
+                        return (404,)
+                    return 207, server.propfind(path, body, self.headers.get('Depth', '0'))
+                if method == 'REPORT':
+                    return 207, server.report(path, body)
+                if method == 'OPTIONS':
+                    return 200, b'', 'text/plain', {'DAV': '1, 2, calendar-access',
+                                                  'Allow': 'OPTIONS, GET, PUT, DELETE, PROPFIND, REPORT'}
+
+                calendar, href = server._find(path)
+                if not calendar or not href:
+                    return (404,)
+                if method in ('GET', 'HEAD'):
+                    event = calendar.events.get(href)
+                    if not event:
+                        return (404,)
+                    return 200, event.ical.encode('utf-8'), 'text/calendar; charset=utf-8', {'ETag': event.etag}
+                if method == 'PUT':
+                    existed = href in calendar.events
+                    event = calendar.put(body.decode('utf-8'), href)
+                    return 204 if existed else 201, b'', 'text/plain', {'ETag': event.etag}
+                if method == 'DELETE':
+                    return (204 if calendar.events.pop(href, None) else 404,)
+                return (405,)
+
+            do_GET = do_HEAD = do_PUT = do_DELETE = do_OPTIONS = do_PROPFIND = do_REPORT = _serve
+
+        return Handler
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5232
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    print(f"📅 Generating {count} events per calendar...")
+    server = FakeCalDAVServer({
+        'Calendario': synthetic_calendar(count, seed=1),
+        'Casa Juana Doña': synthetic_calendar(count, seed=2),
+    }, port=port, latency_ms=latency)
+    print(f"✅ Fake CalDAV server on {server.url} (latency {latency:g} ms, stats at {server.url}_stats)")
+    print(f"   ICLOUD_CALDAV_URL={server.url} ICLOUD_USERNAME=x ICLOUD_APP_PASSWORD=x python3.11 get_today_events.py")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,240 @@
+"""
+Firefly Catalog
+Caché local de presupuestos, categorías y cuentas de Firefly III
+
+Los nombres se normalizan (minúsculas, sin acentos, espacios simples) y se indexan
+en un dict, así que resolver "Comida" o "comida " a su ID no cuesta una petición.
+Las cuentas se indexan por tipo y nombre (Firefly solo los hace únicos por tipo).
+Cada tipo se recarga entero (todas las páginas) cuando caduca el TTL, en segundo
+plano, o cuando se busca un nombre desconocido, con un intervalo mínimo entre
+recargas. Las peticiones a Firefly nunca se hacen con el lock del catálogo tomado.
+"""
+
+import os
+import threading
+import time
+import unicodedata
+from typing import Dict, Optional
+
+import requests
+
+TTL_SECONDS = int(os.getenv('FIREFLY_CATALOG_TTL', 3600))
+
+# A miss reloads the catalogue at most this often
+MIN_REFRESH_SECONDS = int(os.getenv('FIREFLY_CATALOG_MIN_REFRESH', 60))
+
+PAGE_SIZE = 200
+
+# kind -> (endpoint, params)
+KINDS = {
+    'budgets': ('budgets', {}),
+    'categories': ('categories', {}),
+    'accounts': ('accounts', {'type': 'all'}),
+}
+
+
+def normalizar_nombre(nombre: str) -> str:
+    """'  Comída ' -> 'comida'"""
+    texto = unicodedata.normalize('NFKD', str(nombre).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+class FireflyCatalog:
+    """Name -> object lookups for Firefly III budgets, categories and accounts"""
+
+    def __init__(self, base_url: str, token: str, ttl: int = TTL_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.headers = {
+            'Authorization': f'Bearer {token}',
+            'Accept': 'application/json'
+        }
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._por_nombre = {kind: {} for kind in KINDS}
+        self._cargado = {kind: 0.0 for kind in KINDS}
+        self._listo = {kind: False for kind in KINDS}  # loaded at least once
+        self._en_segundo_plano = {kind: False for kind in KINDS}
+        self._lock = threading.Lock()
+        # One load per kind at a time; requests are made without holding _lock
+        self._carga_locks = {kind: threading.Lock() for kind in KINDS}
+
+    @staticmethod
+    def _clave(kind: str, nombre: str, tipo: Optional[str] = None):
+        """
+        Index key: the normalised name, plus the type for accounts
+
+        Firefly account names are unique per type only: "Cash" can be both an
+        asset and an expense account.
+        """
+        if kind == 'accounts':
+            return (tipo, normalizar_nombre(nombre))
+        return normalizar_nombre(nombre)
+
+    def _fetch_all(self, kind: str):
+        """Every page of a Firefly list endpoint"""
+        endpoint, params = KINDS[kind]
+        items = []
+        page = 1
+
+        while True:
+            response = requests.get(
+                f'{self.base_url}/api/v1/{endpoint}',
+                headers=self.headers,
+                params={**params, 'page': page, 'limit': PAGE_SIZE},
+                timeout=10
+            )
+            response.raise_for_status()
+            data = response.json()
+            items.extend(data.get('data', []))
+
+            pagination = data.get('meta', {}).get('pagination', {})
+            if page >= pagination.get('total_pages', 1):
+                return items
+            page += 1
+
+    def _refresh(self, kind: str, visto: float) -> bool:
+        """
+        Reload one kind (must be called without holding _lock)
+
+        visto is the load time the caller saw: if another thread reloaded the
+        kind meanwhile, it is not fetched again.
+        """
+        with self._carga_locks[kind]:
+            if self._cargado[kind] != visto:
+                return self._listo[kind]
+
+            try:
+                items = self._fetch_all(kind)
+            except Exception as e:
+                print(f"❌ Error loading Firefly {kind}: {e}")
+                # Do not hammer Firefly while it is failing
+                with self._lock:
+                    self._cargado[kind] = time.time() - self.ttl + MIN_REFRESH_SECONDS
+                return False
+
+            por_nombre = {}
+            for item in items:
+                attrs = item.get('attributes', {})
+                entrada = {'id': str(item['id']), 'name': attrs.get('name', ''), 'type': attrs.get('type')}
+                # Keep the first one if two objects share a key
+                por_nombre.setdefault(self._clave(kind, entrada['name'], entrada['type']), entrada)
+
+            with self._lock:
+                self._por_nombre[kind] = por_nombre
+                self._cargado[kind] = time.time()
+                self._listo[kind] = True
+                self.refreshes += 1
+            return True
+
+    def _refresh_in_background(self, kind: str, visto: float):
+        """Reload a kind in a thread, meanwhile lookups use the expired entries"""
+        with self._lock:
+            if self._en_segundo_plano[kind]:
+                return
+            self._en_segundo_plano[kind] = True
+
+        def recargar():
+            try:
+                self._refresh(kind, visto)
+            finally:
+                with self._lock:
+                    self._en_segundo_plano[kind] = False
+
+        threading.Thread(target=recargar, name=f'firefly-catalog-{kind}', daemon=True).start()
+
+    def find(self, kind: str, nombre: str, refresh_on_miss: bool = True,
+             tipo: Optional[str] = None) -> Optional[Dict]:
+        """
+        Find an object by name
+
+        When the TTL expires the kind is reloaded in the background and the old
+        entries keep answering; only the first load, and a reload on a miss,
+        wait for Firefly.
+
+        Args:
+            kind: 'budgets', 'categories' or 'accounts'
+            nombre: Name as written by the user (case and accents ignored)
+            refresh_on_miss: Reload the catalogue once if the name is unknown
+            tipo: Account type ('asset', 'expense', 'revenue'...), required for accounts
+
+        Returns:
+            Dict with 'id', 'name' and 'type', or None
+        """
+        if kind == 'accounts' and not tipo:
+            raise ValueError("Account lookups need the account type")
+        if not normalizar_nombre(nombre):
+            return None
+        clave = self._clave(kind, nombre, tipo)
+
+        with self._lock:
+            cargado = self._cargado[kind]
+            listo = self._listo[kind]
+        edad = time.time() - cargado
+
+        if edad > self.ttl:
+            if listo:
+                self._refresh_in_background(kind, cargado)
+            else:
+                self._refresh(kind, cargado)
+                edad = 0
+
+        with self._lock:
+            cargado = self._cargado[kind]
+            entrada = self._por_nombre[kind].get(clave)
+
+        if entrada is None and refresh_on_miss and edad > MIN_REFRESH_SECONDS:
+            self._refresh(kind, cargado)
+            with self._lock:
+                entrada = self._por_nombre[kind].get(clave)
+
+        with self._lock:
+            if entrada is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entrada
+
+    def find_id(self, kind: str, nombre: str, refresh_on_miss: bool = True,
+                tipo: Optional[str] = None) -> Optional[str]:
+        entrada = self.find(kind, nombre, refresh_on_miss, tipo)
+        return entrada['id'] if entrada else None
+
+    def add(self, kind: str, object_id, nombre: str, tipo: Optional[str] = None):
+        """Record an object just created in Firefly, without reloading"""
+        with self._lock:
+            self._por_nombre[kind][self._clave(kind, nombre, tipo)] = {
+                'id': str(object_id), 'name': nombre, 'type': tipo
+            }
+
+    def invalidate(self, kind: Optional[str] = None):
+        """Force a reload of one kind (or all) on next lookup"""
+        with self._lock:
+            for k in ([kind] if kind else KINDS):
+                self._cargado[k] = 0.0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'ttl': self.ttl,
+            'entries': {kind: len(entradas) for kind, entradas in self._por_nombre.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_firefly_catalog(base_url: str, token: str) -> FireflyCatalog:
+    """Process-wide catalogue for a Firefly instance"""
+    clave = (base_url.rstrip('/'), token)
+    with _catalogs_lock:
+        if clave not in _catalogs:
+            _catalogs[clave] = FireflyCatalog(base_url, token)
+        return _catalogs[clave]
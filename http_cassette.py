@@ -0,0 +1,318 @@
+"""
+HTTP Cassette
+Record/replay of the HTTP traffic of the Todoist, Firefly and iCloud (CalDAV) clients
+
+All of them go through requests (caldav's DAVClient uses a requests session), so
+one hook on requests' HTTPAdapter.send captures everything:
+
+- record: requests go out as usual and every response is kept, scrubbed of
+  secrets (auth headers and cookies, token-like query params and the values of
+  secret environment variables such as TODOIST_API_TOKEN or ICLOUD_APP_PASSWORD).
+  The JSON cassette is written once, on uninstall() or at exit
+- replay: nothing goes out. Responses come from the cassette, in recorded
+  order for repeated requests, after an injected latency
+  (HTTP_REPLAY_LATENCY_MS: milliseconds, or 'recorded' for the recorded times).
+  A request never recorded fails with a ConnectionError, like a network error.
+
+Requests are matched on method, URL and body; if the body differs (a CalDAV
+query for another date range), on method and URL only.
+
+Run any script with it, without changing the script:
+
+    python3.11 http_cassette.py record data/cassettes/day.json cronograma_generator_v7_5.py
+    HTTP_REPLAY_LATENCY_MS=recorded python3.11 http_cassette.py replay data/cassettes/day.json cronograma_generator_v7_5.py
+
+In replay the clients still need their credentials set, to any value.
+"""
+
+import atexit
+import base64
+import hashlib
+import json
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+REDACTED = '<redacted>'
+
+# Headers never written to a cassette
+SECRET_HEADERS = {'authorization', 'proxy-authorization', 'cookie', 'set-cookie', 'x-api-key'}
+
+# Recorded bodies are stored decoded: these no longer describe them
+TRANSPORT_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+
+SECRET_PARAMS = {'token', 'access_token', 'api_key', 'apikey', 'key', 'password', 'secret'}
+
+# Environment variables whose values are replaced by <NAME> everywhere
+SECRET_ENV = re.compile(r'TOKEN|PASSWORD|SECRET|_KEY$|USERNAME')
+EXTRA_SECRET_ENV = [name for name in os.getenv('HTTP_CASSETTE_SCRUB', '').split(',') if name]
+
+# Shorter values would replace too much
+MIN_SECRET_LENGTH = 4
+
+_original_send = HTTPAdapter.send
+_active: Optional['Cassette'] = None
+
+
+def _longest_first(secrets: Dict[str, str]) -> Dict[str, str]:
+    return dict(sorted(secrets.items(), key=lambda item: -len(item[0])))
+
+
+def _secret_values() -> Dict[str, str]:
+    """Secret value -> placeholder"""
+    return _longest_first({
+        value: f'<{name}>'
+        for name, value in os.environ.items()
+        if (SECRET_ENV.search(name) or name in EXTRA_SECRET_ENV) and len(value) >= MIN_SECRET_LENGTH
+    })
+
+
+def scrub_text(text: str, secrets: Dict[str, str]) -> str:
+    for value, placeholder in secrets.items():
+        if value in text:
+            text = text.replace(value, placeholder)
+    return text
+
+
+def scrub_url(url: str, secrets: Dict[str, str]) -> str:
+    parts = urlsplit(url)
+    query = urlencode([
+        (name, REDACTED if name.lower() in SECRET_PARAMS else value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+    ])
+    return scrub_text(urlunsplit(parts._replace(query=query)), secrets)
+
+
+def scrub_headers(headers, secrets: Dict[str, str], drop=()) -> Dict[str, str]:
+    return {
+        name: REDACTED if name.lower() in SECRET_HEADERS else scrub_text(str(value), secrets)
+        for name, value in headers.items()
+        if name.lower() not in drop
+    }
+
+
+def _body_bytes(body) -> bytes:
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    # Streamed bodies (files, generators) are not matched on
+    return b''
+
+
+class Cassette:
+    """Recorded interactions of one run, matched by request"""
+
+    def __init__(self, path: str, mode: str, latency: Union[None, float, str] = None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions: List[Dict] = []
+        self.stats = {'recorded': 0, 'replayed': 0, 'replayed_by_url': 0, 'missed': 0}
+        self._secrets = _secret_values()
+        self._lock = threading.Lock()
+        # Replay queues: exact key and (method, url) -> interactions in recorded order
+        self._by_key = defaultdict(list)
+        self._by_url = defaultdict(list)
+        self._used = defaultdict(int)
+
+        if mode == 'replay':
+            with open(path, encoding='utf-8') as f:
+                self.interactions = json.load(f)['interactions']
+            for interaction in self.interactions:
+                request = interaction['request']
+                self._by_key[(request['method'], request['url'], request['body_sha256'])].append(interaction)
+                self._by_url[(request['method'], request['url'])].append(interaction)
+
+    def _request_record(self, request) -> Dict:
+        body = scrub_text(_body_bytes(request.body).decode('utf-8', 'replace'), self._secrets)
+        return {
+            'method': request.method,
+            'url': scrub_url(request.url, self._secrets),
+            'headers': scrub_headers(request.headers, self._secrets),
+            'body_sha256': hashlib.sha256(body.encode('utf-8')).hexdigest(),
+        }
+
+    def _learn_secrets(self, request):
+        """Credentials a request sends (auth headers, token params) are scrubbed wherever they appear"""
+        values = [value for name, value in request.headers.items() if name.lower() in SECRET_HEADERS]
+        # 'Bearer <token>', 'Basic <credentials>'
+        values += [value.split(' ', 1)[1] for value in values if ' ' in value]
+        values += [value for name, value in parse_qsl(urlsplit(request.url).query) if name.lower() in SECRET_PARAMS]
+        new = {value: REDACTED for value in values if len(value) >= MIN_SECRET_LENGTH and value not in self._secrets}
+        if new:
+            self._secrets = _longest_first({**self._secrets, **new})
+
+    def _next(self, queues, key) -> Optional[Dict]:
+        """Next recorded interaction of a queue (the last one repeats)"""
+        queue = queues.get(key)
+        if not queue:
+            return None
+        used = self._used[(id(queues), key)]
+        self._used[(id(queues), key)] = used + 1
+        return queue[min(used, len(queue) - 1)]
+
+    def record(self, adapter, request, **kwargs):
+        started = time.perf_counter()
+        response = _original_send(adapter, request, **kwargs)
+        content = response.content
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._learn_secrets(request)
+
+        try:
+            body, encoded = scrub_text(content.decode('utf-8'), self._secrets), False
+        except UnicodeDecodeError:
+            body, encoded = base64.b64encode(content).decode('ascii'), True
+
+        with self._lock:
+            self.interactions.append({
+                'request': self._request_record(request),
+                'response': {
+                    'status': response.status_code,
+                    'reason': response.reason,
+                    'headers': scrub_headers(response.headers, self._secrets, drop=TRANSPORT_HEADERS),
+                    'body': body,
+                    'base64': encoded,
+                },
+                'elapsed_ms': elapsed_ms,
+            })
+            self.stats['recorded'] += 1
+        return response
+
+    def replay(self, adapter, request, **kwargs):
+        recorded = self._request_record(request)
+        with self._lock:
+            interaction = self._next(self._by_key, (recorded['method'], recorded['url'], recorded['body_sha256']))
+            if interaction:
+                self.stats['replayed'] += 1
+            else:
+                interaction = self._next(self._by_url, (recorded['method'], recorded['url']))
+                self.stats['replayed_by_url' if interaction else 'missed'] += 1
+
+        if not interaction:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded response for {recorded['method']} {recorded['url']} in {self.path}",
+                request=request
+            )
+
+        if self.latency == 'recorded':
+            time.sleep(interaction['elapsed_ms'] / 1000)
+        elif self.latency:
+            time.sleep(float(self.latency) / 1000)
+
+        data = interaction['response']
+        response = requests.Response()
+        response.status_code = data['status']
+        response.reason = data['reason']
+        response.headers = CaseInsensitiveDict(data['headers'])
+        response._content = base64.b64decode(data['body']) if data['base64'] else data['body'].encode('utf-8')
+        response._content_consumed = True
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        # Used by requests' auth handlers to resend after a 401
+        response.connection = adapter
+        return response
+
+    def save(self):
+        """Write the recorded interactions (the whole file, atomically)"""
+        with self._lock:
+            interactions = list(self.interactions)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'interactions': interactions}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+def _send(adapter, request, **kwargs):
+    cassette = _active
+    if cassette is None:
+        return _original_send(adapter, request, **kwargs)
+    if cassette.mode == 'record':
+        return cassette.record(adapter, request, **kwargs)
+    return cassette.replay(adapter, request, **kwargs)
+
+
+def _latency_from_env() -> Union[None, float, str]:
+    value = os.getenv('HTTP_REPLAY_LATENCY_MS', '0')
+    return 'recorded' if value == 'recorded' else float(value)
+
+
+def install(path: str, mode: str, latency: Union[None, float, str] = None) -> Cassette:
+    """
+    Route every requests call through a cassette until uninstall()
+
+    Args:
+        path: Cassette file (JSON). Recording starts a new one.
+        mode: 'record' or 'replay'
+        latency: Replay delay per request: milliseconds, 'recorded', or None
+                 for HTTP_REPLAY_LATENCY_MS
+    """
+    global _active
+    if _active is not None:
+        uninstall()
+    _active = Cassette(path, mode, _latency_from_env() if latency is None else latency)
+    HTTPAdapter.send = _send
+    if mode == 'record':
+        # Scripts that exit without uninstall() still leave their cassette
+        atexit.register(_active.save)
+    return _active
+
+
+def uninstall():
+    """Stop routing requests through the cassette (a recording is saved here)"""
+    global _active
+    HTTPAdapter.send = _original_send
+    active, _active = _active, None
+    if active is not None and active.mode == 'record':
+        atexit.unregister(active.save)
+        active.save()
+
+
+@contextmanager
+def cassette(path: str, mode: str, latency: Union[None, float, str] = None):
+    """with cassette('data/cassettes/todoist.json', 'replay'): ..."""
+    active = install(path, mode, latency)
+    try:
+        yield active
+    finally:
+        uninstall()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] not in ('record', 'replay'):
+        print("Usage: python3.11 http_cassette.py record|replay <cassette.json> <script.py> [args...]")
+        sys.exit(2)
+
+    mode, path, script = sys.argv[1:4]
+    active = install(path, mode)
+    latency = f"{active.latency:g} ms" if isinstance(active.latency, float) else active.latency
+    print(f"📼 HTTP cassette: {mode} {path}" + (f" (latency: {latency})" if mode == 'replay' and active.latency else ""))
+
+    # The script sees its own name and arguments
+    sys.argv = [script] + sys.argv[4:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        stats = active.stats
+        uninstall()
+        print(f"\n📼 HTTP cassette {mode}: {stats['recorded']} recorded, {stats['replayed']} replayed, "
+              f"{stats['replayed_by_url']} replayed by URL, {stats['missed']} missed")
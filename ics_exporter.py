@@ -1,23 +1,171 @@
 """
 ICS (iCalendar) Exporter
 Exports cronograma to ICS format for Google Calendar import
+
+Event UIDs are derived from the Todoist task id and the date, so re-importing a
+regenerated day updates its events instead of duplicating them. publish() keeps
+the SEQUENCE/LAST-MODIFIED of every UID in a local store; the /calendar.ics
+subscription feed is built from that store (see iter_feed_ics).
+
+Output is produced by generators (iter_calendar) that yield one folded VEVENT at
+a time, so week or month exports are streamed to a file or HTTP response
+instead of being built in memory.
 """
 
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
+import hashlib
+import json
+import os
 import uuid
 
+from sqlite_store import db_path, get_connection, transaction, register_migrations
+
+FEED_DB_PATH = db_path('ics_feed.db')
+
+# Days before today still served by the subscription feed
+FEED_DAYS_BACK = int(os.getenv('ICS_FEED_DAYS_BACK', 14))
+
+# Stored events older than this are deleted on publish
+FEED_KEEP_DAYS = 90
+
+# Namespace for the deterministic event UIDs
+UID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, 'cronograma.generator')
+
+UID_DOMAIN = 'cronograma'
+
+register_migrations(FEED_DB_PATH, [
+    """
+    CREATE TABLE IF NOT EXISTS ics_events (
+        uid TEXT PRIMARY KEY,
+        date TEXT NOT NULL,
+        event TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        sequence INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'CONFIRMED',
+        created_at TEXT NOT NULL,
+        last_modified TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_ics_events_date ON ics_events(date);
+    CREATE INDEX IF NOT EXISTS idx_ics_events_modified ON ics_events(last_modified);
+    """,
+])
+
+# ICS timestamps (UTC)
+ICS_UTC_FORMAT = "%Y%m%dT%H%M%SZ"
+
+CALENDAR_HEADER = [
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//Cronograma Generator//ES",
+    "CALSCALE:GREGORIAN",
+    "METHOD:PUBLISH",
+    "X-WR-CALNAME:Cronograma Diario",
+    "X-WR-TIMEZONE:Europe/Madrid",
+    "X-WR-CALDESC:Cronograma generado automáticamente desde Todoist"
+]
+
+# Timezone definition for Europe/Madrid
+MADRID_VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Madrid",
+    "BEGIN:STANDARD",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "END:STANDARD",
+    "BEGIN:DAYLIGHT",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "END:DAYLIGHT",
+    "END:VTIMEZONE"
+]
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).strftime(ICS_UTC_FORMAT)
+
+
+def _fingerprint(event: Dict) -> str:
+    return hashlib.sha1(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# RFC 5545 3.1: content lines are at most 75 octets, excluding the CRLF
+MAX_LINE_OCTETS = 75
+
+
+def fold_line(line: str) -> str:
+    """
+    Fold a content line to 75 octets and terminate it with CRLF
+
+    Continuation lines start with a space (which counts towards their 75 octets).
+    Lines are split on UTF-8 character boundaries, never inside a character.
+    """
+    # Fast path: a str of n characters is at most 4n octets
+    if len(line) * 4 <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+    data = line.encode("utf-8")
+    if len(data) <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+
+    parts = []
+    start = 0
+    limit = MAX_LINE_OCTETS
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # Step back over UTF-8 continuation bytes (10xxxxxx)
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode("utf-8"))
+        start = end
+        limit = MAX_LINE_OCTETS - 1
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def iter_calendar(vevents: Iterable[List[str]]) -> Iterator[str]:
+    """
+    Stream a VCALENDAR: header, one folded chunk per VEVENT, footer
+
+    Args:
+        vevents: Iterable of unfolded VEVENT line lists (may be a generator)
+    """
+    yield "".join(fold_line(line) for line in CALENDAR_HEADER + MADRID_VTIMEZONE)
+    for vevent in vevents:
+        yield "".join(fold_line(line) for line in vevent)
+    yield fold_line("END:VCALENDAR")
+
+
+def write_ics(filename: str, chunks: Iterable[str]) -> int:
+    """
+    Write streamed ICS chunks to a file
+
+    Returns:
+        Number of bytes written
+    """
+    written = 0
+    # newline="" keeps the CRLF line endings untouched
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        for chunk in chunks:
+            written += f.write(chunk)
+    return written
+
 
 class ICSExporter:
     """Export cronograma events to ICS format"""
     
     def __init__(self):
         self.events = []
+        # uid -> (sequence, last_modified, status) after publish()
+        self._states = {}
     
     def add_event(self, title: str, start_time: str, end_time: str, 
                   description: str = "", location: str = "", 
                   priority: str = "P4", task_type: str = "General",
-                  url: str = ""):
+                  url: str = "", task_id: str = ""):
         """
         Add an event to the calendar
         
@@ -30,6 +178,8 @@ class ICSExporter:
             priority: Priority level (P1-P4)
             task_type: Type of task (Física, Intelectual, etc.)
             url: URL to the task
+            task_id: Todoist task ID, used for the event UID. Events without
+                     one (free time, meals) are identified by title and start time.
         """
         event = {
             "title": title,
@@ -39,7 +189,8 @@ class ICSExporter:
             "location": location,
             "priority": priority,
             "task_type": task_type,
-            "url": url
+            "url": url,
+            "task_id": str(task_id) if task_id else ""
         }
         self.events.append(event)
     
@@ -53,53 +204,124 @@ class ICSExporter:
         Returns:
             ICS file content as string
         """
+        return "".join(self.iter_ics(date))
+    
+    def iter_ics(self, date: str = None) -> Iterator[str]:
+        """
+        Stream ICS file content, one folded VEVENT per chunk
+        
+        Args:
+            date: Date in YYYY-MM-DD format. If None, uses today.
+        """
         if date is None:
             date = datetime.now().strftime("%Y-%m-%d")
         
-        # Parse the date
+        return iter_calendar(self._iter_vevents(date))
+    
+    def _iter_vevents(self, date: str) -> Iterator[List[str]]:
         event_date = datetime.strptime(date, "%Y-%m-%d")
+        now_str = _utc_now()
         
-        # ICS header
-        ics_content = [
-            "BEGIN:VCALENDAR",
-            "VERSION:2.0",
-            "PRODID:-//Cronograma Generator//ES",
-            "CALSCALE:GREGORIAN",
-            "METHOD:PUBLISH",
-            "X-WR-CALNAME:Cronograma Diario",
-            "X-WR-TIMEZONE:Europe/Madrid",
-            "X-WR-CALDESC:Cronograma generado automáticamente desde Todoist"
-        ]
+        for uid, event in self._events_with_uids(date):
+            sequence, last_modified, status = self._states.get(uid, (0, now_str, "CONFIRMED"))
+            yield self._create_event_ics(
+                event, event_date, uid=uid, sequence=sequence,
+                last_modified=last_modified, dtstamp=now_str, status=status
+            )
+    
+    def _events_with_uids(self, date: str) -> List[Tuple[str, Dict]]:
+        """
+        Pair each event with its deterministic UID
         
-        # Add timezone definition for Europe/Madrid
-        ics_content.extend([
-            "BEGIN:VTIMEZONE",
-            "TZID:Europe/Madrid",
-            "BEGIN:STANDARD",
-            "DTSTART:19701025T030000",
-            "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
-            "TZOFFSETFROM:+0200",
-            "TZOFFSETTO:+0100",
-            "END:STANDARD",
-            "BEGIN:DAYLIGHT",
-            "DTSTART:19700329T020000",
-            "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
-            "TZOFFSETFROM:+0100",
-            "TZOFFSETTO:+0200",
-            "END:DAYLIGHT",
-            "END:VTIMEZONE"
-        ])
-        
-        # Add events
+        The key is the task id (or title and start time) plus the date; a task
+        split into several blocks gets an occurrence suffix from the second
+        block on, so the first block keeps the same UID.
+        """
+        seen = {}
+        result = []
         for event in self.events:
-            ics_content.extend(self._create_event_ics(event, event_date))
+            key = event.get("task_id") or f"{event['title']}@{event['start_time']}"
+            occurrence = seen.get(key, 0)
+            seen[key] = occurrence + 1
+            name = f"{key}:{date}" + (f"#{occurrence}" if occurrence else "")
+            result.append((f"{uuid.uuid5(UID_NAMESPACE, name)}@{UID_DOMAIN}", event))
+        return result
+    
+    def publish(self, date: str = None) -> Dict:
+        """
+        Record this day's events in the feed store
         
-        # ICS footer
-        ics_content.append("END:VCALENDAR")
+        Changed events get SEQUENCE+1 and a new LAST-MODIFIED; events published
+        earlier for the same date that are no longer scheduled are kept as
+        CANCELLED so subscribed calendars remove them.
         
-        return "\r\n".join(ics_content)
+        Args:
+            date: Date in YYYY-MM-DD format. If None, uses today.
+            
+        Returns:
+            Dict with 'added', 'changed', 'cancelled' and 'unchanged' counts
+        """
+        if date is None:
+            date = datetime.now().strftime("%Y-%m-%d")
+        now_str = _utc_now()
+        counts = {'added': 0, 'changed': 0, 'cancelled': 0, 'unchanged': 0}
+        
+        events = self._events_with_uids(date)
+        
+        with transaction(FEED_DB_PATH, immediate=True) as conn:
+            stored = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    "SELECT uid, fingerprint, sequence, status, last_modified FROM ics_events WHERE date = ?",
+                    (date,)
+                )
+            }
+            
+            for uid, event in events:
+                fingerprint = _fingerprint(event)
+                if uid not in stored:
+                    conn.execute("""
+                        INSERT INTO ics_events (uid, date, event, fingerprint, sequence, status, created_at, last_modified)
+                        VALUES (?, ?, ?, ?, 0, 'CONFIRMED', ?, ?)
+                    """, (uid, date, json.dumps(event, ensure_ascii=False), fingerprint, now_str, now_str))
+                    self._states[uid] = (0, now_str, "CONFIRMED")
+                    counts['added'] += 1
+                    continue
+                
+                old_fingerprint, sequence, status, last_modified = stored[uid]
+                if old_fingerprint == fingerprint and status == "CONFIRMED":
+                    self._states[uid] = (sequence, last_modified, status)
+                    counts['unchanged'] += 1
+                    continue
+                
+                conn.execute("""
+                    UPDATE ics_events
+                    SET event = ?, fingerprint = ?, sequence = ?, status = 'CONFIRMED', last_modified = ?
+                    WHERE uid = ?
+                """, (json.dumps(event, ensure_ascii=False), fingerprint, sequence + 1, now_str, uid))
+                self._states[uid] = (sequence + 1, now_str, "CONFIRMED")
+                counts['changed'] += 1
+            
+            current = {uid for uid, _ in events}
+            gone = [
+                uid for uid, (_, _, status, _) in stored.items()
+                if uid not in current and status != "CANCELLED"
+            ]
+            conn.executemany("""
+                UPDATE ics_events
+                SET sequence = sequence + 1, status = 'CANCELLED', last_modified = ?
+                WHERE uid = ?
+            """, [(now_str, uid) for uid in gone])
+            counts['cancelled'] = len(gone)
+            
+            cutoff = (datetime.now() - timedelta(days=FEED_KEEP_DAYS)).strftime("%Y-%m-%d")
+            conn.execute("DELETE FROM ics_events WHERE date < ?", (cutoff,))
+        
+        return counts
     
-    def _create_event_ics(self, event: Dict, event_date: datetime) -> List[str]:
+    def _create_event_ics(self, event: Dict, event_date: datetime, uid: str,
+                          sequence: int = 0, last_modified: Optional[str] = None,
+                          dtstamp: Optional[str] = None, status: str = "CONFIRMED") -> List[str]:
         """Create ICS event entry"""
         
         # Parse start and end times
@@ -110,13 +332,14 @@ class ICSExporter:
         start_dt = event_date.replace(hour=start_hour, minute=start_min, second=0, microsecond=0)
         end_dt = event_date.replace(hour=end_hour, minute=end_min, second=0, microsecond=0)
         
-        # Format for ICS (UTC format)
+        # Events ending after midnight end on the next day
+        if end_dt < start_dt:
+            end_dt += timedelta(days=1)
+        
+        # Local times, interpreted in the Europe/Madrid VTIMEZONE
         start_str = start_dt.strftime("%Y%m%dT%H%M%S")
         end_str = end_dt.strftime("%Y%m%dT%H%M%S")
-        now_str = datetime.now().strftime("%Y%m%dT%H%M%SZ")
-        
-        # Generate unique ID
-        uid = str(uuid.uuid4())
+        now_str = None if dtstamp and last_modified else _utc_now()
         
         # Build description
         description_parts = []
@@ -139,13 +362,15 @@ class ICSExporter:
         event_ics = [
             "BEGIN:VEVENT",
             f"UID:{uid}",
-            f"DTSTAMP:{now_str}",
+            f"DTSTAMP:{dtstamp or now_str}",
+            f"LAST-MODIFIED:{last_modified or now_str}",
+            f"SEQUENCE:{sequence}",
             f"DTSTART;TZID=Europe/Madrid:{start_str}",
             f"DTEND;TZID=Europe/Madrid:{end_str}",
             f"SUMMARY:{self._escape_text(event['title'])}",
             f"DESCRIPTION:{self._escape_text(description)}",
             f"PRIORITY:{ics_priority}",
-            f"STATUS:CONFIRMED",
+            f"STATUS:{status}",
             f"TRANSP:OPAQUE"
         ]
         
@@ -180,9 +405,145 @@ class ICSExporter:
             filename: Output filename
             date: Date in YYYY-MM-DD format
         """
-        ics_content = self.generate_ics(date)
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(ics_content)
+        write_ics(filename, self.iter_ics(date))
+
+
+
+def _feed_range(since: Optional[str], until: Optional[str]) -> Tuple[str, str]:
+    """Default feed range: FEED_DAYS_BACK days ago, open-ended"""
+    if since is None:
+        since = (datetime.now() - timedelta(days=FEED_DAYS_BACK)).strftime("%Y-%m-%d")
+    return since, until or "9999-12-31"
+
+
+def get_feed_version(since: Optional[str] = None, until: Optional[str] = None,
+                     include_shared: bool = True) -> Tuple[str, Optional[datetime]]:
+    """
+    Cheap version of the subscription feed, without rendering it
+
+    Args:
+        since/until: Date range (YYYY-MM-DD, inclusive)
+        include_shared: Include events copied from the shared calendar
+
+    Returns:
+        (etag, last_modified) where last_modified is a UTC datetime or None if empty
+    """
+    since, until = _feed_range(since, until)
+    conn = get_connection(FEED_DB_PATH)
+    count, sequences, last_modified = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(sequence), 0), MAX(last_modified) FROM ics_events WHERE date BETWEEN ? AND ?",
+        (since, until)
+    ).fetchone()
+
+    version = f"{since}:{until}:{count}:{sequences}:{last_modified}"
+    if include_shared:
+        from events_db import get_copied_events_version
+        shared_count, shared_modified = get_copied_events_version(since, until)
+        version += f":{shared_count}:{shared_modified}"
+        if shared_modified:
+            shared_modified = _iso_to_ics_utc(shared_modified)
+            last_modified = max(filter(None, [last_modified, shared_modified]))
+
+    etag = hashlib.sha1(version.encode('utf-8')).hexdigest()
+    if last_modified:
+        last_modified = datetime.strptime(last_modified, ICS_UTC_FORMAT).replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def _iso_to_ics_utc(value: str) -> str:
+    """Local ISO timestamp (as stored by events_db) -> ICS UTC timestamp"""
+    return datetime.fromisoformat(value).astimezone(timezone.utc).strftime(ICS_UTC_FORMAT)
+
+
+def _iter_plan_vevents(exporter: ICSExporter, since: str, until: str) -> Iterator[List[str]]:
+    """Published cronograma events, read from the cursor one row at a time"""
+    conn = get_connection(FEED_DB_PATH)
+    cursor = conn.execute("""
+        SELECT uid, date, event, sequence, status, last_modified
+        FROM ics_events
+        WHERE date BETWEEN ? AND ?
+        ORDER BY date, uid
+    """, (since, until))
+
+    event_date = None
+    for uid, date, event, sequence, status, last_modified in cursor:
+        # Rows come ordered by date: parse each date once
+        if event_date is None or date != event_date_str:
+            event_date_str, event_date = date, datetime.strptime(date, "%Y-%m-%d")
+        yield exporter._create_event_ics(
+            json.loads(event), event_date, uid=uid,
+            sequence=sequence, last_modified=last_modified, dtstamp=last_modified, status=status
+        )
+
+
+def _plan_slots(since: str, until: str) -> Set[Tuple[str, str, str]]:
+    """(date, start_time, title) of the published cronograma events in a range"""
+    conn = get_connection(FEED_DB_PATH)
+    return set(conn.execute("""
+        SELECT date, json_extract(event, '$.start_time'), json_extract(event, '$.title')
+        FROM ics_events
+        WHERE date BETWEEN ? AND ? AND status = 'CONFIRMED'
+    """, (since, until)))
+
+
+def _iter_shared_vevents(exporter: ICSExporter, since: str, until: str) -> Iterator[List[str]]:
+    """
+    Events copied from the shared calendar (cancelled ones as STATUS:CANCELLED)
+
+    A copy lives in the personal calendar, so once a cronograma for its day is
+    published the event is already in the feed (as a "📅 summary" block); those
+    are skipped.
+    """
+    from events_db import iter_copied_events
+
+    in_plan = _plan_slots(since, until)
+    for event in iter_copied_events(since, until):
+        slot = (event['start_at'][:10], event['start_time'], f"📅 {event['summary']}")
+        if not event['cancelled_at'] and slot in in_plan:
+            continue
+        last_modified = _iso_to_ics_utc(max(filter(None, [event['copied_at'], event['updated_at'], event['cancelled_at']])))
+        yield exporter._create_event_ics(
+            {
+                "title": event['summary'],
+                "start_time": event['start_time'],
+                "end_time": event['end_time'],
+                "description": f"Calendario: {event['calendar_source']}",
+                "priority": "",
+                "task_type": "",
+                "url": ""
+            },
+            datetime.strptime(event['start_at'][:10], "%Y-%m-%d"),
+            uid=f"{uuid.uuid5(UID_NAMESPACE, 'shared:' + event['uid'])}@{UID_DOMAIN}",
+            sequence=1 if event['cancelled_at'] else 0,
+            last_modified=last_modified, dtstamp=last_modified,
+            status="CANCELLED" if event['cancelled_at'] else "CONFIRMED"
+        )
+
+
+def iter_feed_ics(since: Optional[str] = None, until: Optional[str] = None,
+                  include_shared: bool = True) -> Iterator[str]:
+    """
+    Stream the subscription feed for a date range
+
+    Every published cronograma event in the range plus, optionally, the events
+    copied from the shared calendar. Cancelled events are included
+    (STATUS:CANCELLED) so clients drop them. DTSTAMP is the event's
+    LAST-MODIFIED, so an unchanged store renders an identical feed.
+
+    Args:
+        since/until: Date range (YYYY-MM-DD, inclusive). Defaults to
+                     FEED_DAYS_BACK days ago, open-ended.
+        include_shared: Include events copied from the shared calendar
+    """
+    since, until = _feed_range(since, until)
+    exporter = ICSExporter()
+
+    def vevents():
+        yield from _iter_plan_vevents(exporter, since, until)
+        if include_shared:
+            yield from _iter_shared_vevents(exporter, since, until)
+
+    return iter_calendar(vevents())
 
 
 if __name__ == "__main__":
@@ -1,10 +1,41 @@
 import os
 import json
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import pytz
 
+from run_trace import record_call
+
+# Connections kept open per process (web server threads share the pool)
+POOL_MIN_CONNECTIONS = int(os.getenv('IDEALISTA_PG_POOL_MIN', 1))
+POOL_MAX_CONNECTIONS = int(os.getenv('IDEALISTA_PG_POOL_MAX', 5))
+# How long a thread waits for a free pooled connection
+POOL_WAIT_SECONDS = float(os.getenv('IDEALISTA_PG_POOL_WAIT', 30))
+# A failed schema setup is retried by the next get_pool() after this long
+SCHEMA_RETRY_SECONDS = 30
+
+# Retention (days) for raw samples, hourly rollups and JSON snapshots; daily rollups are kept
+RAW_RETENTION_DAYS = int(os.getenv('IDEALISTA_RAW_RETENTION_DAYS', 90))
+HOURLY_RETENTION_DAYS = int(os.getenv('IDEALISTA_HOURLY_RETENTION_DAYS', 365))
+SNAPSHOT_RETENTION_DAYS = int(os.getenv('IDEALISTA_SNAPSHOT_RETENTION_DAYS', 90))
+
+ROLLUP_RESOLUTIONS = ('hour', 'day')
+METRICS = ('visitas', 'favoritos', 'mensajes')
+
+_pool = None
+# Reentrant: the schema setup run under it uses the pool itself
+_pool_lock = threading.RLock()
+# ThreadedConnectionPool raises instead of blocking when it runs out
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+_schema_ready = False
+_schema_initializing = False
+_schema_retry_at = 0.0
+_last_retention = None
+
 def get_db_connection():
-    """Get PostgreSQL connection"""
+    """Get a standalone PostgreSQL connection (not pooled)"""
     try:
         import psycopg2
         
@@ -21,82 +52,417 @@ def get_db_connection():
         print(f"⚠️ Error connecting to PostgreSQL: {e}")
         return None
 
-def init_idealista_table():
-    """Initialize Idealista table in PostgreSQL"""
-    conn = get_db_connection()
-    if not conn:
-        return
+def get_pool():
+    """
+    Process-wide connection pool, created on first use
+
+    The schema is created under the same lock, so other threads wait for it.
+    If that fails (e.g. PostgreSQL still starting), a later call retries it.
+    Returns None if DATABASE_URL is missing or PostgreSQL is unreachable.
+    """
+    global _pool, _schema_ready, _schema_initializing, _schema_retry_at
+    if _pool is not None and _schema_ready:
+        return _pool
     
+    with _pool_lock:
+        if _pool is None:
+            database_url = os.getenv('DATABASE_URL')
+            if not database_url:
+                print("⚠️ DATABASE_URL not found, falling back to empty data")
+                return None
+            
+            try:
+                from psycopg2.pool import ThreadedConnectionPool
+                
+                _pool = ThreadedConnectionPool(
+                    POOL_MIN_CONNECTIONS,
+                    POOL_MAX_CONNECTIONS,
+                    database_url,
+                    keepalives=1,
+                    keepalives_idle=60
+                )
+            except Exception as e:
+                print(f"⚠️ Error connecting to PostgreSQL: {e}")
+                return None
+        
+        if not _schema_ready and not _schema_initializing and time.time() >= _schema_retry_at:
+            _schema_initializing = True
+            try:
+                _schema_ready = init_idealista_table()
+            finally:
+                _schema_initializing = False
+            if not _schema_ready:
+                _schema_retry_at = time.time() + SCHEMA_RETRY_SECONDS
+        
+        return _pool
+
+@contextmanager
+def db_cursor(commit=False):
+    """
+    Cursor on a pooled connection
+
+    Commits on success if commit=True, rolls back on error and always returns
+    the connection to the pool (discarding it if it was closed by the server).
+    Waits up to POOL_WAIT_SECONDS for a free connection.
+    """
+    pool = get_pool()
+    if pool is None:
+        raise RuntimeError("no database connection")
+    
+    started = time.perf_counter()
+    if not _pool_slots.acquire(timeout=POOL_WAIT_SECONDS):
+        raise RuntimeError(f"no free database connection after {POOL_WAIT_SECONDS:g}s")
+    try:
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    broken = False
     try:
-        cursor = conn.cursor()
+        with conn.cursor() as cursor:
+            yield cursor
+        if commit:
+            conn.commit()
+        else:
+            conn.rollback()  # end the read transaction, do not leave it idle
+        record_call('postgres', (time.perf_counter() - started) * 1000)
+    except Exception:
+        record_call('postgres', (time.perf_counter() - started) * 1000, ok=False)
+        if conn.closed:
+            broken = True
+        else:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken or bool(conn.closed))
+        _pool_slots.release()
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def init_idealista_table():
+    """
+    Initialize Idealista tables in PostgreSQL (run by get_pool until it succeeds)
+
+    Returns:
+        True if the schema (and the first backfill) is in place
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS idealista_data (
+                    id SERIAL PRIMARY KEY,
+                    data JSONB NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    last_updated TEXT NOT NULL
+                )
+            ''')
+            
+            # One row per property and scrape; the primary key is the (property_id, ts) index
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS idealista_metrics (
+                    property_id TEXT NOT NULL,
+                    ts TIMESTAMP NOT NULL,
+                    visitas INTEGER NOT NULL DEFAULT 0,
+                    favoritos INTEGER NOT NULL DEFAULT 0,
+                    mensajes INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (property_id, ts)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_idealista_metrics_ts ON idealista_metrics(ts)')
+            
+            # Last value of each (cumulative) counter per hour/day bucket
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS idealista_metrics_rollup (
+                    property_id TEXT NOT NULL,
+                    resolution TEXT NOT NULL,
+                    bucket TIMESTAMP NOT NULL,
+                    visitas INTEGER NOT NULL,
+                    favoritos INTEGER NOT NULL,
+                    mensajes INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (property_id, resolution, bucket)
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS idealista_properties (
+                    property_id TEXT PRIMARY KEY,
+                    property_name TEXT,
+                    last_seen TIMESTAMP NOT NULL
+                )
+            ''')
+            
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM idealista_metrics)')
+            has_metrics = cursor.fetchone()[0]
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS idealista_data (
-                id SERIAL PRIMARY KEY,
-                data JSONB NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                last_updated TEXT NOT NULL
-            )
-        ''')
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
         print("✅ Idealista table initialized in PostgreSQL")
+        
+        if not has_metrics:
+            return backfill_idealista_metrics()
+        return True
     except Exception as e:
         print(f"⚠️ Error initializing table: {e}")
-        if conn:
-            conn.close()
+        return False
+
+def _to_int(value):
+    try:
+        return int(float(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+def _save_metrics(cursor, properties, ts):
+    """Insert one metrics row per property and refresh property names"""
+    from psycopg2.extras import execute_values
+    
+    # Keyed by id: a property listed twice must not hit ON CONFLICT twice in one statement
+    rows = {}
+    names = {}
+    for prop in properties:
+        prop_id = prop.get('propertyId')
+        if prop_id is None:
+            continue
+        rows[str(prop_id)] = (str(prop_id), ts) + tuple(_to_int(prop.get(m)) for m in METRICS)
+        names[str(prop_id)] = (str(prop_id), prop.get('propertyName'), ts)
+    
+    if not rows:
+        return 0
+    rows = list(rows.values())
+    names = list(names.values())
+    
+    execute_values(cursor, '''
+        INSERT INTO idealista_metrics (property_id, ts, visitas, favoritos, mensajes)
+        VALUES %s
+        ON CONFLICT (property_id, ts) DO UPDATE SET
+            visitas = EXCLUDED.visitas,
+            favoritos = EXCLUDED.favoritos,
+            mensajes = EXCLUDED.mensajes
+    ''', rows)
+    
+    execute_values(cursor, '''
+        INSERT INTO idealista_properties (property_id, property_name, last_seen)
+        VALUES %s
+        ON CONFLICT (property_id) DO UPDATE SET
+            property_name = COALESCE(EXCLUDED.property_name, idealista_properties.property_name),
+            last_seen = EXCLUDED.last_seen
+    ''', names)
+    
+    return len(rows)
+
+def _rollup(cursor, resolution, since=None):
+    """Recompute rollup buckets of one resolution from raw samples (all, or from since)"""
+    cursor.execute('''
+        INSERT INTO idealista_metrics_rollup
+            (property_id, resolution, bucket, visitas, favoritos, mensajes, samples)
+        SELECT DISTINCT ON (property_id, date_trunc(%(res)s, ts))
+            property_id, %(res)s, date_trunc(%(res)s, ts),
+            visitas, favoritos, mensajes,
+            COUNT(*) OVER (PARTITION BY property_id, date_trunc(%(res)s, ts))
+        FROM idealista_metrics
+        WHERE %(since)s::timestamp IS NULL OR ts >= date_trunc(%(res)s, %(since)s::timestamp)
+        ORDER BY property_id, date_trunc(%(res)s, ts), ts DESC
+        ON CONFLICT (property_id, resolution, bucket) DO UPDATE SET
+            visitas = EXCLUDED.visitas,
+            favoritos = EXCLUDED.favoritos,
+            mensajes = EXCLUDED.mensajes,
+            -- Raw samples are only ever deleted: a bucket recomputed after some
+            -- were never has fewer samples than it had
+            samples = GREATEST(idealista_metrics_rollup.samples, EXCLUDED.samples)
+    ''', {'res': resolution, 'since': since})
+
+def rollup_idealista_metrics(since=None):
+    """Refresh hourly and daily rollups (only buckets from since, if given)"""
+    with db_cursor(commit=True) as cursor:
+        for resolution in ROLLUP_RESOLUTIONS:
+            _rollup(cursor, resolution, since)
+
+def backfill_idealista_metrics():
+    """Populate idealista_metrics and rollups from the stored JSON snapshots (True on success)"""
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute('''
+                INSERT INTO idealista_metrics (property_id, ts, visitas, favoritos, mensajes)
+                SELECT p->>'propertyId', d.timestamp,
+                       COALESCE(NULLIF(p->>'visitas', '')::numeric, 0)::int,
+                       COALESCE(NULLIF(p->>'favoritos', '')::numeric, 0)::int,
+                       COALESCE(NULLIF(p->>'mensajes', '')::numeric, 0)::int
+                FROM idealista_data d, jsonb_array_elements(d.data->'properties') p
+                WHERE p->>'propertyId' IS NOT NULL
+                ON CONFLICT (property_id, ts) DO NOTHING
+            ''')
+            inserted = cursor.rowcount
+            
+            cursor.execute('''
+                INSERT INTO idealista_properties (property_id, property_name, last_seen)
+                SELECT DISTINCT ON (p->>'propertyId') p->>'propertyId', p->>'propertyName', d.timestamp
+                FROM idealista_data d, jsonb_array_elements(d.data->'properties') p
+                WHERE p->>'propertyId' IS NOT NULL
+                ORDER BY p->>'propertyId', d.timestamp DESC
+                ON CONFLICT (property_id) DO NOTHING
+            ''')
+            
+            for resolution in ROLLUP_RESOLUTIONS:
+                _rollup(cursor, resolution)
+        
+        print(f"✅ Idealista metrics backfilled: {inserted} samples")
+        return True
+    except Exception as e:
+        print(f"⚠️ Error backfilling Idealista metrics: {e}")
+        return False
+
+def apply_idealista_retention():
+    """
+    Delete data past its retention period
+
+    Raw samples and hourly rollups are only deleted once covered by daily rollups;
+    the two most recent JSON snapshots are always kept for the dashboard.
+    Raw samples go by whole days, so no day is left with part of its samples.
+    """
+    with db_cursor(commit=True) as cursor:
+        # Make sure every day about to lose its raw samples has its daily rollup
+        cursor.execute('''
+            SELECT MIN(ts) FROM idealista_metrics
+            WHERE ts < date_trunc('day', (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s))
+        ''', (RAW_RETENTION_DAYS,))
+        oldest = cursor.fetchone()[0]
+        if oldest is not None:
+            _rollup(cursor, 'day', oldest)
+        
+        cursor.execute('''
+            DELETE FROM idealista_metrics
+            WHERE ts < date_trunc('day', (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s))
+        ''', (RAW_RETENTION_DAYS,))
+        raw_deleted = cursor.rowcount
+        
+        cursor.execute('''
+            DELETE FROM idealista_metrics_rollup
+            WHERE resolution = 'hour' AND bucket < (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        ''', (HOURLY_RETENTION_DAYS,))
+        hourly_deleted = cursor.rowcount
+        
+        cursor.execute('''
+            DELETE FROM idealista_data
+            WHERE timestamp < (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s)
+              AND id < (SELECT MIN(id) FROM (SELECT id FROM idealista_data ORDER BY id DESC LIMIT 2) latest)
+        ''', (SNAPSHOT_RETENTION_DAYS,))
+        snapshots_deleted = cursor.rowcount
+    
+    return {'raw': raw_deleted, 'hourly': hourly_deleted, 'snapshots': snapshots_deleted}
+
+def _utc_now():
+    """Naive UTC now: the TIMESTAMP columns hold UTC, whatever the server's timezone"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _madrid_time(ts):
+    """Naive UTC timestamp from the database -> 'YYYY-MM-DD HH:MM:SS' in Madrid time"""
+    if ts.tzinfo is None:
+        ts = pytz.utc.localize(ts)
+    return ts.astimezone(pytz.timezone('Europe/Madrid')).strftime('%Y-%m-%d %H:%M:%S')
+
+def _attach_deltas(cursor, data, now):
+    """
+    Add 'previous' and 'changes' to every property, against its latest stored sample
+
+    One indexed query (latest row per property before now) replaces loading and
+    diffing the whole previous snapshot.
+    """
+    properties = data.get('properties', [])
+    ids = list({str(p['propertyId']) for p in properties if p.get('propertyId') is not None})
+    
+    previous = {}
+    if ids:
+        cursor.execute('''
+            SELECT DISTINCT ON (property_id) property_id, ts, visitas, favoritos, mensajes
+            FROM idealista_metrics
+            WHERE property_id = ANY(%s) AND ts < %s
+            ORDER BY property_id, ts DESC
+        ''', (ids, now))
+        for prop_id, ts, visitas, favoritos, mensajes in cursor.fetchall():
+            previous[prop_id] = {'visitas': visitas, 'favoritos': favoritos, 'mensajes': mensajes, 'ts': ts}
+    
+    for prop in properties:
+        prev = previous.get(str(prop.get('propertyId')))
+        if prev:
+            prop['previous'] = {m: prev[m] for m in METRICS}
+            prop['changes'] = {m: _to_int(prop.get(m)) - prev[m] for m in METRICS}
+        else:
+            prop['previous'] = None
+            prop['changes'] = {m: 0 for m in METRICS}
+    
+    previous_ts = max((p['ts'] for p in previous.values()), default=None)
+    data['previous_timestamp'] = _madrid_time(previous_ts) if previous_ts else None
+    data['timestamp_madrid'] = _madrid_time(now)
 
 def save_idealista_data(data):
-    """Save Idealista data to PostgreSQL"""
-    conn = get_db_connection()
-    if not conn:
+    """
+    Save Idealista data to PostgreSQL
+
+    Each property gets its 'previous' values and 'changes' computed here, once,
+    and stored in the snapshot so readers do not diff again.
+
+    Returns:
+        The saved data (with deltas), or None if it could not be saved
+    """
+    if not get_pool():
         print("⚠️ Cannot save Idealista data: no database connection")
-        return
+        return None
     
     try:
-        init_idealista_table()
+        now = _utc_now()
+        
+        with db_cursor(commit=True) as cursor:
+            _attach_deltas(cursor, data, now)
+            
+            # Snapshot for the dashboard (kept for SNAPSHOT_RETENTION_DAYS)
+            cursor.execute('''
+                INSERT INTO idealista_data (data, timestamp, last_updated)
+                VALUES (%s, %s, %s)
+            ''', (
+                json.dumps(data, ensure_ascii=False),
+                now,
+                data.get('last_updated', _madrid_time(now))
+            ))
+            
+            # Normalised time series + the rollup buckets this scrape falls into
+            samples = _save_metrics(cursor, data.get('properties', []), now)
+            for resolution in ROLLUP_RESOLUTIONS:
+                _rollup(cursor, resolution, now)
         
-        cursor = conn.cursor()
+        print(f"✅ Idealista data saved to PostgreSQL ({samples} metric samples)")
         
-        # Keep history, don't delete old data
-        # Insert new data
-        cursor.execute('''
-            INSERT INTO idealista_data (data, timestamp, last_updated)
-            VALUES (%s, %s, %s)
-        ''', (
-            json.dumps(data, ensure_ascii=False),
-            datetime.now(),
-            data.get('last_updated', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("✅ Idealista data saved to PostgreSQL")
+        # Retention runs at most once a day, piggybacking on the scraper updates
+        global _last_retention
+        if _last_retention is None or (now - _last_retention).total_seconds() > 86400:
+            _last_retention = now
+            try:
+                deleted = apply_idealista_retention()
+                print(f"🧹 Idealista retention: {deleted}")
+            except Exception as e:
+                print(f"⚠️ Error applying Idealista retention: {e}")
+        
+        return data
     except Exception as e:
         print(f"⚠️ Error saving Idealista data: {e}")
-        if conn:
-            conn.close()
+        return None
 
 def get_idealista_data():
     """Get latest Idealista data from PostgreSQL"""
-    conn = get_db_connection()
-    if not conn:
+    if not get_pool():
         print("⚠️ Cannot load Idealista data: no database connection")
         return {'properties': [], 'timestamp': '', 'last_updated': 'Nunca'}
     
     try:
-        init_idealista_table()
-        
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT data FROM idealista_data ORDER BY id DESC LIMIT 1')
-        row = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        with db_cursor() as cursor:
+            cursor.execute('SELECT data FROM idealista_data ORDER BY id DESC LIMIT 1')
+            row = cursor.fetchone()
         
         if row:
             # PostgreSQL JSONB returns dict directly, no need to parse
@@ -109,76 +475,105 @@ def get_idealista_data():
             return {'properties': [], 'timestamp': '', 'last_updated': 'Nunca'}
     except Exception as e:
         print(f"⚠️ Error loading Idealista data: {e}")
-        if conn:
-            conn.close()
         return {'properties': [], 'timestamp': '', 'last_updated': 'Nunca'}
 
 def get_idealista_comparison():
     """Get current and previous Idealista data for comparison"""
-    conn = get_db_connection()
-    if not conn:
+    if not get_pool():
         print("⚠️ Cannot load Idealista data: no database connection")
         return None, None
     
     try:
-        init_idealista_table()
-        
-        cursor = conn.cursor()
-        
-        # Get latest 2 records
-        cursor.execute('SELECT data, timestamp FROM idealista_data ORDER BY id DESC LIMIT 2')
-        rows = cursor.fetchall()
+        with db_cursor() as cursor:
+            # Get latest 2 records
+            cursor.execute('SELECT data, timestamp FROM idealista_data ORDER BY id DESC LIMIT 2')
+            rows = cursor.fetchall()
         
         print(f"🔍 DEBUG get_idealista_comparison: Found {len(rows)} records")
         
-        cursor.close()
-        conn.close()
-        
         if len(rows) >= 2:
             # Current data (most recent)
-            # Convert to Madrid timezone
-            madrid_tz = pytz.timezone('Europe/Madrid')
-            
             current_data = rows[0][0]
             current_timestamp = rows[0][1]
             if isinstance(current_data, str):
                 current_data = json.loads(current_data)
-            # Convert UTC to Madrid time
-            if current_timestamp.tzinfo is None:
-                current_timestamp = pytz.utc.localize(current_timestamp)
-            current_timestamp_madrid = current_timestamp.astimezone(madrid_tz)
-            current_data['timestamp'] = current_timestamp_madrid.strftime('%Y-%m-%d %H:%M:%S')
+            current_data['timestamp'] = _madrid_time(current_timestamp)
             
             # Previous data (second most recent)
             previous_data = rows[1][0]
             previous_timestamp = rows[1][1]
             if isinstance(previous_data, str):
                 previous_data = json.loads(previous_data)
-            # Convert UTC to Madrid time
-            if previous_timestamp.tzinfo is None:
-                previous_timestamp = pytz.utc.localize(previous_timestamp)
-            previous_timestamp_madrid = previous_timestamp.astimezone(madrid_tz)
-            previous_data['timestamp'] = previous_timestamp_madrid.strftime('%Y-%m-%d %H:%M:%S')
+            previous_data['timestamp'] = _madrid_time(previous_timestamp)
             
             return current_data, previous_data
         elif len(rows) == 1:
             # Only one record, no comparison possible
-            madrid_tz = pytz.timezone('Europe/Madrid')
-            
             current_data = rows[0][0]
             current_timestamp = rows[0][1]
             if isinstance(current_data, str):
                 current_data = json.loads(current_data)
-            # Convert UTC to Madrid time
-            if current_timestamp.tzinfo is None:
-                current_timestamp = pytz.utc.localize(current_timestamp)
-            current_timestamp_madrid = current_timestamp.astimezone(madrid_tz)
-            current_data['timestamp'] = current_timestamp_madrid.strftime('%Y-%m-%d %H:%M:%S')
+            current_data['timestamp'] = _madrid_time(current_timestamp)
             return current_data, None
         else:
             return None, None
     except Exception as e:
         print(f"⚠️ Error loading Idealista comparison: {e}")
-        if conn:
-            conn.close()
         return None, None
+
+def get_idealista_trends(days=30, resolution='day', property_id=None):
+    """
+    Metric trends per property from the rollup table
+
+    Args:
+        days: How far back to look
+        resolution: 'hour' or 'day'
+        property_id: Only this property (all if None)
+
+    Returns:
+        List of {'property_id', 'property_name', 'points': [{'bucket', 'visitas',
+        'favoritos', 'mensajes', 'delta_visitas', 'delta_favoritos', 'delta_mensajes'}]}.
+        Buckets are UTC hours/days; hourly buckets are labelled in Madrid time.
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {ROLLUP_RESOLUTIONS}")
+    
+    if not get_pool():
+        print("⚠️ Cannot load Idealista trends: no database connection")
+        return []
+    
+    with db_cursor() as cursor:
+        cursor.execute('''
+            SELECT r.property_id, p.property_name, r.bucket,
+                   r.visitas, r.favoritos, r.mensajes,
+                   r.visitas - LAG(r.visitas) OVER w,
+                   r.favoritos - LAG(r.favoritos) OVER w,
+                   r.mensajes - LAG(r.mensajes) OVER w
+            FROM idealista_metrics_rollup r
+            LEFT JOIN idealista_properties p ON p.property_id = r.property_id
+            WHERE r.resolution = %s
+              AND r.bucket >= date_trunc(%s, (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s))
+              AND (%s::text IS NULL OR r.property_id = %s::text)
+            WINDOW w AS (PARTITION BY r.property_id ORDER BY r.bucket)
+            ORDER BY r.property_id, r.bucket
+        ''', (resolution, resolution, days, property_id, property_id))
+        rows = cursor.fetchall()
+    
+    trends = {}
+    for prop_id, name, bucket, visitas, favoritos, mensajes, d_visitas, d_favoritos, d_mensajes in rows:
+        trend = trends.setdefault(prop_id, {
+            'property_id': prop_id,
+            'property_name': name or f'Propiedad {prop_id}',
+            'points': []
+        })
+        trend['points'].append({
+            'bucket': _madrid_time(bucket)[:16] if resolution == 'hour' else bucket.strftime('%Y-%m-%d'),
+            'visitas': visitas,
+            'favoritos': favoritos,
+            'mensajes': mensajes,
+            'delta_visitas': d_visitas or 0,
+            'delta_favoritos': d_favoritos or 0,
+            'delta_mensajes': d_mensajes or 0
+        })
+    
+    return list(trends.values())
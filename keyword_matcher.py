@@ -0,0 +1,74 @@
+"""
+Keyword Matcher
+Compiled multi-keyword matcher shared by expense categorization and task emojis
+
+All keywords are compiled once into a single alternation regex, so classifying a
+text is one regex pass instead of a substring scan per keyword.
+"""
+
+import re
+from typing import Iterable, Optional, Tuple
+
+# Boundary modes
+BOUNDARY_WORD = 'word'            # whole words only: 'bar' does not match 'barcelona'
+BOUNDARY_PREFIX = 'prefix'        # word starts: 'hidrat' matches 'hidratarse'
+
+
+class KeywordMatcher:
+    """Return the value of the first group whose keywords appear in a text"""
+
+    def __init__(self, groups: Iterable[Tuple], boundary: str = BOUNDARY_WORD, plurals: bool = False):
+        """
+        Args:
+            groups: Ordered (value, keywords) pairs, or (value, keywords, boundary)
+                    to give one group its own boundary mode. If several groups
+                    match, the one listed first wins, as with the old if-chains.
+            boundary: Default mode, BOUNDARY_WORD or BOUNDARY_PREFIX
+            plurals: For BOUNDARY_WORD keywords, also accept a trailing 's'/'es'
+        """
+        self.values = []
+        self._priority = {}
+        by_boundary = {BOUNDARY_WORD: [], BOUNDARY_PREFIX: []}
+
+        for priority, group in enumerate(groups):
+            value, keywords = group[0], group[1]
+            group_boundary = group[2] if len(group) > 2 else boundary
+            if group_boundary not in by_boundary:
+                raise ValueError(f"Unknown boundary mode: {group_boundary}")
+            self.values.append(value)
+            for keyword in keywords:
+                keyword = keyword.lower()
+                # A keyword shared by two groups belongs to the first one
+                if keyword not in self._priority:
+                    self._priority[keyword] = priority
+                    by_boundary[group_boundary].append(keyword)
+
+        # One capturing group per mode; longest first so 'padre rico' wins over a
+        # shorter overlapping keyword
+        branches = []
+        for mode, keywords in by_boundary.items():
+            if not keywords:
+                continue
+            alternation = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+            if mode == BOUNDARY_WORD:
+                suffix = r'(?:e?s)?' if plurals else ''
+                branches.append(rf'({alternation}){suffix}(?!\w)')
+            else:
+                branches.append(rf'({alternation})')
+
+        self._regex = re.compile(rf'(?<!\w)(?:{"|".join(branches)})') if branches else None
+
+    def match(self, text: str) -> Optional[object]:
+        """Value of the highest-priority group found in text, or None"""
+        if not text or self._regex is None:
+            return None
+
+        best = None
+        for found in self._regex.finditer(text.lower()):
+            priority = self._priority[found.group(found.lastindex)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+
+        return self.values[best] if best is not None else None
@@ -0,0 +1,206 @@
+"""
+Metrics
+In-process counters, gauges and histograms in the Prometheus text format
+
+No client library and no push gateway: the web server keeps its metrics in
+memory and renders them on GET /metrics, so a Prometheus scrape or a plain curl
+reads them. Values computed at scrape time (cache stats, queue depth, last
+generation) come from collector functions.
+
+    REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests', ['route', 'status'])
+    REQUESTS.inc(route='/health', status='200')
+    REGISTRY.render()
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds: from a cached lookup to a full cronograma regeneration
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# (name suffix, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        """Current value of a counter or gauge (0 if never set)"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [('', dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    """Only goes up"""
+
+    kind = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        if value < 0:
+            raise ValueError("Counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """Goes up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][n] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+                samples.append(('_sum', labels, state['sum']))
+                samples.append(('_count', labels, state['count']))
+        return samples
+
+
+class Registry:
+    """Metrics of the process, rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """collector() returns metrics built at scrape time (not registered)"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                print(f"⚠️  Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def gauge_of(name: str, documentation: str, values: Dict[Tuple[str, ...], float],
+             labelnames: Sequence[str] = ()) -> Gauge:
+    """A one-off gauge (for collectors): label values tuple -> value"""
+    gauge = Gauge(name, documentation, labelnames)
+    for key, value in values.items():
+        if value is not None:
+            gauge.set(value, **dict(zip(labelnames, key)))
+    return gauge
+
+
+def counter_of(name: str, documentation: str, values: Dict[Tuple[str, ...], float],
+               labelnames: Sequence[str] = ()) -> Counter:
+    """A one-off counter (for collectors) from totals kept elsewhere"""
+    counter = Counter(name, documentation, labelnames)
+    for key, value in values.items():
+        counter.inc(value, **dict(zip(labelnames, key)))
+    return counter
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -9,11 +9,9 @@ if [ -f ".env" ]; then
     rm -f .env
 fi
 
-# Create database if it doesn't exist
-if [ ! -f "events_tracker.db" ]; then
-    echo "📊 Creando base de datos..."
-    python3.11 -c "from events_db import init_db; init_db()"
-fi
+# Create/migrate local SQLite databases (data/, idempotent)
+echo "📊 Preparando bases de datos..."
+python3.11 -c "import events_db, completed_tasks_db, expense_queue"
 
 # Generate initial cronograma
 echo "📅 Generando cronograma inicial..."
@@ -0,0 +1,309 @@
+"""
+Run Trace
+Per-stage timings of a cronograma generation
+
+The generator marks its stages (CalDAV detection, personal calendar, Todoist,
+schedule, Idealista/Postgres, Firefly, render...) on a RunTrace. Each stage
+records:
+
+- its duration
+- upstream calls made while it ran, per service (count, total ms, errors):
+  every requests call (Todoist, iCloud CalDAV, Firefly, OpenAI) is seen through
+  one hook on requests' HTTPAdapter.send; Postgres reports its own queries
+  (idealista_postgres.db_cursor)
+- item counts set by the generator (events, tasks, blocks...)
+
+Every finished stage is logged as one JSON line (RUN_TRACE_LOG: 'stdout', the
+default, 'stderr', 'off' or a file to append to). The whole run is saved next to
+its HTML artifact (<artifact>.trace.json) and as the last run
+(RUN_TRACE_FILE, default data/last_run.json), served by /debug/last-run.
+
+    trace = RunTrace('cronograma_v7_5')
+    trace.stage('todoist')
+    tasks = ...
+    trace.set(tasks=len(tasks))
+    trace.stage('render')
+    ...
+    trace.finish(artifact=output_file)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from sqlite_store import db_path
+
+RUN_TRACE_FILE = os.getenv('RUN_TRACE_FILE', db_path('last_run.json'))
+RUN_TRACE_LOG = os.getenv('RUN_TRACE_LOG', 'stdout')
+
+# Host fragment -> service name (anything else is reported by host name)
+SERVICE_HOSTS = [
+    ('todoist.com', 'todoist'),
+    ('icloud.com', 'icloud'),
+    ('openai.com', 'openai'),
+]
+
+_listeners: List[Callable[[str, float, bool], None]] = []
+_hook_lock = threading.Lock()
+_hooked_send = None
+
+
+def service_for_url(url: str) -> str:
+    """Service name of an upstream URL (todoist, icloud, firefly, openai or the host)"""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    for fragment, service in SERVICE_HOSTS:
+        if host.endswith(fragment):
+            return service
+    # Self-hosted services, known by their configured URLs
+    for env, service in (('ICLOUD_CALDAV_URL', 'icloud'), ('FIREFLY_URL', 'firefly')):
+        if os.getenv(env) and parts.netloc.lower() == urlsplit(os.getenv(env)).netloc.lower():
+            return service
+    if 'firefly' in host:
+        return 'firefly'
+    return host or 'unknown'
+
+
+def add_call_listener(listener: Callable[[str, float, bool], None]):
+    """Call listener(service, elapsed_ms, ok) after every upstream call"""
+    install_http_hook()
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_call_listener(listener: Callable[[str, float, bool], None]):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def record_call(service: str, elapsed_ms: float, ok: bool = True):
+    """Report an upstream call made without requests (e.g. a Postgres query)"""
+    for listener in list(_listeners):
+        try:
+            listener(service, elapsed_ms, ok)
+        except Exception as e:
+            print(f"⚠️  Call listener failed: {e}")
+
+
+def install_http_hook():
+    """
+    Time every requests call (idempotent)
+
+    Wraps whatever HTTPAdapter.send is at the time, so it stacks on top of an
+    installed HTTP cassette (http_cassette.py).
+    """
+    global _hooked_send
+    from requests.adapters import HTTPAdapter
+
+    with _hook_lock:
+        if _hooked_send is not None and HTTPAdapter.send is _hooked_send:
+            return
+        wrapped = HTTPAdapter.send
+
+        def send(adapter, request, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                response = wrapped(adapter, request, **kwargs)
+                ok = response.status_code < 500
+                return response
+            finally:
+                record_call(service_for_url(request.url), (time.perf_counter() - started) * 1000, ok)
+
+        HTTPAdapter.send = send
+        _hooked_send = send
+
+
+class Span:
+    """One stage of a run"""
+
+    __slots__ = ('name', 'start_ms', 'duration_ms', 'items', 'calls', 'status', 'error')
+
+    def __init__(self, name: str, start_ms: float):
+        self.name = name
+        self.start_ms = start_ms
+        self.duration_ms = None
+        self.items: Dict[str, int] = {}
+        # service -> {'count', 'ms', 'errors'}
+        self.calls = defaultdict(lambda: {'count': 0, 'ms': 0.0, 'errors': 0})
+        self.status = 'ok'
+        self.error = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'start_ms': round(self.start_ms, 1),
+            'duration_ms': None if self.duration_ms is None else round(self.duration_ms, 1),
+            'status': self.status,
+            'error': self.error,
+            'requests': sum(call['count'] for call in self.calls.values()),
+            'calls': {service: {**call, 'ms': round(call['ms'], 1)} for service, call in self.calls.items()},
+            'items': self.items,
+        }
+
+
+class RunTrace:
+    """Sequential stages of one run (a stage ends when the next one starts)"""
+
+    def __init__(self, name: str, **context):
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.context = context
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.spans: List[Span] = []
+        self.status = None
+        self.error = None
+        self.artifacts: List[str] = []
+        self.duration_ms = None
+        self._t0 = time.perf_counter()
+        self._current: Optional[Span] = None
+        self._lock = threading.Lock()
+        add_call_listener(self._on_call)
+
+    def _now_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def _on_call(self, service: str, elapsed_ms: float, ok: bool):
+        with self._lock:
+            span = self._current
+            if span is None:
+                return
+            call = span.calls[service]
+            call['count'] += 1
+            call['ms'] += elapsed_ms
+            call['errors'] += 0 if ok else 1
+
+    def stage(self, name: str, **items) -> Span:
+        """End the current stage and start the next one"""
+        self.end_stage()
+        span = Span(name, self._now_ms())
+        span.items.update(items)
+        with self._lock:
+            self._current = span
+            self.spans.append(span)
+        return span
+
+    def set(self, **items):
+        """Item counts of the current stage"""
+        if self._current is not None:
+            self._current.items.update(items)
+
+    def error_in_stage(self, error):
+        """Mark the current stage failed (the run goes on)"""
+        if self._current is not None:
+            self._current.status = 'error'
+            self._current.error = str(error)
+
+    def end_stage(self):
+        with self._lock:
+            span, self._current = self._current, None
+        if span is None:
+            return
+        span.duration_ms = self._now_ms() - span.start_ms
+        self._log({'event': 'stage', **span.to_dict()})
+
+    def add_artifact(self, path: str):
+        """A file the run generated: the trace is saved next to it"""
+        if path not in self.artifacts:
+            self.artifacts.append(path)
+
+    def finish(self, status: str = 'ok', error=None, artifact: Optional[str] = None) -> Dict:
+        """End the run, log it and save it (next to its artifacts and as the last run)"""
+        self.end_stage()
+        remove_call_listener(self._on_call)
+        self.status = status
+        self.error = None if error is None else str(error)
+        self.duration_ms = self._now_ms()
+        if artifact:
+            self.add_artifact(artifact)
+
+        run = self.to_dict()
+        self._log({'event': 'run', **{key: value for key, value in run.items() if key != 'stages'}})
+        sidecars = {f"{os.path.splitext(path)[0]}.trace.json" for path in self.artifacts}
+        for path in [RUN_TRACE_FILE] + sorted(sidecars):
+            try:
+                save_run(run, path)
+            except Exception as e:
+                print(f"⚠️  Could not save run trace to {path}: {e}")
+        return run
+
+    def finish_at_exit(self):
+        """atexit handler: save the trace of a run that died before finish()"""
+        if self.status is None:
+            error = getattr(sys, 'last_value', None)
+            error = repr(error) if error else 'exited before finishing'
+            # The stage it died in
+            self.error_in_stage(error)
+            self.finish('error', error)
+
+    def to_dict(self) -> Dict:
+        stages = [span.to_dict() for span in self.spans]
+        calls = defaultdict(lambda: {'count': 0, 'ms': 0.0, 'errors': 0})
+        for span in self.spans:
+            for service, call in span.calls.items():
+                for key in ('count', 'ms', 'errors'):
+                    calls[service][key] += call[key]
+        return {
+            'run_id': self.run_id,
+            'name': self.name,
+            'context': self.context,
+            'started_at': self.started_at,
+            'status': self.status,
+            'error': self.error,
+            'duration_ms': round(self._now_ms() if self.duration_ms is None else self.duration_ms, 1),
+            'requests': sum(call['count'] for call in calls.values()),
+            'calls': {service: {**call, 'ms': round(call['ms'], 1)} for service, call in calls.items()},
+            'artifacts': [os.path.basename(path) for path in self.artifacts],
+            'stages': stages,
+        }
+
+    def _log(self, record: Dict):
+        if RUN_TRACE_LOG == 'off':
+            return
+        line = json.dumps({'run_id': self.run_id, 'run': self.name, **record}, ensure_ascii=False, default=str)
+        if RUN_TRACE_LOG in ('stdout', 'stderr'):
+            print(line, file=getattr(sys, RUN_TRACE_LOG), flush=True)
+            return
+        # Tracing never stops a generation
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(RUN_TRACE_LOG)), exist_ok=True)
+            with open(RUN_TRACE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            print(f"⚠️  Could not write run trace log: {e}")
+
+    def summary(self) -> str:
+        """Human-readable breakdown of the stages"""
+        total_ms = self._now_ms() if self.duration_ms is None else self.duration_ms
+        lines = [f"⏱️  {self.name}: {total_ms / 1000:.2f} s"]
+        for span in self.spans:
+            data = span.to_dict()
+            calls = ', '.join(f"{service} {call['count']}×{call['ms'] / max(call['count'], 1):.0f}ms"
+                              for service, call in data['calls'].items())
+            items = ', '.join(f"{key}={value}" for key, value in data['items'].items())
+            lines.append(f"   {'❌' if span.status == 'error' else '·'} {span.name:<18} "
+                         f"{(data['duration_ms'] or 0):>8.0f} ms  {calls}{'  ' if calls and items else ''}{items}")
+        return '\n'.join(lines)
+
+
+def save_run(run: Dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(run, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def load_last_run() -> Optional[Dict]:
+    """Trace of the last generation, or None if there is none"""
+    if not os.path.exists(RUN_TRACE_FILE):
+        return None
+    with open(RUN_TRACE_FILE, encoding='utf-8') as f:
+        return json.load(f)
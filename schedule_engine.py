@@ -0,0 +1,956 @@
+'''
+Schedule Engine
+Builds the minute-by-minute day schedule (07:00-21:00) used by the cronograma
+
+Extracted from cronograma_generator_v7_5 so the scheduling rules can be imported,
+tested and benchmarked without fetching anything:
+
+- Fixed blocks: calendar events, breakfast, lunch, tasks with a due_time and
+  tasks already completed today
+- First-fit pass (the V7.5 rules): administrative routine and checks from 07:20,
+  morning tasks with the alternation rule, afternoon/night/flexible tasks in the
+  first gap that fits
+- Optimising pass: branch and bound over the free intervals left by the fixed
+  blocks, maximising priority-weighted scheduled minutes within a time budget.
+  It keeps block windows, the sequencing rules and packs every interval
+  from its start, so idle time ends up in one piece. Its result replaces the
+  first-fit one only when it is strictly better.
+
+Block times, windows and sequencing rules come from schedule_rules. A schedule
+is a DaySchedule: an integer array of DAY_MINUTES slots (minute 0 = 07:00)
+holding the index of the task/event dict occupying each minute, 0 when free.
+Blocks are written with slice assignment and read back as runs (np.diff), so
+placing and consolidating cost one operation per block, not per minute.
+'''
+
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from schedule_rules import SCHEDULE_RULES
+
+# Day, fixed blocks, windows and sequencing rules (see schedule_rules.py)
+RULES = SCHEDULE_RULES
+
+DAY_MINUTES = RULES.day_minutes
+
+# Block windows (minutes from the start of the day, end exclusive)
+ZONES = RULES.windows
+
+# Weight of one scheduled minute per priority (1 = P1 ... 4 = P4)
+PRIORITY_WEIGHTS = {1: 8, 2: 4, 3: 2, 4: 1}
+
+# Every scheduled task also scores this many (weighted) minutes, so that at equal
+# priority several short tasks beat one long task of the same total length
+TASK_BONUS_MINUTES = 15
+
+# Wall-clock budget of the optimising pass
+OPTIMISER_BUDGET_MS = int(os.getenv('SCHEDULE_OPTIMISER_BUDGET_MS', 300))
+# Part of the budget kept for building the schedule once the search stops
+OPTIMISER_RESERVE_MS = 2
+
+FIXED_CONTENTS = ["Desayunar", "Comer", "Tiempo libre"]
+
+# --- Helper Functions ---
+# Duration labels and their minutes (the first one in the task's labels wins)
+DURATION_LABELS = {
+    "5min": 5, "5 minutos": 5, "10min": 10, "10 minutos": 10, "15min": 15, "15 minutos": 15,
+    "20min": 20, "20 minutos": 20, "30min": 30, "30 minutos": 30, "1h": 60, "1 hora": 60,
+    "2h": 120, "2 horas": 120,
+}
+time_labels = list(DURATION_LABELS)
+
+# Variants of the 'checks' label (case-insensitive)
+CHECKS_LABELS = {"checks", "check", "cheks", "chek"}
+
+# Type labels, in order of precedence when a task has several
+TYPE_LABELS = (("fisico", "Física"), ("administrativo", "Administrativa"), ("intelectual", "Intelectual"))
+
+# Block labels as bits of TaskRecord.blocks
+BLOCK_RUTINA, BLOCK_MANANA, BLOCK_TARDE, BLOCK_NOCHE = 1, 2, 4, 8
+BLOCK_LABELS = {
+    "rutina administrativa matinal": BLOCK_RUTINA,
+    "por la mañana": BLOCK_MANANA,
+    "por la tarde": BLOCK_TARDE,
+    "por la noche": BLOCK_NOCHE,
+}
+
+def has_label(task, label):
+    return label in task.get("labels", [])
+
+def has_checks_label(task):
+    """Check if task has any variant of the 'checks' label"""
+    return any(label.lower() in CHECKS_LABELS for label in task.get("labels", []))
+
+def get_duration_minutes(task):
+    # Explicit duration (what-if edits) wins over the labels
+    if task.get("duration_minutes"):
+        return int(task["duration_minutes"])
+    for label in task.get("labels", []):
+        if label in DURATION_LABELS:
+            return DURATION_LABELS[label]
+
+    # Default duration: 5 min for checks tasks, 20 min for others
+    if has_checks_label(task):
+        return 5
+    return 20
+
+def get_task_type_from_labels(task):
+    labels = task.get("labels", [])
+    for label, task_type in TYPE_LABELS:
+        if label in labels:
+            return task_type
+    return "General" # Default type
+
+def get_priority_value(task):
+    """Get numeric priority value for sorting (lower is higher priority)"""
+    priority = task.get("priority_value", 1)  # Use priority_value from formatted tasks
+    if isinstance(priority, str):
+        return {"P1": 1, "P2": 2, "P3": 3, "P4": 4}.get(priority, 4)
+    # Todoist uses 4=urgent, 3=high, 2=medium, 1=low
+    # We need to sort by this value (higher number = higher priority)
+    # So we return negative to sort correctly
+    return 5 - priority  # Convert: 4→1, 3→2, 2→3, 1→4
+
+def sort_by_priority(tasks):
+    return sorted(tasks, key=lambda t: (get_priority_value(t), get_duration_minutes(t), t.get("due_date") or "9999-99-99"))
+
+
+class TaskRecord:
+    """Scheduling attributes of a task, read from its labels in one pass"""
+
+    __slots__ = ("task", "duration", "type", "priority", "blocks", "checks", "sort_key")
+
+    def __init__(self, task: Dict):
+        duration = None
+        blocks = 0
+        checks = False
+        types = set()
+        for label in task.get("labels", []):
+            if duration is None and label in DURATION_LABELS:
+                duration = DURATION_LABELS[label]
+            blocks |= BLOCK_LABELS.get(label, 0)
+            if label.lower() in CHECKS_LABELS:
+                checks = True
+            types.add(label)
+
+        if task.get("duration_minutes"):
+            duration = int(task["duration_minutes"])
+
+        self.task = task
+        self.duration = duration if duration is not None else (5 if checks else 20)
+        self.type = next((task_type for label, task_type in TYPE_LABELS if label in types), "General")
+        self.priority = get_priority_value(task)
+        self.blocks = blocks
+        self.checks = checks
+        # Same order as sort_by_priority
+        self.sort_key = (self.priority, self.duration, task.get("due_date") or "9999-99-99")
+
+    def __repr__(self):
+        return f"TaskRecord({self.task.get('content')!r}, {self.duration} min, {self.type}, P{self.priority})"
+
+def task_key(task):
+    """Identity of a task in the schedule (Todoist id, or content for fixed blocks)"""
+    return task.get("id") or task.get("content")
+
+def minute_to_time(minute: int) -> str:
+    """Minutes from the start of the day -> 'HH:MM'"""
+    clock = RULES.day_start + minute
+    return f"{clock // 60 % 24:02d}:{clock % 60:02d}"
+
+def time_to_minute(hhmm: str) -> int:
+    """'HH:MM' -> minutes from the start of the day (may be outside the day)"""
+    hour, minute = map(int, hhmm.split(':'))
+    return hour * 60 + minute - RULES.day_start
+
+def is_calendar_event(entry) -> bool:
+    """Calendar events (content starting with 📅) are never overwritten by tasks"""
+    return isinstance(entry, dict) and entry.get('content', '').startswith('📅')
+
+
+class DaySchedule:
+    """
+    Minute grid of the day
+
+    grid[m] is the index in `entries` of what occupies minute m; entries[0] is
+    None (free). Entries are interned by identity, so the same dict placed twice
+    shares an index and consecutive minutes of one task form a single run.
+    """
+
+    __slots__ = ("grid", "entries", "_index", "_locked")
+
+    def __init__(self, minutes: int = DAY_MINUTES):
+        self.grid = np.zeros(minutes, dtype=np.int32)
+        self.entries: List[Optional[Dict]] = [None]
+        self._index: Dict[int, int] = {}
+        # Per entry: calendar event that tasks may not overwrite
+        self._locked: List[bool] = [False]
+
+    def __len__(self):
+        return len(self.grid)
+
+    def __getitem__(self, minute: int) -> Optional[Dict]:
+        return self.entries[self.grid[minute]]
+
+    def copy(self) -> 'DaySchedule':
+        schedule = DaySchedule.__new__(DaySchedule)
+        schedule.grid = self.grid.copy()
+        schedule.entries = list(self.entries)
+        schedule._index = dict(self._index)
+        schedule._locked = list(self._locked)
+        return schedule
+
+    def _intern(self, entry: Dict) -> int:
+        index = self._index.get(id(entry))
+        if index is None:
+            index = len(self.entries)
+            self.entries.append(entry)
+            self._locked.append(is_calendar_event(entry))
+            self._index[id(entry)] = index
+        return index
+
+    def _clip(self, start: int, end: int) -> Tuple[int, int]:
+        return max(start, 0), min(end, len(self.grid))
+
+    def fill(self, start: int, end: int, entry: Dict, keep_locked: bool = False):
+        """Occupy [start, end) with entry, optionally leaving calendar events in place"""
+        start, end = self._clip(start, end)
+        if start >= end:
+            return
+        index = self._intern(entry)
+        if keep_locked:
+            window = self.grid[start:end]
+            window[~np.asarray(self._locked)[window]] = index
+        else:
+            self.grid[start:end] = index
+
+    def is_free(self, start: int, end: int) -> bool:
+        start, end = self._clip(start, end)
+        return not self.grid[start:end].any()
+
+    def first_gap(self, start: int, end: int, duration: int) -> Optional[int]:
+        """First minute of [start, end) where `duration` free minutes begin, or None"""
+        start, end = self._clip(start, end)
+        if duration <= 0:
+            return start if start <= end else None
+        if end - start < duration:
+            return None
+        # Busy minutes in every window of `duration` minutes, from a running count
+        busy = np.concatenate(([0], np.cumsum(self.grid[start:end] != 0)))
+        fits = np.flatnonzero(busy[duration:] == busy[:-duration])
+        return start + int(fits[0]) if fits.size else None
+
+    def runs(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+        """Maximal (start, end, entry index) runs of [start, end)"""
+        start, end = self._clip(start, len(self.grid) if end is None else end)
+        if start >= end:
+            return
+        window = self.grid[start:end]
+        bounds = np.flatnonzero(np.diff(window)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(window)]))
+        for run_start, run_end in zip(starts.tolist(), ends.tolist()):
+            yield start + run_start, start + run_end, int(window[run_start])
+
+    def free_runs(self, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Maximal free (start, end) runs of [start, end)"""
+        return [(s, e) for s, e, index in self.runs(start, end) if index == 0]
+
+    def minutes_by_entry(self) -> np.ndarray:
+        """Minutes occupied by each entry index (index 0 = free minutes)"""
+        return np.bincount(self.grid, minlength=len(self.entries))
+
+    def scheduled_entries(self) -> List[Dict]:
+        """Distinct entries still occupying at least one minute"""
+        return [self.entries[index] for index in np.unique(self.grid).tolist() if index]
+
+
+def new_schedule() -> DaySchedule:
+    return DaySchedule()
+
+
+# --- Task Categorization ---
+
+def categorize_tasks(formatted_tasks: List[Dict], verbose: bool = True) -> Dict[str, List[Dict]]:
+    """
+    Annotate tasks with duration and type and split them into scheduling groups
+
+    Every task's labels are read once (TaskRecord) and the task is dropped into
+    all its groups in the same pass.
+
+    Returns:
+        Dict with 'rutina', 'checks', 'manana', 'tarde', 'noche' and 'flexible'
+        lists, each sorted by priority
+    """
+    buckets = {name: [] for name in ('rutina', 'checks', 'manana', 'tarde', 'noche', 'flexible')}
+    block_groups = ((BLOCK_RUTINA, 'rutina'), (BLOCK_MANANA, 'manana'), (BLOCK_TARDE, 'tarde'), (BLOCK_NOCHE, 'noche'))
+
+    for task in formatted_tasks:
+        record = TaskRecord(task)
+        # Add type and duration to each task dictionary for easier access
+        task["duration"] = record.duration
+        task["type"] = record.type
+
+        # PRIORITY 1: Checks tasks - these ALWAYS go to rutina administrativa, regardless of other labels
+        if record.checks:
+            buckets['checks'].append(record)
+        elif not record.blocks:
+            # Flexible tasks are those not in any specific time block and not checks
+            buckets['flexible'].append(record)
+        else:
+            for bit, name in block_groups:
+                if record.blocks & bit:
+                    buckets[name].append(record)
+
+    groups = {
+        name: [record.task for record in sorted(records, key=lambda r: r.sort_key)]
+        for name, records in buckets.items()
+    }
+
+    if verbose:
+        print(f"   🔍 Found {len(groups['checks'])} tasks with checks labels")
+        for task in groups['checks']:
+            print(f"      - {task['content']} (labels: {task.get('labels', [])})")
+
+    return groups
+
+
+# --- Fixed Blocks ---
+
+def place_fixed_blocks(schedule, calendar_events, formatted_tasks, completed_tasks=(),
+                       verbose: bool = True) -> List[Dict]:
+    """
+    Place calendar events, meals, completed tasks and tasks with a due_time
+
+    Returns:
+        Tasks still to be scheduled (no due_time, or their slot was taken)
+    """
+    # Fixed blocks - Calendar events have HIGHEST priority
+    if verbose:
+        print("   Adding calendar events as fixed blocks...")
+    for event in calendar_events:
+        start_minute = time_to_minute(event['start_time'])
+
+        # Only add if within our schedule range (07:00-21:00)
+        if 0 <= start_minute < DAY_MINUTES:
+            schedule.fill(start_minute, start_minute + event['duration'], event)
+            if verbose:
+                print(f"      ✅ {event['start_time']}-{event['end_time']}: {event['content']}")
+
+    # Fixed blocks - Desayunar and Comer
+    for content, start, end in RULES.fixed_blocks:
+        block = {"content": content, "type": "Fija", "priority": "P-", "duration": end - start, "url": "", "labels": []}
+        schedule.fill(start, end, block)
+
+    # Completed tasks keep their slot
+    insert_completed_tasks(schedule, completed_tasks, verbose=False)
+
+    # Schedule tasks with specific due_time first (like calendar events)
+    if verbose:
+        print("\n   Scheduling tasks with specific due_time...")
+    tasks_with_time = [t for t in formatted_tasks if t.get('due_time')]
+    tasks_without_time = [t for t in formatted_tasks if not t.get('due_time')]
+
+    for task in tasks_with_time:
+        due_time = task['due_time']
+        try:
+            start_minute = time_to_minute(due_time)
+
+            # Only schedule if within range (07:00-21:00)
+            if 0 <= start_minute < DAY_MINUTES:
+                duration = task['duration']
+                end_minute = min(start_minute + duration, DAY_MINUTES)
+
+                # Check if the time slot is available
+                if schedule.is_free(start_minute, end_minute):
+                    # Schedule at the specific time
+                    schedule.fill(start_minute, end_minute, task)
+                    if verbose:
+                        print(f"      ✅ {due_time}: {task['content']} (horario fijo)")
+                else:
+                    # Conflict detected, will be scheduled sequentially later
+                    if verbose:
+                        print(f"      ⚠️ {due_time}: {task['content']} (conflicto, se programará secuencialmente)")
+                    tasks_without_time.append(task)
+            else:
+                if verbose:
+                    print(f"      ⚠️ {due_time}: {task['content']} (fuera de rango 07:00-21:00)")
+                tasks_without_time.append(task)
+        except Exception as e:
+            print(f"      ❌ Error procesando {task['content']}: {e}")
+            tasks_without_time.append(task)
+
+    return tasks_without_time
+
+
+def insert_completed_tasks(schedule, completed_tasks, verbose: bool = True):
+    """Put today's completed tasks back at the times they were done"""
+    for completed_task in completed_tasks:
+        try:
+            start_minute = time_to_minute(completed_task['start_time'])
+            end_minute = time_to_minute(completed_task['end_time'])
+
+            # Only insert if within schedule range
+            if 0 <= start_minute < DAY_MINUTES and 0 <= end_minute <= DAY_MINUTES:
+                block = {
+                    'id': completed_task['id'],
+                    'content': completed_task['content'],
+                    'priority_value': 1,  # Default
+                    'labels': completed_task['labels'],
+                    'url': '',
+                    'completed': True,  # Mark as completed
+                    'duration': end_minute - start_minute
+                }
+                schedule.fill(start_minute, end_minute, block)
+                if verbose:
+                    print(f"      ✅ Inserted: {completed_task['start_time']}-{completed_task['end_time']}: {completed_task['content']}")
+        except Exception as e:
+            print(f"      ❌ Error inserting completed task: {e}")
+
+
+# --- First-fit Pass (V7.5 rules) ---
+
+def add_task_to_schedule_at(schedule, task, start_minute):
+    """Add a task at a specific minute, skipping calendar events"""
+    duration = task["duration"]
+    # Don't overwrite calendar events (they have 'content' starting with emoji)
+    schedule.fill(start_minute, start_minute + duration, task, keep_locked=True)
+    return start_minute + duration
+
+
+def _place_first_gap(schedule, task, start, end) -> bool:
+    gap = schedule.first_gap(start, end, task["duration"])
+    if gap is None:
+        return False
+    add_task_to_schedule_at(schedule, task, gap)
+    return True
+
+
+def alternate_morning_tasks(manana_tasks: List[Dict], verbose: bool = True) -> List[Dict]:
+    """
+    Morning rule: NO two physical tasks in a row. Must be 1 intellectual + 1 physical,
+    or 2 intellectual + 1 physical
+    """
+    # Separate morning tasks by type
+    morning_fisica = [t for t in manana_tasks if t["type"] == "Física"]
+    morning_intelectual = [t for t in manana_tasks if t["type"] == "Intelectual"]
+
+    # Build morning schedule with strict alternation
+    # Strategy: Distribute physical tasks evenly, always separated by 1-2 intellectual tasks
+    morning_schedule = []
+    fisica_idx = 0
+    intelectual_idx = 0
+
+    num_fisica = len(morning_fisica)
+    num_intelectual = len(morning_intelectual)
+
+    # Calculate how many intellectual tasks should go between each physical task
+    if num_fisica > 0:
+        intelectual_per_fisica = num_intelectual // num_fisica
+        extra_intelectual = num_intelectual % num_fisica
+    else:
+        intelectual_per_fisica = 0
+        extra_intelectual = num_intelectual
+
+    if verbose:
+        print(f"   Distribution: {num_intelectual} intelectual / {num_fisica} física = {intelectual_per_fisica} per física + {extra_intelectual} extra")
+
+    # Interleave tasks
+    while fisica_idx < num_fisica:
+        # Add 1 or 2 intellectual tasks before each physical
+        tasks_to_add = max(1, min(2, intelectual_per_fisica))
+
+        for _ in range(tasks_to_add):
+            if intelectual_idx < num_intelectual:
+                morning_schedule.append(morning_intelectual[intelectual_idx])
+                intelectual_idx += 1
+
+        # Add one physical task
+        morning_schedule.append(morning_fisica[fisica_idx])
+        fisica_idx += 1
+
+    # Add any remaining intellectual tasks at the end
+    while intelectual_idx < num_intelectual:
+        morning_schedule.append(morning_intelectual[intelectual_idx])
+        intelectual_idx += 1
+
+    return morning_schedule
+
+
+def first_fit(schedule, groups: Dict[str, List[Dict]], verbose: bool = True):
+    """Place the groups with the V7.5 first-fit rules (mutates schedule)"""
+    morning_end = ZONES['morning'][1]
+
+    # Sequential blocks, within the morning window (never over "Comer")
+    current_minute = RULES.blocks['rutina'][0]
+    for task in groups['rutina'] + groups['checks']:
+        if current_minute + task["duration"] <= morning_end:
+            current_minute = add_task_to_schedule_at(schedule, task, current_minute)
+        elif verbose:
+            print(f"   ⚠️ Task '{task['content']}' doesn't fit in morning block")
+
+    # Morning tasks with special alternation rule
+    if verbose:
+        print("\n   Applying morning alternation rule...")
+    morning_schedule = alternate_morning_tasks(groups['manana'], verbose)
+    morning_other = [t for t in groups['manana'] if t["type"] not in ["Física", "Intelectual"]]
+
+    if verbose:
+        print(f"   Morning schedule: {len(morning_schedule)} tasks")
+        print(f"   Sequence: {' → '.join([t['type'] for t in morning_schedule])}")
+
+    # Place morning tasks sequentially in the morning block
+    morning_start = current_minute
+    for task in morning_schedule:
+        if current_minute + task["duration"] <= morning_end: # Ensure it fits before lunch
+            current_minute = add_task_to_schedule_at(schedule, task, current_minute)
+        elif verbose:
+            print(f"   ⚠️ Task '{task['content']}' doesn't fit in morning block")
+
+    # Place other morning tasks (General, Administrativa) in remaining morning slots
+    for task in morning_other:
+        if not _place_first_gap(schedule, task, morning_start, morning_end) and verbose:
+            print(f"   ⚠️ Could not place morning task: {task['content']}")
+
+    # Afternoon, night and flexible tasks
+    for task in groups['tarde']:
+        _place_first_gap(schedule, task, *ZONES['afternoon'])
+    for task in groups['noche']:
+        _place_first_gap(schedule, task, *ZONES['night'])
+    for task in groups['flexible']:
+        _place_first_gap(schedule, task, 0, DAY_MINUTES)
+
+
+# --- Optimising Pass ---
+
+def free_intervals(schedule) -> List[Tuple[int, int, str]]:
+    """Maximal free runs of the schedule, split at block window boundaries"""
+    return [
+        (start, end, zone)
+        for zone, (zone_start, zone_end) in ZONES.items()
+        for start, end in schedule.free_runs(zone_start, zone_end)
+    ]
+
+
+def _item_type(item):
+    return item['task']["type"]
+
+
+def _item_duration(item):
+    return item['duration']
+
+
+def _arrange_bin(items: List[Dict], zone: str) -> Optional[List[Dict]]:
+    """
+    Order the optimiser items packed into one free interval
+
+    Administrative routine and checks first, then by priority; the window's
+    sequencing rules (schedule_rules) take precedence. None if they cannot hold.
+    """
+    head = [item for item in items if item['group'] in ('rutina', 'checks')]
+    rest = [item for item in items if item['group'] not in ('rutina', 'checks')]
+    return RULES.arrange(zone, head + rest, _item_type, _item_duration)
+
+
+class _Timeout(Exception):
+    pass
+
+
+def optimise_schedule(base_schedule, groups: Dict[str, List[Dict]],
+                      time_budget_ms: int = OPTIMISER_BUDGET_MS,
+                      incumbent: Optional[DaySchedule] = None) -> Tuple[DaySchedule, Dict]:
+    """
+    Branch and bound placement of the groups into the free intervals of base_schedule
+
+    Each task goes into one free interval of its group's block windows
+    (schedule_rules.GROUP_WINDOWS) or stays unassigned. The objective is the
+    priority-weighted scheduled minutes plus TASK_BONUS_MINUTES per task
+    (schedule_metrics 'score'); the bound is a fractional fill of the remaining
+    free minutes with the remaining tasks, best value per minute first. The
+    windows' sequencing rules are pruned on with a lower bound of the separators
+    each interval still needs, and checked exactly (RULES.arrange) on complete
+    solutions. The greedy best-fit solution is the starting incumbent, so the
+    search always returns a valid schedule, even when it runs out of time budget.
+    A given incumbent (the first-fit schedule, which may split a task around a
+    fixed block) is the one to beat instead when it scores higher, and is
+    returned as is unless the search finds something better.
+
+    The objective trades task count for weighted minutes: it may leave more tasks
+    unassigned than first-fit when that schedules more high-priority minutes.
+
+    Args:
+        incumbent: A schedule of the same tasks over base_schedule to improve on
+
+    Returns:
+        (schedule, stats) with 'nodes', 'complete' (search exhausted) and 'solve_ms'
+    """
+    started = time.perf_counter()
+    deadline = started + max(time_budget_ms - OPTIMISER_RESERVE_MS, 0) / 1000
+
+    bins = free_intervals(base_schedule)
+    bin_rules = [RULES.rules_for(zone) for _, _, zone in bins]
+    ruled_bins = [b for b in range(len(bins)) if bin_rules[b]]
+
+    items = []
+    seen = set()
+    to_place = []
+    for group, tasks in groups.items():
+        for task in tasks:
+            # A task may be in several groups; the first one (most restrictive) wins
+            if id(task) in seen:
+                continue
+            seen.add(id(task))
+            to_place.append(task)
+            allowed = tuple(
+                b for b, (start, end, zone) in enumerate(bins)
+                if zone in RULES.group_windows[group] and end - start >= task["duration"]
+                and RULES.allowed_in(zone, task["type"], task["duration"])
+            )
+            weight = PRIORITY_WEIGHTS.get(get_priority_value(task), 1)
+            items.append({
+                'task': task, 'group': group, 'duration': task["duration"], 'weight': weight,
+                'value': weight * (task["duration"] + TASK_BONUS_MINUTES), 'allowed': allowed,
+                'ruled': any(bin_rules[b] for b in allowed),
+            })
+
+    # Highest weight first (tightest bound), longest first within a weight
+    items.sort(key=lambda item: (-item['weight'], -item['duration']))
+
+    def shape(item):
+        return (item['duration'], item['allowed'], item['task']["type"], item['group'] in ('rutina', 'checks'))
+
+    def signature(item):
+        return (item['weight'],) + shape(item)
+
+    # Of tasks with the same shape, at most as many as the free intervals could
+    # hold are ever placed, and the highest weights first: drop the rest (keeps
+    # the search small with long task lists)
+    room = {}
+    kept = []
+    for item in items:
+        key = shape(item)
+        if key not in room:
+            room[key] = sum((bins[b][1] - bins[b][0]) // item['duration'] for b in item['allowed'])
+        if room[key] > 0:
+            room[key] -= 1
+            kept.append(item)
+    items = kept
+    n = len(items)
+
+    # Identical consecutive items are interchangeable: force non-decreasing bins
+    same_as_previous = [i > 0 and signature(items[i]) == signature(items[i - 1]) for i in range(n)]
+
+    # Tasks that could still go into an interval with sequencing rules
+    separators_after = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        separators_after[i] = separators_after[i + 1] + (1 if items[i]['ruled'] else 0)
+
+    capacity = [end - start for start, end, _ in bins]
+    # Per interval and rule: measure of the rule's type, count of other tasks
+    rule_measure = [[0] * len(rules) for rules in bin_rules]
+    rule_others = [[0] * len(rules) for rules in bin_rules]
+    choice = [len(bins)] * n  # len(bins) = unassigned
+
+    def place(i, b, sign=1):
+        item = items[i]
+        capacity[b] -= sign * item['duration']
+        for r, rule in enumerate(bin_rules[b]):
+            if item['task']["type"] == rule.type:
+                rule_measure[b][r] += sign * rule.measure(item['duration'])
+            else:
+                rule_others[b][r] += sign
+        choice[i] = b if sign > 0 else len(bins)
+
+    def unplace(i, b):
+        place(i, b, -1)
+
+    def deficit():
+        """Lower bound of separating tasks still missing across intervals"""
+        total = 0
+        for b in ruled_bins:
+            total += max(
+                [rule.separators_needed(rule_measure[b][r]) - rule_others[b][r] for r, rule in enumerate(bin_rules[b])]
+                + [0]
+            )
+        return total
+
+    def contents(b, choices):
+        return [items[i] for i in range(n) if choices[i] == b]
+
+    def arrangeable(choices):
+        return all(_arrange_bin(contents(b, choices), bins[b][2]) is not None for b in ruled_bins)
+
+    # Value per free minute, best first, for the fractional bound
+    by_density = sorted(range(n), key=lambda i: -items[i]['value'] / items[i]['duration'])
+
+    def greedy(order):
+        """Best fit in the given order, never breaking a sequencing rule"""
+        value = 0
+        for i in order:
+            item = items[i]
+            for b in sorted(item['allowed'], key=lambda b: capacity[b]):
+                if capacity[b] < item['duration']:
+                    continue
+                place(i, b)
+                if not bin_rules[b] or _arrange_bin(contents(b, choice), bins[b][2]) is not None:
+                    value += item['value']
+                    break
+                unplace(i, b)
+        placed = list(choice)
+        for i in range(n):
+            if choice[i] < len(bins):
+                unplace(i, choice[i])
+        return value, placed
+
+    # Incumbent: the better of priority order and value-per-minute order
+    best_value, best_choice = max(greedy(range(n)), greedy(by_density), key=lambda result: result[0])
+    if incumbent is not None:
+        incumbent_value = schedule_metrics(incumbent, to_place)['score']
+        if incumbent_value > best_value:
+            # No choice of intervals reproduces it: kept unless beaten
+            best_value, best_choice = incumbent_value, None
+
+    nodes = 0
+
+    def bound(i):
+        """Fractional fill of the free minutes with items i.., best value per minute first"""
+        free = sum(capacity)
+        extra = 0
+        for k in by_density:
+            if free <= 0:
+                break
+            item = items[k]
+            if k < i or not any(capacity[b] >= item['duration'] for b in item['allowed']):
+                continue
+            minutes = min(item['duration'], free)
+            extra += item['value'] * minutes / item['duration']
+            free -= minutes
+        return extra
+
+    def expand(i, value):
+        """Visit the node of items[:i] placed with this value: its choices for items[i], None if pruned"""
+        nonlocal best_value, best_choice, nodes
+        nodes += 1
+        if nodes & 15 == 0 and time.perf_counter() > deadline:
+            raise _Timeout()
+
+        if ruled_bins and deficit() > separators_after[i]:
+            return None
+
+        if i == n:
+            if value > best_value and arrangeable(choice):
+                best_value = value
+                best_choice = list(choice)
+            return None
+
+        if value + bound(i) <= best_value:
+            return None
+
+        item = items[i]
+        floor = choice[i - 1] if same_as_previous[i] else -1
+        candidates = sorted(
+            (b for b in item['allowed'] if b >= floor and capacity[b] >= item['duration']),
+            key=lambda b: capacity[b]
+        )
+        # Leave it unassigned last (identical items after it then stay unassigned too)
+        return candidates + [None]
+
+    def search():
+        """Depth first over the items with an explicit stack: one frame per item, however many"""
+        options = expand(0, 0)
+        # Frames: [item, value before it, its choices, next choice]
+        stack = [[0, 0, options, 0]] if options is not None else []
+        while stack:
+            frame = stack[-1]
+            i, value, options, k = frame
+            if k > 0 and options[k - 1] is not None:
+                unplace(i, options[k - 1])
+            if k == len(options):
+                stack.pop()
+                continue
+            frame[3] = k + 1
+            b = options[k]
+            if b is not None:
+                place(i, b)
+                value += items[i]['value']
+            children = expand(i + 1, value)
+            if children is not None:
+                stack.append([i + 1, value, children, 0])
+
+    complete = True
+    try:
+        search()
+    except _Timeout:
+        # Out of time: keep the incumbent
+        complete = False
+
+    if best_choice is None:
+        schedule = incumbent.copy()
+    else:
+        schedule = base_schedule.copy()
+        for b, (start, end, zone) in enumerate(bins):
+            minute = start
+            for item in _arrange_bin(contents(b, best_choice), zone):
+                schedule.fill(minute, minute + item['duration'], item['task'])
+                minute += item['duration']
+
+    return schedule, {
+        'nodes': nodes,
+        'complete': complete,
+        'solve_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+# --- Metrics ---
+
+def schedule_metrics(schedule, tasks: List[Dict]) -> Dict:
+    """
+    Scheduled/unassigned tasks, weighted minutes and idle time of a schedule
+
+    Args:
+        tasks: The tasks that were to be scheduled
+    """
+    keys = {task_key(task) for task in tasks}
+    scheduled = {}
+    scheduled_minutes = 0
+    weighted_minutes = 0
+    minutes = schedule.minutes_by_entry()
+    for index in np.flatnonzero(minutes[1:]).tolist():
+        entry = schedule.entries[index + 1]
+        if entry.get("content") in FIXED_CONTENTS:
+            continue
+        key = task_key(entry)
+        if key in keys and not entry.get('completed'):
+            weight = PRIORITY_WEIGHTS.get(get_priority_value(entry), 1)
+            count = int(minutes[index + 1])
+            scheduled[key] = weight
+            scheduled_minutes += count
+            weighted_minutes += weight * count
+
+    free = schedule.grid == 0
+    idle_minutes = int(minutes[0])
+    idle_gaps = int(free[:1].sum() + (free[1:] & ~free[:-1]).sum())
+
+    return {
+        'scheduled_tasks': len(scheduled),
+        'unassigned_tasks': len(keys - scheduled.keys()),
+        'scheduled_minutes': scheduled_minutes,
+        'weighted_minutes': weighted_minutes,
+        # Optimiser objective
+        'score': weighted_minutes + TASK_BONUS_MINUTES * sum(scheduled.values()),
+        'idle_minutes': idle_minutes,
+        'idle_gaps': idle_gaps,
+    }
+
+
+# --- Entry Point ---
+
+def build_schedule(formatted_tasks: List[Dict], calendar_events: List[Dict],
+                   completed_tasks: List[Dict] = (), optimise: bool = True,
+                   time_budget_ms: int = OPTIMISER_BUDGET_MS, verbose: bool = True) -> Tuple[DaySchedule, Dict]:
+    """
+    Build the day schedule
+
+    Args:
+        formatted_tasks: Todoist tasks for the day (annotated in place with duration/type)
+        calendar_events: Personal calendar events (fixed blocks)
+        completed_tasks: Tasks already completed today (kept where they were done)
+        optimise: Run the optimising pass after first-fit
+        time_budget_ms: Time budget of the optimising pass
+        verbose: Log every step (off for previews served by the web server)
+
+    Returns:
+        (schedule, report) where report has the 'first_fit' and 'optimised' metrics,
+        optimiser stats and which one was 'used'. The optimised schedule wins on
+        score (weighted minutes), so it can have more unassigned tasks.
+    """
+    groups = categorize_tasks(formatted_tasks, verbose)
+
+    if verbose:
+        print("\n5️⃣ Generating cronograma with Morning Alternation Rule...")
+
+    base = new_schedule()
+    tasks_without_time = place_fixed_blocks(base, calendar_events, formatted_tasks, completed_tasks, verbose)
+
+    # Only tasks without time (or those that couldn't be scheduled)
+    pending = {id(t) for t in tasks_without_time}
+    groups = {name: [t for t in tasks if id(t) in pending] for name, tasks in groups.items()}
+    to_schedule = tasks_without_time
+
+    schedule = base.copy()
+    first_fit(schedule, groups, verbose)
+    # First-fit may overwrite completed tasks: put them back
+    insert_completed_tasks(schedule, completed_tasks, verbose=False)
+
+    report = {'first_fit': schedule_metrics(schedule, to_schedule), 'used': 'first_fit'}
+
+    if optimise and to_schedule:
+        optimised, stats = optimise_schedule(base, groups, time_budget_ms, incumbent=schedule)
+        report['optimiser'] = stats
+        report['optimised'] = schedule_metrics(optimised, to_schedule)
+
+        first, best = report['first_fit'], report['optimised']
+        # Equal scores: fewer unassigned tasks, then fewer gaps
+        if (best['score'], -best['unassigned_tasks'], -best['idle_gaps']) > \
+                (first['score'], -first['unassigned_tasks'], -first['idle_gaps']):
+            schedule = optimised
+            report['used'] = 'optimised'
+
+        report['improvement'] = {
+            'score': best['score'] - first['score'],
+            'weighted_minutes': best['weighted_minutes'] - first['weighted_minutes'],
+            'scheduled_minutes': best['scheduled_minutes'] - first['scheduled_minutes'],
+            'unassigned_tasks': first['unassigned_tasks'] - best['unassigned_tasks'],
+            'idle_gaps': first['idle_gaps'] - best['idle_gaps'],
+        }
+        if verbose:
+            print(f"\n   🧮 Optimiser: {stats['solve_ms']} ms, {stats['nodes']} nodes"
+                  f"{'' if stats['complete'] else ' (time budget reached)'}")
+            print(f"      first-fit: {first['unassigned_tasks']} unassigned, {first['idle_gaps']} gaps, "
+                  f"{first['weighted_minutes']} weighted min")
+            print(f"      optimised: {best['unassigned_tasks']} unassigned, {best['idle_gaps']} gaps, "
+                  f"{best['weighted_minutes']} weighted min -> using {report['used']}")
+
+    return schedule, report
+
+
+def consolidate_schedule(schedule: DaySchedule) -> List[Dict]:
+    """Pass 2: group consecutive minutes of the same task (or free) into a list of events"""
+    final_cronograma = []
+    for start_minute, end_minute, index in schedule.runs():
+        task = schedule.entries[index]
+        duration = end_minute - start_minute
+
+        start_time = minute_to_time(start_minute)
+        end_time = minute_to_time(end_minute)
+
+        if task is None:
+            # This is a free block
+            final_cronograma.append({
+                "content": "Tiempo libre",
+                "type": "General",
+                "priority": "P4",
+                "duration": duration,
+                "url": "",
+                "labels": [],
+                "start_time": start_time,
+                "end_time": end_time
+            })
+        else:
+            # This is a scheduled task
+            task_details = dict(task)
+            task_details["start_time"] = start_time
+            task_details["end_time"] = end_time
+            # Overwrite duration to the actual consolidated block duration
+            task_details["duration"] = duration
+            # Convert Todoist priority to P1-P4 display format
+            # Todoist: 4=urgent, 3=high, 2=medium, 1=low
+            # Display: P1=urgent, P2=high, P3=medium, P4=low
+            todoist_priority = task.get("priority_value", 1)
+            display_priority = 5 - todoist_priority  # Convert: 4→P1, 3→P2, 2→P3, 1→P4
+            task_details["priority"] = f"P{display_priority}"
+            final_cronograma.append(task_details)
+
+    return final_cronograma
@@ -0,0 +1,235 @@
+'''
+Schedule Rules
+Declarative configuration of the day: time blocks, block windows and sequencing rules
+
+The configuration below (or a JSON file with the same keys, SCHEDULE_RULES_FILE)
+is compiled once into a ScheduleRules object that the scheduler and the HTML
+renderer query:
+
+- BLOCKS: named time blocks with their label and colour; a 'fixed' block is
+  occupied by that content (Desayunar, Comer)
+- WINDOWS: where tasks may be placed, and GROUP_WINDOWS which windows each task
+  group (rutina, checks, manana, tarde, noche, flexible) may use
+- RULES: sequencing rules inside a window. Tasks of `type` form runs of at most
+  `max_tasks` tasks or `max_minutes` minutes, and runs must be separated by at
+  least one task of another type. Examples:
+
+    {"window": "morning", "type": "Física", "max_tasks": 1}          # no two physical in a row
+    {"window": "afternoon", "type": "Física", "max_tasks": 1}
+    {"window": "morning", "type": "Intelectual", "max_minutes": 90}  # max 90 min intellectual streak
+
+Minutes in the compiled object are relative to the start of the day (07:00 = 0),
+like the schedule slots.
+'''
+
+import json
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DAY = ("07:00", "21:00")
+
+BLOCKS = [
+    {"name": "desayuno", "label": "Desayuno", "start": "07:00", "end": "07:20", "color": "#fffaf5", "fixed": "Desayunar"},
+    {"name": "rutina", "label": "Rutina administrativa matinal", "start": "07:20", "end": "09:40", "color": "#f0f7ff"},
+    {"name": "manana", "label": "Por la mañana", "start": "09:40", "end": "14:00", "color": "#f8fcf5"},
+    {"name": "comida", "label": "Comida", "start": "14:00", "end": "15:00", "color": "#fffef0", "fixed": "Comer"},
+    {"name": "tarde", "label": "Por la tarde", "start": "15:00", "end": "20:00", "color": "#fef8fa"},
+    {"name": "noche", "label": "Noche", "start": "20:00", "end": "21:00", "color": "#f8f7fc"},
+]
+
+# Colour and label outside every block
+OTHER_BLOCK = ("#ffffff", "Otro")
+
+WINDOWS = {
+    "morning": ("07:00", "14:00"),
+    "afternoon": ("15:00", "20:00"),
+    "night": ("20:00", "21:00"),
+}
+
+GROUP_WINDOWS = {
+    "rutina": ["morning"],
+    "checks": ["morning"],
+    "manana": ["morning"],
+    "tarde": ["afternoon"],
+    "noche": ["night"],
+    "flexible": ["morning", "afternoon", "night"],
+}
+
+RULES = [
+    # Morning rule: NO two physical tasks in a row
+    {"window": "morning", "type": "Física", "max_tasks": 1},
+]
+
+
+def _clock_minutes(hhmm: str) -> int:
+    hour, minute = map(int, hhmm.split(":"))
+    return hour * 60 + minute
+
+
+class RunRule:
+    """Tasks of one type in runs of at most `limit` tasks (or minutes), separated by other tasks"""
+
+    __slots__ = ("window", "type", "limit", "by_minutes")
+
+    def __init__(self, window: str, type: str, max_tasks: Optional[int] = None, max_minutes: Optional[int] = None):
+        if (max_tasks is None) == (max_minutes is None):
+            raise ValueError(f"Rule for {type} in {window}: set exactly one of max_tasks / max_minutes")
+        self.window = window
+        self.type = type
+        self.by_minutes = max_minutes is not None
+        self.limit = max_minutes if self.by_minutes else max_tasks
+
+    def measure(self, duration: int) -> int:
+        """How much a task of the rule's type adds to a run"""
+        return duration if self.by_minutes else 1
+
+    def fits_alone(self, duration: int) -> bool:
+        return self.measure(duration) <= self.limit
+
+    def separators_needed(self, total: int, streak: int = 0) -> int:
+        """
+        Lower bound of separating tasks needed to place `total` (measure) of the
+        rule's type, when the sequence currently ends with a run of `streak`
+        """
+        if total <= 0:
+            return 0
+        if streak > 0:
+            return math.ceil(max(0, total - (self.limit - streak)) / self.limit)
+        return math.ceil(total / self.limit) - 1
+
+    def __repr__(self):
+        unit = "min" if self.by_minutes else "tasks"
+        return f"RunRule({self.window}, {self.type}, <= {self.limit} {unit})"
+
+
+class ScheduleRules:
+    """Compiled blocks, windows and rules"""
+
+    def __init__(self, day=DAY, blocks=BLOCKS, windows=WINDOWS, group_windows=GROUP_WINDOWS, rules=RULES):
+        self.day_start = _clock_minutes(day[0])
+        self.day_minutes = _clock_minutes(day[1]) - self.day_start
+
+        def relative(hhmm):
+            return _clock_minutes(hhmm) - self.day_start
+
+        self.blocks = {
+            block["name"]: (relative(block["start"]), relative(block["end"]))
+            for block in blocks
+        }
+        self.fixed_blocks = [
+            (block["fixed"], relative(block["start"]), relative(block["end"]))
+            for block in blocks if block.get("fixed")
+        ]
+        self.windows = {name: (relative(start), relative(end)) for name, (start, end) in windows.items()}
+        self.group_windows = {group: tuple(names) for group, names in group_windows.items()}
+
+        for group, names in self.group_windows.items():
+            unknown = set(names) - set(self.windows)
+            if unknown:
+                raise ValueError(f"Group {group} uses unknown windows {sorted(unknown)}")
+
+        self.rules_by_window: Dict[str, Tuple[RunRule, ...]] = {name: () for name in self.windows}
+        for rule in rules:
+            compiled = RunRule(**rule)
+            if compiled.window not in self.windows:
+                raise ValueError(f"Rule {compiled} uses unknown window")
+            self.rules_by_window[compiled.window] += (compiled,)
+
+        # Display block of every minute of the clock day, for O(1) lookups
+        self._block_by_minute = [OTHER_BLOCK] * (24 * 60)
+        for block in blocks:
+            for minute in range(_clock_minutes(block["start"]), _clock_minutes(block["end"])):
+                self._block_by_minute[minute] = (block["color"], block["label"])
+
+    def block_at(self, hhmm: str) -> Tuple[str, str]:
+        """(colour, label) of the block a clock time falls in"""
+        return self._block_by_minute[_clock_minutes(hhmm) % (24 * 60)]
+
+    def rules_for(self, window: str) -> Tuple[RunRule, ...]:
+        return self.rules_by_window.get(window, ())
+
+    def allowed_in(self, window: str, task_type: str, duration: int) -> bool:
+        """A task that alone breaks a rule of the window can never go there"""
+        return all(rule.fits_alone(duration) for rule in self.rules_for(window) if rule.type == task_type)
+
+    def arrange(self, window: str, items: Sequence, type_of, duration_of) -> Optional[List]:
+        """
+        Order the tasks of one contiguous interval so that every rule of the window holds
+
+        Keeps the given (preferred) order where possible: a constrained task is
+        pulled forward only when there are no spare separators left for it.
+
+        Args:
+            items: Tasks in preferred order
+            type_of/duration_of: Accessors for an item's type and duration
+
+        Returns:
+            The ordered items, or None if the rules cannot be satisfied
+        """
+        rules = self.rules_for(window)
+        if not rules:
+            return list(items)
+
+        remaining = list(items)
+        sequence = []
+        streaks = [0] * len(rules)
+
+        while remaining:
+            allowed = [
+                item for item in remaining
+                if all(type_of(item) != rule.type or streaks[r] + rule.measure(duration_of(item)) <= rule.limit
+                       for r, rule in enumerate(rules))
+            ]
+            if not allowed:
+                return None
+
+            pick = allowed[0]
+            for r, rule in enumerate(rules):
+                of_type = [item for item in remaining if type_of(item) == rule.type]
+                if not of_type:
+                    continue
+                needed = rule.separators_needed(sum(rule.measure(duration_of(item)) for item in of_type), streaks[r])
+                if needed >= len(remaining) - len(of_type):
+                    candidates = [item for item in allowed if type_of(item) == rule.type]
+                    if candidates:
+                        pick = candidates[0]
+                        break
+
+            remaining.remove(pick)
+            sequence.append(pick)
+            for r, rule in enumerate(rules):
+                streaks[r] = streaks[r] + rule.measure(duration_of(pick)) if type_of(pick) == rule.type else 0
+
+        return sequence
+
+    def check_sequence(self, window: str, items: Sequence, type_of, duration_of) -> bool:
+        """Whether an already ordered, contiguous sequence keeps the window's rules"""
+        for rule in self.rules_for(window):
+            streak = 0
+            for item in items:
+                streak = streak + rule.measure(duration_of(item)) if type_of(item) == rule.type else 0
+                if streak > rule.limit:
+                    return False
+        return True
+
+
+def load_rules(path: Optional[str] = None) -> ScheduleRules:
+    """
+    Compile the default configuration, overridden by a JSON file if given
+
+    The file may define any of "day", "blocks", "windows", "group_windows", "rules".
+    """
+    config = {"day": DAY, "blocks": BLOCKS, "windows": WINDOWS, "group_windows": GROUP_WINDOWS, "rules": RULES}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown schedule rule keys: {sorted(unknown)}")
+        config.update(overrides)
+    return ScheduleRules(**config)
+
+
+# Compiled once on import
+SCHEDULE_RULES = load_rules(os.getenv("SCHEDULE_RULES_FILE"))
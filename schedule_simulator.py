@@ -0,0 +1,204 @@
+'''
+Schedule Simulator
+What-if previews of a day plan: apply edits to the stored inputs and rerun the engine
+
+The generator stores every plan with its inputs (schedules_db). A simulation
+takes those inputs, applies a list of edits and runs build_schedule in memory,
+so nothing is fetched from Todoist or CalDAV and nothing is written. Edits:
+
+    {"action": "add", "task": {"content": "...", "labels": [...], "priority_value": 4,
+                               "duration_minutes": 30, "due_time": "16:00"}}
+    {"action": "remove", "task_id": "123"}
+    {"action": "pin", "task_id": "123", "start_time": "10:30"}   # null start_time unpins
+    {"action": "duration", "task_id": "123", "minutes": 45}
+
+Pinning uses the engine's due_time placement: the task goes exactly there if the
+slot is free, otherwise it is scheduled like any other task (reported in
+'pin_conflicts').
+'''
+
+import copy
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from schedule_engine import build_schedule, consolidate_schedule, task_key, DAY_MINUTES, FIXED_CONTENTS, PRIORITY_WEIGHTS
+
+# Optimiser budget of a simulation (previews must stay interactive)
+SIMULATION_BUDGET_MS = int(os.getenv('SCHEDULE_SIMULATION_BUDGET_MS', 150))
+
+
+class EditError(ValueError):
+    """An edit that cannot be applied to the stored plan"""
+
+
+def _valid_time(value: str) -> str:
+    try:
+        datetime.strptime(value, '%H:%M')
+    except (TypeError, ValueError):
+        raise EditError(f"Invalid time {value!r} (expected HH:MM)")
+    return value
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _valid_minutes(value) -> int:
+    """Whole minutes that fit in the scheduled day"""
+    if not _is_int(value):
+        raise EditError(f"Invalid duration {value!r} (expected whole minutes)")
+    if not 0 < value <= DAY_MINUTES:
+        raise EditError(f"Duration out of range: {value} (1-{DAY_MINUTES} minutes)")
+    return value
+
+
+def _valid_priority(value) -> int:
+    if not _is_int(value) or value not in PRIORITY_WEIGHTS:
+        raise EditError(f"Invalid priority_value {value!r} (expected 1-4)")
+    return value
+
+
+def _valid_labels(value) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(label, str) for label in value):
+        raise EditError(f"Invalid labels {value!r} (expected a list of strings)")
+    return value
+
+
+def apply_edits(tasks: List[Dict], edits: List[Dict]) -> List[Dict]:
+    """
+    Apply what-if edits to a copy of the tasks
+
+    Raises:
+        EditError: Malformed edit, unknown action, unknown task or invalid value
+    """
+    tasks = copy.deepcopy(tasks)
+    by_key = {str(task_key(task)): task for task in tasks}
+
+    def find(edit):
+        key = str(edit.get('task_id', ''))
+        if key not in by_key:
+            raise EditError(f"Unknown task {key!r}")
+        return by_key[key]
+
+    for n, edit in enumerate(edits):
+        if not isinstance(edit, dict):
+            raise EditError(f"Edit {n} is not an object")
+        action = edit.get('action')
+
+        if action == 'add':
+            if not isinstance(edit.get('task') or {}, dict):
+                raise EditError(f"Edit {n}: task must be an object")
+            new_task = dict(edit.get('task') or {})
+            if not new_task.get('content') or not isinstance(new_task['content'], str):
+                raise EditError("New task needs a content")
+            new_task.setdefault('id', f"whatif-{n}")
+            new_task['labels'] = _valid_labels(new_task.get('labels', []))
+            new_task['priority_value'] = _valid_priority(new_task.get('priority_value', 1))
+            new_task.setdefault('url', '')
+            if new_task.get('duration_minutes') is not None:
+                new_task['duration_minutes'] = _valid_minutes(new_task['duration_minutes'])
+            if new_task.get('due_time'):
+                _valid_time(new_task['due_time'])
+            if str(task_key(new_task)) in by_key:
+                raise EditError(f"Task {task_key(new_task)!r} already exists")
+            tasks.append(new_task)
+            by_key[str(task_key(new_task))] = new_task
+
+        elif action == 'remove':
+            task = find(edit)
+            tasks.remove(task)
+            del by_key[str(task_key(task))]
+
+        elif action == 'pin':
+            task = find(edit)
+            if edit.get('start_time'):
+                task['due_time'] = _valid_time(edit['start_time'])
+            else:
+                task.pop('due_time', None)
+
+        elif action == 'duration':
+            find(edit)['duration_minutes'] = _valid_minutes(edit.get('minutes'))
+
+        else:
+            raise EditError(f"Unknown action {action!r} (add, remove, pin, duration)")
+
+    return tasks
+
+
+def _task_times(plan: List[Dict]) -> Dict[str, str]:
+    """Task key -> 'HH:MM-HH:MM' (comma-separated if split) of the tasks in a plan"""
+    times = {}
+    for block in plan:
+        if not block.get('id') or block.get('completed') or block.get('content') in FIXED_CONTENTS:
+            continue
+        key = str(block['id'])
+        span = f"{block['start_time']}-{block['end_time']}"
+        times[key] = f"{times[key]}, {span}" if key in times else span
+    return times
+
+
+def plan_changes(before: List[Dict], after: List[Dict]) -> Dict[str, List[Dict]]:
+    """Tasks moved, newly scheduled and no longer scheduled between two plans"""
+    old, new = _task_times(before), _task_times(after)
+    contents = {str(block['id']): block.get('content') for block in before + after if block.get('id')}
+    return {
+        'moved': [
+            {'id': key, 'content': contents[key], 'from': old[key], 'to': new[key]}
+            for key in new if key in old and old[key] != new[key]
+        ],
+        'scheduled': [{'id': key, 'content': contents[key], 'to': new[key]} for key in new if key not in old],
+        'unscheduled': [{'id': key, 'content': contents[key], 'from': old[key]} for key in old if key not in new],
+    }
+
+
+def simulate(stored: Dict, edits: List[Dict], time_budget_ms: Optional[int] = None) -> Dict:
+    """
+    Preview a stored day plan with edits applied
+
+    Args:
+        stored: Plan with its inputs, as returned by schedules_db.get_day_schedule
+        edits: What-if edits (see module docstring)
+        time_budget_ms: Optimiser budget (default SIMULATION_BUDGET_MS)
+
+    Returns:
+        Dict with the new 'plan', 'unassigned' tasks, 'changes' against the stored
+        plan, 'pin_conflicts', the engine 'report' and 'solve_ms'
+
+    Raises:
+        EditError: If an edit cannot be applied
+    """
+    started = time.perf_counter()
+    tasks = apply_edits(stored['tasks'], edits)
+
+    # The engine logs every step; a preview only needs the result
+    schedule, report = build_schedule(
+        tasks,
+        copy.deepcopy(stored['calendar_events']),
+        copy.deepcopy(stored['completed_tasks']),
+        time_budget_ms=SIMULATION_BUDGET_MS if time_budget_ms is None else time_budget_ms,
+        verbose=False
+    )
+    plan = consolidate_schedule(schedule)
+
+    scheduled = {str(task_key(entry)) for entry in schedule.scheduled_entries()}
+    pinned = {str(edit.get('task_id')): edit['start_time'] for edit in edits
+              if edit.get('action') == 'pin' and edit.get('start_time')}
+    starts = {str(block['id']): block['start_time'] for block in reversed(plan) if block.get('id')}
+
+    return {
+        'date': stored['date'],
+        'plan': plan,
+        'unassigned': [
+            {'id': task.get('id'), 'content': task.get('content')}
+            for task in tasks if str(task_key(task)) not in scheduled
+        ],
+        'changes': plan_changes(stored['plan'], plan),
+        'pin_conflicts': [
+            {'id': key, 'requested': start_time, 'placed': starts.get(key)}
+            for key, start_time in pinned.items() if starts.get(key) != start_time
+        ],
+        'report': report,
+        'solve_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
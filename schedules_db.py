@@ -0,0 +1,93 @@
+"""
+Day Schedules Database
+Stores each generated day plan as structured data
+
+One row per date with the engine inputs (tasks, calendar events, completed
+tasks) and its output (consolidated plan and build report), replaced on every
+generation. The what-if simulator (schedule_simulator.py) replays the inputs
+with edits in memory, without calling Todoist or CalDAV again.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlite_store import db_path, get_connection, transaction, register_migrations
+
+DB_PATH = db_path('schedules.db')
+
+# Days of plans kept (older rows are dropped on save)
+KEEP_DAYS = int(os.getenv('SCHEDULES_KEEP_DAYS', 30))
+
+register_migrations(DB_PATH, [
+    """
+    CREATE TABLE IF NOT EXISTS day_schedules (
+        date TEXT PRIMARY KEY,
+        tasks TEXT NOT NULL,
+        calendar_events TEXT NOT NULL,
+        completed_tasks TEXT NOT NULL,
+        plan TEXT NOT NULL,
+        report TEXT NOT NULL,
+        generated_at TEXT NOT NULL
+    );
+    """,
+])
+
+
+def save_day_schedule(date: str, tasks: List[Dict], calendar_events: List[Dict],
+                      completed_tasks: List[Dict], plan: List[Dict], report: Dict):
+    """
+    Store (replace) the plan generated for a date
+
+    Args:
+        date: Date of the plan (YYYY-MM-DD)
+        tasks: Tasks given to build_schedule
+        calendar_events: Calendar events given to build_schedule
+        completed_tasks: Completed tasks given to build_schedule
+        plan: consolidate_schedule output
+        report: build_schedule report
+    """
+    cutoff = (datetime.now() - timedelta(days=KEEP_DAYS)).strftime("%Y-%m-%d")
+    with transaction(DB_PATH) as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO day_schedules
+                (date, tasks, calendar_events, completed_tasks, plan, report, generated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            date,
+            json.dumps(tasks, ensure_ascii=False, default=str),
+            json.dumps(calendar_events, ensure_ascii=False, default=str),
+            json.dumps(list(completed_tasks), ensure_ascii=False, default=str),
+            json.dumps(plan, ensure_ascii=False, default=str),
+            json.dumps(report, ensure_ascii=False, default=str),
+            datetime.now().isoformat()
+        ))
+        if KEEP_DAYS > 0:
+            conn.execute("DELETE FROM day_schedules WHERE date < ?", (cutoff,))
+
+
+def get_day_schedule(date: str) -> Optional[Dict]:
+    """The stored plan of a date with its inputs, or None if it was never generated"""
+    conn = get_connection(DB_PATH)
+    row = conn.execute("""
+        SELECT date, tasks, calendar_events, completed_tasks, plan, report, generated_at
+        FROM day_schedules WHERE date = ?
+    """, (date,)).fetchone()
+
+    if not row:
+        return None
+
+    return {
+        'date': row[0],
+        'tasks': json.loads(row[1]),
+        'calendar_events': json.loads(row[2]),
+        'completed_tasks': json.loads(row[3]),
+        'plan': json.loads(row[4]),
+        'report': json.loads(row[5]),
+        'generated_at': row[6]
+    }
+
+
+# Auto-initialize database on import
+get_connection(DB_PATH)
@@ -0,0 +1,180 @@
+"""
+SQLite Store
+Shared access layer for the local SQLite databases
+
+- One data directory for every database file (DATA_DIR, default data/ next to
+  this module)
+- One cached connection per thread and file, so the statement cache is reused
+  instead of reconnecting and re-preparing on every call. Short-lived threads
+  (one per web request) call close_connections() when they finish
+- WAL journal mode and busy_timeout, so Flask request threads, the expense
+  queue worker and the cronograma generator can share the same files
+- Schema migrations registered per file and applied once, tracked with
+  PRAGMA user_version
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Union
+
+# Next to the code, not the working directory: the web server, the cron job and
+# scripts started elsewhere must all open the same files
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 10000))
+
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 256
+
+Migration = Union[str, Callable[[sqlite3.Connection], None]]
+
+_local = threading.local()
+_migrations: Dict[str, List[Migration]] = {}
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def db_path(filename: str) -> str:
+    """Absolute path of a database file inside the data directory"""
+    return os.path.join(DATA_DIR, filename)
+
+
+def register_migrations(path: str, migrations: List[Migration]):
+    """
+    Declare the schema of a database file
+
+    Args:
+        path: Database file
+        migrations: Ordered SQL scripts or callables(conn). Migration N runs once,
+                    when the file's user_version is below N. Never edit or reorder
+                    released migrations; append new ones.
+    """
+    _migrations[os.path.abspath(path)] = list(migrations)
+
+
+def _statements(script: str) -> List[str]:
+    """Split an SQL script into statements (triggers and quoted ';' kept whole)"""
+    statements = []
+    current = ''
+    for part in script.split(';'):
+        current += part + ';'
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    if current.strip(' \t\n;'):
+        statements.append(current.strip())
+    return statements
+
+
+def _apply_migrations(conn: sqlite3.Connection, path: str):
+    """
+    Each migration and its user_version bump commit together or not at all
+
+    executescript() would commit before running, so scripts are split and run
+    with execute() inside an explicit transaction. Callables must not commit.
+    BEGIN IMMEDIATE makes another process starting at the same time wait and
+    then see the new user_version.
+    """
+    migrations = _migrations.get(path, [])
+
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(migrations):
+                conn.commit()
+                return
+            migration = migrations[version]
+            if callable(migration):
+                migration(conn)
+            else:
+                for statement in _statements(migration):
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def get_connection(path: str) -> sqlite3.Connection:
+    """
+    Cached connection to a database file for the current thread
+
+    The first connection to a file in the process applies its pending migrations.
+    Do not close the returned connection; close_connections() closes them all
+    at the end of the thread's work.
+    """
+    path = os.path.abspath(path)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+
+    if path not in _migrated:
+        with _migrate_lock:
+            if path not in _migrated:
+                _apply_migrations(conn, path)
+                _migrated.add(path)
+
+    connections[path] = conn
+    return conn
+
+
+@contextmanager
+def transaction(path: str, immediate: bool = False):
+    """
+    Connection inside a transaction: commit on success, rollback on error
+
+    Args:
+        immediate: Take the write lock up front (BEGIN IMMEDIATE), for
+                   read-then-write sequences that must not interleave
+    """
+    conn = get_connection(path)
+    if immediate:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def close_connections():
+    """Close the current thread's connections (the next get_connection reopens)"""
+    connections = getattr(_local, 'connections', {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def adopt_legacy_file(old_path: str, new_path: str) -> bool:
+    """
+    Move a database file created outside the data directory into it
+
+    Only moves if the new file does not exist yet (WAL/SHM side files included).
+    """
+    old_path = os.path.abspath(old_path)
+    new_path = os.path.abspath(new_path)
+    if old_path == new_path or not os.path.exists(old_path) or os.path.exists(new_path):
+        return False
+
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(old_path + suffix):
+            shutil.move(old_path + suffix, new_path + suffix)
+    print(f"📦 Moved {old_path} -> {new_path}")
+    return True
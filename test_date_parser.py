@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Corpus de pruebas y micro-benchmark de date_parser
+
+Uso: python test_date_parser.py [iteraciones]
+"""
+
+import sys
+import timeit
+from datetime import date
+
+from date_parser import extraer_fecha
+
+# Lunes 19 de octubre de 2026
+HOY = date(2026, 10, 19)
+
+# (texto, fecha esperada, texto limpio esperado)
+CORPUS = [
+    # Relativas
+    ("25.50 Mercadona ayer", "2026-10-18", "25.50 Mercadona"),
+    ("25.50 ayer Mercadona", "2026-10-18", "25.50 Mercadona"),
+    ("12 farmacia anteayer", "2026-10-17", "12 farmacia"),
+    ("12 farmacia ante ayer", "2026-10-17", "12 farmacia"),
+    ("8 cine hoy", "2026-10-19", "8 cine"),
+    ("30 gasolina mañana", "2026-10-20", "30 gasolina"),
+    ("30 gasolina pasado mañana", "2026-10-21", "30 gasolina"),
+    ("4 café esta mañana", "2026-10-19", "4 café"),
+    ("4 café de la mañana", None, "4 café de la mañana"),
+    ("15 Uber AYER", "2026-10-18", "15 Uber"),
+    # Días de la semana (hoy es lunes)
+    ("20 cena el viernes", "2026-10-16", "20 cena"),
+    ("20 cena el lunes", "2026-10-19", "20 cena"),
+    ("20 cena el lunes pasado", "2026-10-12", "20 cena"),
+    ("20 cena el próximo lunes", "2026-10-26", "20 cena"),
+    ("20 cena el miércoles que viene", "2026-10-21", "20 cena"),
+    ("9 churros domingo", "2026-10-18", "9 churros"),
+    ("9 churros el sabado", "2026-10-17", "9 churros"),
+    # Día y mes
+    ("50 regalo 10 diciembre", "2026-12-10", "50 regalo"),
+    ("50 regalo 10 de diciembre", "2026-12-10", "50 regalo"),
+    ("50 regalo 19 octubre", "2026-10-19", "50 regalo"),
+    ("50 regalo 15 enero", "2027-01-15", "50 regalo"),
+    ("100 seguro 1 de enero de 2026", "2026-01-01", "100 seguro"),
+    ("100 seguro 10 diciembre 2025", "2025-12-10", "100 seguro"),
+    ("100 seguro 31 febrero", None, "100 seguro 31 febrero"),
+    # Numéricas
+    ("60 luz 05/10/2026", "2026-10-05", "60 luz"),
+    ("60 luz 5-10-2026", "2026-10-05", "60 luz"),
+    ("60 luz 32/10/2026", None, "60 luz 32/10/2026"),
+    # Solo mes
+    ("200 viaje febrero", "2027-02-01", "200 viaje"),
+    ("200 viaje noviembre", "2026-11-01", "200 viaje"),
+    ("200 viaje marzo de 2026", "2026-03-01", "200 viaje"),
+    # Sin fecha
+    ("25.50 Mercadona", None, "25.50 Mercadona"),
+    ("3 Hoyos golf", None, "3 Hoyos golf"),
+    ("40 ropa Mayoral", None, "40 ropa Mayoral"),
+    ("", None, ""),
+]
+
+
+def test_corpus():
+    """Every corpus entry parses to the expected date and cleaned text"""
+    fallos = []
+    for texto, fecha_esperada, limpio_esperado in CORPUS:
+        resultado = extraer_fecha(texto, hoy=HOY)
+        if resultado != (fecha_esperada, limpio_esperado):
+            fallos.append((texto, resultado, (fecha_esperada, limpio_esperado)))
+
+    for texto, resultado, esperado in fallos:
+        print(f"❌ {texto!r}: {resultado} (esperado {esperado})")
+    assert not fallos, f"{len(fallos)} de {len(CORPUS)} casos fallan"
+
+
+def benchmark(iteraciones=2000):
+    """Time a full pass over the corpus"""
+    textos = [texto for texto, _, _ in CORPUS]
+
+    def pasada():
+        for texto in textos:
+            extraer_fecha(texto, hoy=HOY)
+
+    segundos = min(timeit.repeat(pasada, number=iteraciones, repeat=3))
+    llamadas = iteraciones * len(textos)
+    print(f"⏱️  {llamadas} llamadas en {segundos:.3f}s "
+          f"({segundos / llamadas * 1e6:.2f} µs/llamada)")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 TEST: DATE PARSER")
+    print("=" * 60)
+
+    test_corpus()
+    print(f"✅ {len(CORPUS)} casos OK")
+
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
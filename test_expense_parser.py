@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Corpus de pruebas del parser local de gastos (extraer_gasto_local)
+
+Cada frase lleva el importe, la descripción y la confianza esperados. Con
+confianza < CONFIANZA_MINIMA el gasto se extrae con la IA, así que las frases
+ambiguas deben quedar por debajo.
+
+Uso: python test_expense_parser.py
+"""
+
+from datetime import date
+
+from expense_utils import extraer_gasto_local, CONFIANZA_MINIMA
+
+# Lunes 19 de octubre de 2026
+HOY = date(2026, 10, 19)
+
+# (texto, importe, descripción, fecha, confianza)
+CORPUS = [
+    # Cifras
+    ("25.50 Mercadona", 25.5, "Mercadona", None, 0.95),
+    ("0,85 pan", 0.85, "pan", None, 0.95),
+    ("25,50€ Mercadona", 25.5, "Mercadona", None, 0.95),
+    ("45,90 € zapatillas Decathlon", 45.9, "zapatillas Decathlon", None, 0.95),
+    ("1 euro pan", 1.0, "pan", None, 0.95),
+    ("12 de fruta", 12.0, "fruta", None, 0.95),
+    ("150 restaurante con Cris", 150.0, "restaurante con Cris", None, 0.95),
+    ("80 cents caramelo", 0.8, "caramelo", None, 0.95),
+    # Céntimos separados
+    ("25 euros 50 farmacia", 25.5, "farmacia", None, 0.95),
+    ("25 con 50 farmacia", 25.5, "farmacia", None, 0.95),
+    ("3 euros con 20 taxi", 3.2, "taxi", None, 0.95),
+    # Importe al final
+    ("Mercadona 25.50", 25.5, "Mercadona", None, 0.75),
+    ("Mercadona 25,50 euros", 25.5, "Mercadona", None, 0.75),
+    ("una cerveza 3 euros", 3.0, "una cerveza", None, 0.75),
+    # Palabras
+    ("dos euros cincuenta café", 2.5, "café", None, 0.85),
+    ("uno euro comida", 1.0, "comida", None, 0.85),
+    ("tres euros churros", 3.0, "churros", None, 0.85),
+    ("veinte euros con cincuenta cena", 20.5, "cena", None, 0.85),
+    ("veintiún euros cena", 21.0, "cena", None, 0.85),
+    ("treinta y cinco euros peluquería", 35.0, "peluquería", None, 0.85),
+    ("cuarenta y dos con veinte Repsol", 42.2, "Repsol", None, 0.85),
+    ("ciento veinte euros seguro coche", 120.0, "seguro coche", None, 0.85),
+    ("mil doscientos alquiler", 1200.0, "alquiler", None, 0.85),
+    ("cincuenta céntimos chicle", 0.5, "chicle", None, 0.85),
+    # Con fecha
+    ("60 gasolina ayer", 60.0, "gasolina", "2026-10-18", 0.95),
+    ("3 café el viernes", 3.0, "café", "2026-10-16", 0.95),
+    ("8 cine hoy", 8.0, "cine", "2026-10-19", 0.95),
+    # Ambiguas: a la IA
+    ("15 taxi 3 personas", 15.0, "taxi 3 personas", None, 0.55),
+    ("dos cafés y un croissant", 2.0, "cafés y un croissant", None, 0.55),
+    ("15 cena con Ana Luis Pedro María Juan y Rosa", 15.0,
+     "cena con Ana Luis Pedro María Juan y Rosa", None, 0.75),
+    # Sin importe o sin descripción
+    ("un café", None, None, None, 0.0),
+    ("cinco euros", None, None, None, 0.0),
+    ("Mercadona", None, None, None, 0.0),
+    ("", None, None, None, 0.0),
+]
+
+
+def test_corpus():
+    """Every corpus entry parses to the expected amount, description, date and confidence"""
+    fallos = []
+    for texto, monto, descripcion, fecha, confianza in CORPUS:
+        (monto_r, descripcion_r, fecha_r, _, _), confianza_r = extraer_gasto_local(texto, HOY)
+        if (monto_r, descripcion_r, fecha_r, confianza_r) != (monto, descripcion, fecha, confianza):
+            fallos.append((texto, (monto_r, descripcion_r, fecha_r, confianza_r),
+                           (monto, descripcion, fecha, confianza)))
+
+    for texto, resultado, esperado in fallos:
+        print(f"❌ {texto!r}: {resultado} (esperado {esperado})")
+    assert not fallos, f"{len(fallos)} de {len(CORPUS)} casos fallan"
+
+
+def test_categoria_y_tags():
+    """'categoría X' and 'extraordinario' are taken out of the description"""
+    datos, confianza = extraer_gasto_local("4 café categoría ocio", HOY)
+    assert datos == (4.0, "café", None, "Ocio", []) and confianza == 0.95
+
+    datos, _ = extraer_gasto_local("500 viaje extraordinario 15 febrero", HOY)
+    assert datos == (500.0, "viaje", "2027-02-15", None, ["Extraordinario"])
+
+
+def test_ambiguas_bajo_el_umbral():
+    """Phrasings the local parser misreads must go to the AI"""
+    for texto in ("15 taxi 3 personas", "dos cafés y un croissant"):
+        _, confianza = extraer_gasto_local(texto, HOY)
+        assert confianza < CONFIANZA_MINIMA, texto
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 TEST: EXPENSE PARSER")
+    print("=" * 60)
+
+    test_corpus()
+    test_categoria_y_tags()
+    test_ambiguas_bajo_el_umbral()
+    print(f"✅ {len(CORPUS)} casos OK")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Record/replay of http_cassette against a local http.server
+
+Records a few requests carrying secrets (a secret environment variable, a
+bearer token, a token query param and a cookie), checks that none of them
+reach the cassette file, then replays it with the server stopped: exact
+matches, the by-URL fallback for a different body and a miss.
+
+Usage: python test_http_cassette.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import http_cassette
+
+ENV_SECRET = 'env-secret-4f9a1c'
+BEARER = 'bearer-secret-77d2e0'
+QUERY_TOKEN = 'query-secret-3b8c51'
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Answers with the request it got, secrets included"""
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        payload = json.dumps({
+            'path': self.path,
+            'body': body,
+            'auth': self.headers.get('Authorization'),
+            'env': ENV_SECRET,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Set-Cookie', f'session={BEARER}')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+def _record(path):
+    """Record three requests against a throwaway server; returns its base URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    headers = {'Authorization': f'Bearer {BEARER}'}
+    try:
+        with http_cassette.cassette(path, 'record') as active:
+            requests.get(f'{base}/tasks?token={QUERY_TOKEN}&day=1', headers=headers)
+            requests.post(f'{base}/report', data='range=2026-10-19', headers=headers)
+            requests.post(f'{base}/report', data='range=2026-10-20', headers=headers)
+            # Written once, when the cassette is uninstalled
+            assert not os.path.exists(path)
+            assert active.stats['recorded'] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+    return base
+
+
+def test_record_scrubs_secrets():
+    """No secret value reaches the cassette file"""
+    os.environ['CASSETTE_TEST_TOKEN'] = ENV_SECRET
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cassette.json')
+            _record(path)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+    finally:
+        del os.environ['CASSETTE_TEST_TOKEN']
+
+    for secret in (ENV_SECRET, BEARER, QUERY_TOKEN):
+        assert secret not in text, secret
+    assert '<CASSETTE_TEST_TOKEN>' in text
+    assert len(json.loads(text)['interactions']) == 3
+
+
+def test_replay_exact_and_by_url():
+    """Replay needs no server: exact matches in order, then the by-URL fallback"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cassette.json')
+        base = _record(path)
+
+        with http_cassette.cassette(path, 'replay', latency=0) as active:
+            response = requests.get(f'{base}/tasks?token=other&day=1')
+            assert response.status_code == 200
+            assert response.json()['path'] == '/tasks?token=<redacted>&day=1'
+
+            first = requests.post(f'{base}/report', data='range=2026-10-19').json()
+            second = requests.post(f'{base}/report', data='range=2026-10-20').json()
+            assert (first['body'], second['body']) == ('range=2026-10-19', 'range=2026-10-20')
+
+            # A body never recorded: same method and URL
+            fallback = requests.post(f'{base}/report', data='range=2026-12-31').json()
+            assert fallback['body'].startswith('range=2026-10-')
+
+            try:
+                requests.get(f'{base}/never-recorded')
+            except requests.exceptions.ConnectionError:
+                pass
+            else:
+                raise AssertionError("an unrecorded request must fail")
+
+            assert active.stats == {'recorded': 0, 'replayed': 3, 'replayed_by_url': 1, 'missed': 1}
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 TEST: HTTP CASSETTE")
+    print("=" * 60)
+
+    test_record_scrubs_secrets()
+    test_replay_exact_and_by_url()
+    print("✅ Record/replay OK")
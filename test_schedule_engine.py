@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Checks of schedule_engine on synthetic days: first-fit vs optimiser
+
+For each seed the optimised schedule must keep the block windows and the morning
+alternation rule, place every task at most once and in one piece, never be worse
+than first-fit and stay within its time budget. Neither pass may write over the
+fixed blocks. The optimiser maximises weighted minutes, so it may leave more
+tasks unassigned than first-fit ("sin asignar" in the report).
+
+Usage: python test_schedule_engine.py [days] [tasks_per_day]
+"""
+
+import random
+import sys
+
+import pytest
+
+import schedule_engine as se
+
+BUDGET_MS = 200
+SEEDS = range(10)
+TASKS_PER_DAY = 30
+
+DURATIONS = ['5min', '15min', '20min', '30min', '1h', '1h', '2h', '2h']
+BLOCKS = ['por la mañana', 'por la tarde', 'por la noche', '', '', 'rutina administrativa matinal', 'checks']
+TYPES = ['fisico', 'intelectual', 'administrativo', '']
+
+WINDOWS = {
+    'por la mañana': se.ZONES['morning'],
+    'rutina administrativa matinal': se.ZONES['morning'],
+    'por la tarde': se.ZONES['afternoon'],
+    'por la noche': se.ZONES['night'],
+}
+
+
+def synthetic_day(seed, count):
+    rng = random.Random(seed)
+    tasks = []
+    for n in range(count):
+        labels = [rng.choice(DURATIONS), rng.choice(BLOCKS), rng.choice(TYPES)]
+        tasks.append({
+            'id': str(n),
+            'content': f'Tarea {n}',
+            'labels': [label for label in labels if label],
+            'priority_value': rng.randint(1, 4),
+        })
+    events = [
+        {'start_time': '10:00', 'end_time': '11:00', 'duration': 60, 'content': '📅 Reunión'},
+        {'start_time': '17:30', 'end_time': '18:15', 'duration': 45, 'content': '📅 Médico'},
+    ]
+    return tasks, events
+
+
+def check_fixed_blocks(schedule):
+    """Desayunar and Comer are never written over"""
+    blocks = se.consolidate_schedule(schedule)
+    for content, start, end in se.RULES.fixed_blocks:
+        assert any(
+            block['content'] == content and se.time_to_minute(block['start_time']) == start
+            and se.time_to_minute(block['end_time']) == end
+            for block in blocks
+        ), f"{content} overwritten"
+
+
+def check_day(seed, count):
+    tasks, events = synthetic_day(seed, count)
+    schedule, report = se.build_schedule(tasks, events, time_budget_ms=BUDGET_MS, verbose=False)
+
+    # The search starts from the first-fit schedule: never worse
+    assert report['optimised']['score'] >= report['first_fit']['score'], report
+    # Some slack for the last node batch and the schedule rebuild
+    assert report['optimiser']['solve_ms'] < BUDGET_MS * 1.5, report['optimiser']
+
+    first_fit_schedule, _ = se.build_schedule(tasks, events, optimise=False, verbose=False)
+    check_fixed_blocks(first_fit_schedule)
+    check_fixed_blocks(schedule)
+
+    if report['used'] != 'optimised':
+        return report
+
+    blocks = se.consolidate_schedule(schedule)
+    seen = set()
+    previous = None
+    for block in blocks:
+        start = se.time_to_minute(block['start_time'])
+        end = se.time_to_minute(block['end_time'])
+        task_id = block.get('id')
+        if task_id:
+            assert task_id not in seen, f"{task_id} split or placed twice"
+            seen.add(task_id)
+            for label, (window_start, window_end) in WINDOWS.items():
+                if label in block['labels'] and not se.has_checks_label(block):
+                    assert window_start <= start and end <= window_end, block
+        if start < se.ZONES['morning'][1]:
+            assert not (previous == 'Física' and block.get('type') == 'Física'), block
+        previous = block.get('type')
+
+    return report
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_check_day(seed):
+    check_day(seed, TASKS_PER_DAY)
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else len(SEEDS)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else TASKS_PER_DAY
+
+    print("=" * 60)
+    print("🧪 TEST: SCHEDULE ENGINE")
+    print("=" * 60)
+
+    for seed in range(days):
+        report = check_day(seed, count)
+        first, best = report['first_fit'], report['optimised']
+        print(f"   día {seed}: {report['used']:<9} {report['optimiser']['solve_ms']:7.1f} ms  "
+              f"sin asignar {first['unassigned_tasks']:>2} -> {best['unassigned_tasks']:>2}  "
+              f"huecos {first['idle_gaps']} -> {best['idle_gaps']}  "
+              f"puntuación {first['score']} -> {best['score']}")
+
+    print(f"✅ {days} días OK")
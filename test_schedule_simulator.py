@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+What-if edits of schedule_simulator: valid edits change the plan, malformed
+ones raise EditError (a 400 on /cronograma/simular) instead of failing inside
+the engine
+
+Usage: python test_schedule_simulator.py
+"""
+
+import pytest
+
+import schedule_engine as se
+from schedule_simulator import EditError, apply_edits, simulate
+from test_schedule_engine import synthetic_day
+
+# (description, edits) that must be rejected
+REJECTED = [
+    ("edit not an object", ["x"]),
+    ("task not an object", [{'action': 'add', 'task': ['X']}]),
+    ("task without content", [{'action': 'add', 'task': {'id': 'nueva'}}]),
+    ("priority as text", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'priority_value': 'alta'}}]),
+    ("priority out of range", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'priority_value': 5}}]),
+    ("priority as bool", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'priority_value': True}}]),
+    ("labels as text", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'labels': 'Fisica'}}]),
+    ("labels not text", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'labels': [1]}}]),
+    ("add duration as text", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'duration_minutes': '45'}}]),
+    ("add duration negative", [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'duration_minutes': -5}}]),
+    ("add duration longer than the day",
+     [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'duration_minutes': se.DAY_MINUTES + 1}}]),
+    ("duration as float", [{'action': 'duration', 'task_id': '0', 'minutes': 30.5}]),
+    ("duration zero", [{'action': 'duration', 'task_id': '0', 'minutes': 0}]),
+    ("duration longer than the day", [{'action': 'duration', 'task_id': '0', 'minutes': 24 * 60}]),
+    ("pin at an invalid time", [{'action': 'pin', 'task_id': '0', 'start_time': '25:00'}]),
+    ("unknown task", [{'action': 'remove', 'task_id': 'nope'}]),
+    ("unknown action", [{'action': 'move', 'task_id': '0'}]),
+]
+
+
+def stored_day(seed=1, count=20):
+    """A plan with its inputs, as schedules_db.get_day_schedule returns it"""
+    tasks, events = synthetic_day(seed, count)
+    schedule, report = se.build_schedule(tasks, events, time_budget_ms=50, verbose=False)
+    return {
+        'date': '2026-10-19',
+        'tasks': tasks,
+        'calendar_events': events,
+        'completed_tasks': [],
+        'plan': se.consolidate_schedule(schedule),
+        'report': report,
+    }
+
+
+@pytest.mark.parametrize('description, edits', REJECTED, ids=[case[0] for case in REJECTED])
+def test_rejected_edits(description, edits):
+    tasks, _ = synthetic_day(1, 20)
+    with pytest.raises(EditError):
+        apply_edits(tasks, edits)
+
+
+def test_valid_add_is_scheduled():
+    stored = stored_day()
+    result = simulate(stored, [{'action': 'add', 'task': {
+        'id': 'nueva', 'content': 'X', 'priority_value': 4, 'labels': ['30min', 'fisico'], 'duration_minutes': 30
+    }}], time_budget_ms=50)
+    scheduled = {str(block.get('id')) for block in result['plan']}
+    unassigned = {str(task['id']) for task in result['unassigned']}
+    assert 'nueva' in scheduled | unassigned
+
+
+def test_text_priority_is_an_edit_error():
+    """The case that used to fail inside the engine with a TypeError"""
+    with pytest.raises(EditError):
+        simulate(stored_day(), [{'action': 'add', 'task': {'id': 'nueva', 'content': 'X', 'priority_value': 'alta'}}])
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 TEST: SCHEDULE SIMULATOR")
+    print("=" * 60)
+
+    for description, edits in REJECTED:
+        test_rejected_edits(description, edits)
+    test_valid_add_is_scheduled()
+    test_text_priority_is_an_edit_error()
+    print(f"✅ {len(REJECTED)} edits rejected, valid edits OK")
@@ -2,7 +2,7 @@
 Web server for handling event copy requests and cronograma regeneration
 """
 
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context
 from flask_cors import CORS
 from calendar_client import iCloudCalendarClient
 from events_db import mark_event_copied, mark_event_ignored, get_new_events
@@ -17,21 +17,186 @@ from expense_utils import (
     categorizar_gasto,
     registrar_en_firefly,
     extraer_monto_descripcion,
+    preparar_gasto,
+    procesar_gasto_encolado,
+    registrar_correccion_categoria,
+    aprender_categoria_usuario,
+    obtener_metricas_parser,
     CATEGORIAS_CONOCIDAS,
     registrar_presupuesto
 )
+from expense_queue import enqueue_expense, get_expense_status, get_queue_stats, start_worker
+from expense_batch import registrar_lote
+from sqlite_store import close_connections
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for browser requests
 
+# Default mode for /registrar-gasto: '1' to always enqueue and answer immediately
+EXPENSE_QUEUE_ASYNC = os.getenv('EXPENSE_QUEUE_ASYNC', '0')
+
+# PostgreSQL connection pool and Idealista schema, set up once per process
+if os.getenv('DATABASE_URL'):
+    from idealista_postgres import get_pool
+    get_pool()
+
 # File to store Idealista data
 IDEALISTA_DATA_FILE = 'idealista_data.json'
 
+# ============================================
+# METRICS (GET /metrics, Prometheus text format)
+# ============================================
+
+import time
+from metrics import REGISTRY, CONTENT_TYPE, gauge_of, counter_of
+from run_trace import add_call_listener
+
+PROCESS_START = time.time()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests per route', ['route', 'method'])
+REQUESTS_TOTAL = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests per route and status', ['route', 'method', 'status'])
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'upstream_request_duration_seconds', 'Latency of calls to upstream services', ['service'])
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'upstream_requests_total', 'Calls to upstream services', ['service'])
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'upstream_errors_total', 'Failed calls to upstream services (exceptions and 5xx)', ['service'])
+FEED_RESPONSES = REGISTRY.counter(
+    'calendar_feed_responses_total', 'Calendar feed responses: hit (304) or miss (full body)', ['result'])
+REGENERATIONS_IN_PROGRESS = REGISTRY.gauge(
+    'cronograma_regenerations_in_progress', 'Cronograma regenerations running (waiting requests)')
+REGENERATIONS_TOTAL = REGISTRY.counter(
+    'cronograma_regenerations_total', 'Cronograma regenerations per result', ['result'])
+
+# Time of the last regeneration that produced a cronograma in this process
+_last_regeneration = {'success': None}
+
+
+def _observe_upstream(service, elapsed_ms, ok):
+    UPSTREAM_LATENCY.observe(elapsed_ms / 1000, service=service)
+    UPSTREAM_REQUESTS.inc(service=service)
+    if not ok:
+        UPSTREAM_ERRORS.inc(service=service)
+
+
+# Todoist, iCloud, Firefly and OpenAI through requests; Postgres reports its queries
+add_call_listener(_observe_upstream)
+
+
+@app.before_request
+def _start_request_timer():
+    request.environ['metrics.started'] = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = request.environ.get('metrics.started')
+    if started is not None:
+        # Route template, not the path: /cola-gastos/<idempotency_key> is one series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method)
+        REQUESTS_TOTAL.inc(route=route, method=request.method, status=str(response.status_code))
+        if route == '/calendar.ics' and response.status_code in (200, 304):
+            FEED_RESPONSES.inc(result='hit' if response.status_code == 304 else 'miss')
+    return response
+
+
+@app.teardown_appcontext
+def _close_sqlite_connections(error=None):
+    # Every request runs in a new thread: its cached SQLite connections would only
+    # be freed when the thread object is collected
+    close_connections()
+
+
+def _collect_cache_metrics():
+    """Hit/miss counters and hit ratio of the in-process caches"""
+    from category_cache import _cache as category_cache
+    from firefly_catalog import _catalogs
+
+    caches = {'calendar_feed': (FEED_RESPONSES.value(result='hit'), FEED_RESPONSES.value(result='miss'))}
+    if category_cache is not None:
+        caches['category'] = (category_cache.hits, category_cache.misses)
+    if _catalogs:
+        caches['firefly_catalog'] = (sum(c.hits for c in list(_catalogs.values())),
+                                     sum(c.misses for c in list(_catalogs.values())))
+
+    return [
+        counter_of('cache_hits_total', 'Cache hits',
+                   {(name,): hits for name, (hits, _) in caches.items()}, ['cache']),
+        counter_of('cache_misses_total', 'Cache misses',
+                   {(name,): misses for name, (_, misses) in caches.items()}, ['cache']),
+        gauge_of('cache_hit_ratio', 'Hits over lookups since process start',
+                 {(name,): hits / (hits + misses) for name, (hits, misses) in caches.items() if hits + misses},
+                 ['cache']),
+    ]
+
+
+def _collect_queue_metrics():
+    """Expense queue depth per status"""
+    stats = get_queue_stats(recent_failed=0)
+    return [gauge_of('expense_queue_items', 'Items in the expense queue per status',
+                     {(status,): stats[status] for status in ('pending', 'processing', 'done', 'failed')},
+                     ['status'])]
+
+
+def _collect_generation_metrics():
+    """
+    Last successful generation, and the stage timings and upstream calls of the
+    last traced run
+
+    Only the traced V7.5 runs (the fallback and tomorrow's preview, run as
+    subprocesses here, and the cron job) show up in the cronograma_last_run_upstream_*
+    gauges, read from the trace (per service, last run only). Their calls never
+    reach _observe_upstream, so they are not part of upstream_requests_total,
+    which already counts the in-process V7 generation: don't add the two up.
+    """
+    from run_trace import load_last_run
+
+    last_success = _last_regeneration['success']
+    run = load_last_run()
+    stages = {}
+    calls = {}
+    if run:
+        finished = datetime.fromisoformat(run['started_at']).timestamp() + (run.get('duration_ms') or 0) / 1000
+        if run.get('status') == 'ok':
+            last_success = max(last_success or 0, finished)
+        stages = {(stage['name'],): stage['duration_ms'] / 1000
+                  for stage in run.get('stages', []) if stage.get('duration_ms') is not None}
+        calls = {(service,): call for service, call in run.get('calls', {}).items()}
+
+    return [
+        gauge_of('process_start_time_seconds', 'Start time of the process (unix seconds)', {(): PROCESS_START}),
+        gauge_of('cronograma_last_success_timestamp_seconds',
+                 'Time of the last successful cronograma generation (unix seconds)', {(): last_success}),
+        gauge_of('cronograma_last_run_duration_seconds', 'Duration of the last traced generation',
+                 {(): run['duration_ms'] / 1000 if run and run.get('duration_ms') is not None else None}),
+        gauge_of('cronograma_last_run_stage_duration_seconds', 'Stage durations of the last traced generation',
+                 stages, ['stage']),
+        gauge_of('cronograma_last_run_upstream_requests', 'Upstream calls of the last traced generation',
+                 {key: call['count'] for key, call in calls.items()}, ['service']),
+        gauge_of('cronograma_last_run_upstream_errors', 'Failed upstream calls of the last traced generation',
+                 {key: call['errors'] for key, call in calls.items()}, ['service']),
+        gauge_of('cronograma_last_run_upstream_seconds', 'Time spent in upstream calls in the last traced generation',
+                 {key: round(call['ms'] / 1000, 4) for key, call in calls.items()}, ['service']),
+    ]
+
+
+REGISTRY.add_collector(_collect_cache_metrics)
+REGISTRY.add_collector(_collect_queue_metrics)
+REGISTRY.add_collector(_collect_generation_metrics)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (also readable with curl)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/boe-subastas', methods=['GET'])
 def boe_dashboard():
     """BOE Subastas Dashboard"""
@@ -297,6 +462,25 @@ def debug_todoist():
             'traceback': traceback.format_exc()
         }), 500
 
+@app.route('/debug/last-run', methods=['GET'])
+def debug_last_run():
+    """Per-stage breakdown of the last cronograma generation (run_trace.py)"""
+    try:
+        from run_trace import load_last_run
+        run = load_last_run()
+        if run is None:
+            return jsonify({'error': 'No generation has been traced yet'}), 404
+        
+        # Slowest stages first, for a quick look
+        run['slowest'] = [
+            {'name': stage['name'], 'duration_ms': stage['duration_ms'], 'requests': stage['requests']}
+            for stage in sorted(run['stages'], key=lambda stage: -(stage['duration_ms'] or 0))[:3]
+        ]
+        return jsonify(run)
+    except Exception as e:
+        print(f"❌ Error reading last run: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/regenerate', methods=['POST', 'GET'])
 def regenerate_endpoint():
     """Regenerate cronograma manually"""
@@ -341,7 +525,7 @@ def copy_and_regenerate():
         
         # Find the event in shared calendar
         print("   Searching for event in Casa Juana Doña...")
-        source_event = find_event_by_uid(calendar_client, "Casa Juana Doña", event_uid)
+        source_event = calendar_client.find_event_by_uid("Casa Juana Doña", event_uid)
         
         if not source_event:
             return jsonify({'error': 'Event not found in shared calendar'}), 404
@@ -480,13 +664,38 @@ def complete_task():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/completed-tasks/stats', methods=['GET'])
+def completed_tasks_stats():
+    """
+    Completed tasks history summaries
+
+    Query params: weeks (default 12), since/until (YYYY-MM-DD, label summary)
+    """
+    try:
+        from completed_tasks_db import get_weekly_summary, get_label_summary
+        
+        weeks = int(request.args.get('weeks', 12))
+        
+        return jsonify({
+            'success': True,
+            'weeks': get_weekly_summary(weeks=weeks),
+            'labels': get_label_summary(
+                since=request.args.get('since'),
+                until=request.args.get('until')
+            )
+        })
+    
+    except Exception as e:
+        print(f"   ❌ Error getting completed tasks stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/update-idealista', methods=['POST'])
 def update_idealista():
     """
     Endpoint to receive Idealista data from Node-RED scraper
     """
     try:
-        from idealista_postgres import save_idealista_data, get_idealista_data
+        from idealista_postgres import save_idealista_data
         
         data = request.json
         
@@ -497,40 +706,20 @@ def update_idealista():
         data['timestamp'] = datetime.now().isoformat()
         data['last_updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Load previous data for comparison
-        previous_data = get_idealista_data()
-        
-        # Calculate changes for each property
-        if previous_data and 'properties' in previous_data:
-            prev_props = {p.get('propertyId'): p for p in previous_data.get('properties', [])}
-            
-            for prop in data['properties']:
-                prop_id = prop.get('propertyId')
-                if prop_id in prev_props:
-                    prev = prev_props[prop_id]
-                    prop['changes'] = {
-                        'visitas': prop.get('visitas', 0) - prev.get('visitas', 0),
-                        'favoritos': prop.get('favoritos', 0) - prev.get('favoritos', 0),
-                        'mensajes': prop.get('mensajes', 0) - prev.get('mensajes', 0)
-                    }
-                else:
-                    prop['changes'] = {'visitas': 0, 'favoritos': 0, 'mensajes': 0}
-        else:
-            # First time, no changes
-            for prop in data['properties']:
-                prop['changes'] = {'visitas': 0, 'favoritos': 0, 'mensajes': 0}
-        
-        # Save data to PostgreSQL database
+        # Save data to PostgreSQL database (per-property changes are computed there, once)
         print(f"\n🔍 DEBUG: Saving Idealista data to PostgreSQL...")
-        print(f"🔍 DEBUG: Data to save: {data}")
-        save_idealista_data(data)
-        print(f"\n✅ Idealista data saved to PostgreSQL")
+        saved = save_idealista_data(data) is not None
+        if saved:
+            print(f"\n✅ Idealista data saved to PostgreSQL")
         
+        # Without the database there are no previous values to diff against
         return jsonify({
             'success': True,
             'message': 'Idealista data updated successfully',
             'properties_count': len(data['properties']),
-            'timestamp': data['timestamp']
+            'timestamp': data['timestamp'],
+            'saved': saved,
+            'changes': {p.get('propertyId'): p.get('changes') or {} for p in data['properties']}
         })
     
     except Exception as e:
@@ -565,6 +754,41 @@ def get_idealista_data():
         print(f"   ❌ Error getting Idealista data: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/idealista-trends', methods=['GET'])
+def get_idealista_trends():
+    """
+    Get Idealista metric trends per property
+
+    Query params: days (default 30), resolution ('day' or 'hour'), property_id
+    """
+    try:
+        from idealista_postgres import get_idealista_trends as load_trends
+        
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            return jsonify({'error': 'days must be a whole number'}), 400
+        resolution = request.args.get('resolution', 'day')
+        property_id = request.args.get('property_id')
+        
+        if days < 1:
+            return jsonify({'error': 'days must be at least 1'}), 400
+        if resolution not in ('day', 'hour'):
+            return jsonify({'error': 'resolution must be "day" or "hour"'}), 400
+        
+        trends = load_trends(days=days, resolution=resolution, property_id=property_id)
+        
+        return jsonify({
+            'success': True,
+            'days': days,
+            'resolution': resolution,
+            'properties': trends
+        })
+    
+    except Exception as e:
+        print(f"   ❌ Error getting Idealista trends: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/firefly-data', methods=['GET'])
 def get_firefly_data():
     """
@@ -704,81 +928,66 @@ def registrar_gasto():
     """
     try:
         data = request.json
-        
+
         if not data:
             return jsonify({
                 'success': False,
                 'error': 'No se recibieron datos'
             }), 400
-        
-        fecha_gasto = None
-        categoria_manual = None
-        tags_gasto = []
-        
-        # Opción 1: Texto completo (desde Siri)
-        if 'texto' in data:
-            texto = data['texto']
-            resultado_extraccion = extraer_monto_descripcion(texto)
-            
-            # Manejar ambos casos: con o sin tags
-            if len(resultado_extraccion) == 5:
-                monto, descripcion, fecha_gasto, categoria_manual, tags_gasto = resultado_extraccion
-            else:
-                monto, descripcion, fecha_gasto, categoria_manual = resultado_extraccion
-                tags_gasto = []
-            
-            # Validar que si hay tag "extraordinario", debe haber fecha
-            if 'Extraordinario' in tags_gasto and fecha_gasto is None:
-                return jsonify({
-                    'success': False,
-                    'error': 'Los gastos extraordinarios DEBEN incluir fecha. Ejemplo: "500 viaje extraordinario 15 febrero"'
-                }), 400
-            
-            if monto is None or descripcion is None:
+
+        # Modo asíncrono: encolar y responder al momento, el worker registra en Firefly
+        modo_async = data.get('async', request.args.get('async', EXPENSE_QUEUE_ASYNC))
+        if str(modo_async).lower() in ('1', 'true', 'yes', 'si', 'sí'):
+            if 'texto' not in data and not ('monto' in data and 'descripcion' in data):
                 return jsonify({
                     'success': False,
-                    'error': 'No se pudo extraer monto y descripción del texto. Formato esperado: "25.50 Mercadona"'
+                    'error': 'Faltan datos. Envía "texto" o "monto" + "descripcion"'
                 }), 400
-        
-        # Opción 2: Monto y descripción separados
-        elif 'monto' in data and 'descripcion' in data:
-            monto = float(data['monto'])
-            descripcion = data['descripcion']
-            fecha_gasto = data.get('fecha')  # Opcional
-            categoria_manual = data.get('categoria')  # Opcional
-            tags_gasto = data.get('tags', [])  # Opcional
-        
-        else:
+
+            idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+            payload = {k: v for k, v in data.items() if k not in ('async', 'idempotency_key')}
+            item, creado = enqueue_expense(payload, idempotency_key)
+
+            print(f"\n📥 Gasto encolado #{item['id']} ({item['status']}){'' if creado else ' [duplicado]'}")
+
+            return jsonify({
+                'success': True,
+                'encolado': True,
+                'duplicado': not creado,
+                'id': item['id'],
+                'idempotency_key': item['idempotency_key'],
+                'estado': item['status'],
+                'mensaje': 'Gasto recibido, se registrará en unos segundos'
+            }), 202 if creado else 200
+
+        gasto, error = preparar_gasto(data)
+
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Faltan datos. Envía "texto" o "monto" + "descripcion"'
+                'error': error
             }), 400
-        
+
+        monto = gasto['monto']
+        descripcion = gasto['descripcion']
+        fecha_gasto = gasto['fecha']
+        tags_gasto = gasto['tags']
+        categoria = gasto['categoria']
+        metodo = gasto['metodo_categorizacion']
+
         print(f"\n💰 Registrando gasto: {monto} EUR - {descripcion}")
         if fecha_gasto:
             print(f"   📅 Fecha: {fecha_gasto}")
         if tags_gasto:
             print(f"   🏷️  Tags: {', '.join(tags_gasto)}")
-        
-        # Agregar tag a la descripción si existe
-        descripcion_con_tag = descripcion
-        if 'Extraordinario' in tags_gasto:
-            descripcion_con_tag = f"{descripcion} [EXTRAORDINARIO]"
-        
-        # Categorizar (usar categoría manual si existe, sino categorizar automáticamente)
-        if categoria_manual:
-            categoria = categoria_manual
-            metodo = 'manual'
-            print(f"   📁 Categoría manual: {categoria}")
-        else:
-            categoria, metodo = categorizar_gasto(descripcion)
-            print(f"   📁 Categoría automática: {categoria} (método: {metodo})")
-        
+        print(f"   📁 Categoría: {categoria} (método: {metodo})")
+
         # Registrar en Firefly III con tags
-        exito, resultado = registrar_en_firefly(monto, descripcion_con_tag, categoria, fecha_gasto, tags_gasto)
+        exito, resultado = registrar_en_firefly(monto, gasto['descripcion_firefly'], categoria, fecha_gasto, tags_gasto)
         
         if exito:
             print(f"   ✅ Registrado en Firefly III")
+            aprender_categoria_usuario(gasto)
             mensaje = f"Registrado: {monto} euros en {categoria}"
             if fecha_gasto:
                 mensaje += f" (fecha: {fecha_gasto})"
@@ -811,6 +1020,83 @@ def registrar_gasto():
         }), 500
 
 
+@app.route('/registrar-gastos-batch', methods=['POST'])
+def registrar_gastos_batch():
+    """
+    Endpoint para registrar muchos gastos de una vez (extracto bancario, CSV...)
+
+    Body JSON (cualquier combinación):
+    {
+        "textos": ["25.50 Mercadona", "60 gasolina ayer"],
+        "texto": "15/10/2026 MERCADONA -25,50\\n16/10/2026 REPSOL -60,00",
+        "csv": "fecha;concepto;importe\\n15/10/2026;MERCADONA;-25,50",
+        "gastos": [{"monto": 25.50, "descripcion": "Mercadona", "fecha": "2026-10-15"}],
+        "async": false
+    }
+    """
+    try:
+        data = request.json
+
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'No se recibieron datos'
+            }), 400
+
+        modo_async = data.get('async', request.args.get('async', EXPENSE_QUEUE_ASYNC))
+        modo_async = str(modo_async).lower() in ('1', 'true', 'yes', 'si', 'sí')
+        if not data.get('idempotency_key') and request.headers.get('Idempotency-Key'):
+            data['idempotency_key'] = request.headers['Idempotency-Key']
+
+        resumen, error = registrar_lote(data, modo_async)
+
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        print(f"\n💰 Lote de gastos: {resumen['total']} entradas, "
+              f"{resumen['categorizaciones']} categorizaciones, {resumen['segundos']}s")
+        for estado, cantidad in resumen['por_estado'].items():
+            print(f"   {estado}: {cantidad}")
+
+        return jsonify({
+            'success': resumen['por_estado'].get('error', 0) == 0,
+            **resumen
+        })
+
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/cola-gastos', methods=['GET'])
+def cola_gastos():
+    """Estado de la cola de gastos asíncronos"""
+    try:
+        return jsonify({
+            'success': True,
+            'cola': get_queue_stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/cola-gastos/<idempotency_key>', methods=['GET'])
+def estado_gasto_encolado(idempotency_key):
+    """Estado de un gasto encolado por su clave de idempotencia"""
+    item = get_expense_status(idempotency_key)
+    if not item:
+        return jsonify({'success': False, 'error': 'Gasto no encontrado en la cola'}), 404
+    return jsonify({'success': True, 'gasto': item})
+
+
 @app.route('/categorias', methods=['GET'])
 def listar_categorias():
     """Lista las categorías disponibles"""
@@ -818,6 +1104,56 @@ def listar_categorias():
         'categorias': list(CATEGORIAS_CONOCIDAS.keys())
     })
 
+@app.route('/corregir-categoria', methods=['POST'])
+def corregir_categoria():
+    """
+    Guarda la categoría correcta para una descripción
+
+    Body JSON:
+    {
+        "descripcion": "Casa Pepe",
+        "categoria": "Comida"
+    }
+    """
+    data = request.json or {}
+    descripcion = data.get('descripcion')
+    categoria = data.get('categoria')
+
+    if not descripcion or not categoria:
+        return jsonify({
+            'success': False,
+            'error': 'Faltan datos. Envía "descripcion" y "categoria"'
+        }), 400
+
+    categoria = categoria.capitalize()
+    registrar_correccion_categoria(descripcion, categoria)
+    print(f"\n📁 Corrección de categoría: {descripcion} → {categoria}")
+
+    return jsonify({
+        'success': True,
+        'mensaje': f'"{descripcion}" se categorizará como {categoria}'
+    })
+
+@app.route('/debug/cache-categorias', methods=['GET'])
+def debug_cache_categorias():
+    """Estadísticas de la caché de categorías"""
+    from category_cache import get_category_cache
+    return jsonify(get_category_cache().stats())
+
+@app.route('/debug/catalogo-firefly', methods=['GET'])
+def debug_catalogo_firefly():
+    """Estadísticas del catálogo local de presupuestos, categorías y cuentas"""
+    from config import get_config
+    from firefly_catalog import get_firefly_catalog
+    config = get_config()
+    catalogo = get_firefly_catalog(config.get('FIREFLY_URL', ''), config.get('FIREFLY_TOKEN', ''))
+    return jsonify(catalogo.stats())
+
+@app.route('/debug/parser-gastos', methods=['GET'])
+def debug_parser_gastos():
+    """Llamadas y latencia del parser de gastos por ruta (local / ia)"""
+    return jsonify(obtener_metricas_parser())
+
 @app.route('/gastos-ayer', methods=['GET'])
 def gastos_ayer():
     """
@@ -1177,6 +1513,118 @@ def serve_cronograma():
     
     return html_content, 200, headers
 
+@app.route('/calendar.ics', methods=['GET'])
+def calendar_feed():
+    """
+    iCalendar subscription feed of the generated cronogramas
+
+    Query params:
+        range: 'week' or 'month' (current one), instead of the default last days
+        from/to: Explicit date range (YYYY-MM-DD, inclusive)
+        shared: '0' to leave out the events copied from the shared calendar
+
+    Supports conditional requests (If-None-Match / If-Modified-Since), so calendar
+    apps polling it get a 304 without a body until a new generation changes it.
+    The body is streamed event by event.
+    """
+    try:
+        from ics_exporter import get_feed_version, iter_feed_ics
+        from datetime import timedelta
+        
+        since = request.args.get('from')
+        until = request.args.get('to')
+        try:
+            for value in (since, until):
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+        
+        today = datetime.now().date()
+        export_range = request.args.get('range')
+        if export_range == 'week':
+            start = today - timedelta(days=today.weekday())
+            since, until = start.isoformat(), (start + timedelta(days=6)).isoformat()
+        elif export_range == 'month':
+            start = today.replace(day=1)
+            end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            since, until = start.isoformat(), end.isoformat()
+        elif export_range:
+            return jsonify({'error': 'range must be "week" or "month"'}), 400
+        
+        include_shared = request.args.get('shared', '1') != '0'
+        
+        etag, last_modified = get_feed_version(since, until, include_shared)
+        
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since and last_modified:
+            not_modified = last_modified <= request.if_modified_since
+        else:
+            not_modified = False
+        
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = Response(
+                stream_with_context(iter_feed_ics(since, until, include_shared)),
+                mimetype='text/calendar'
+            )
+            response.headers['Content-Disposition'] = 'inline; filename="cronograma.ics"'
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    except Exception as e:
+        print(f"   ❌ Error serving calendar feed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cronograma/simular', methods=['POST'])
+def simulate_cronograma():
+    """
+    What-if preview of a generated day plan
+
+    JSON body:
+        date: Plan date (YYYY-MM-DD, default today)
+        edits: List of edits (add / remove / pin / duration, see schedule_simulator.py)
+        budget_ms: Optional optimiser budget
+
+    Reruns the scheduler in memory on the stored inputs of that plan: nothing is
+    fetched from Todoist or iCloud and nothing is saved.
+    """
+    try:
+        from schedules_db import get_day_schedule
+        from schedule_simulator import simulate, EditError
+        
+        data = request.get_json(silent=True) or {}
+        date = data.get('date') or datetime.now().strftime('%Y-%m-%d')
+        edits = data.get('edits', [])
+        if not isinstance(edits, list):
+            return jsonify({'error': 'edits must be a list'}), 400
+        
+        stored = get_day_schedule(date)
+        if not stored:
+            return jsonify({'error': f'No hay cronograma generado para {date}'}), 404
+        
+        budget_ms = data.get('budget_ms')
+        if budget_ms is not None and (not isinstance(budget_ms, int) or not 0 <= budget_ms <= 5000):
+            return jsonify({'error': 'budget_ms must be an integer between 0 and 5000'}), 400
+        
+        try:
+            result = simulate(stored, edits, budget_ms)
+        except EditError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        result['success'] = True
+        result['generated_at'] = stored['generated_at']
+        return jsonify(result)
+    
+    except Exception as e:
+        print(f"   ❌ Error simulating cronograma: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/cronograma/manana', methods=['GET'])
 def serve_cronograma_manana():
     """Generate and serve tomorrow's cronograma in readonly mode"""
@@ -1226,36 +1674,6 @@ def serve_cronograma_manana():
         print(f"   ❌ Error: {e}")
         return jsonify({'error': str(e)}), 500
 
-def find_event_by_uid(calendar_client, calendar_name, uid):
-    """Find an event by UID in a specific calendar"""
-    try:
-        from datetime import timedelta
-        import pytz
-        
-        timezone = pytz.timezone('Europe/Madrid')
-        today = datetime.now(timezone).replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Search in next 60 days
-        for days_ahead in range(60):
-            current_date = today + timedelta(days=days_ahead)
-            next_date = current_date + timedelta(days=1)
-            
-            events = calendar_client.get_events_from_calendar_range(
-                calendar_name,
-                current_date,
-                next_date
-            )
-            
-            for event in events:
-                if event['uid'] == uid:
-                    return event
-        
-        return None
-    
-    except Exception as e:
-        print(f"Error finding event: {e}")
-        return None
-
 def copy_event_to_personal_calendar(calendar_client, source_event):
     """
     Copy an event to the personal calendar using CalDAV
@@ -1284,6 +1702,19 @@ def copy_event_to_personal_calendar(calendar_client, source_event):
         return False
 
 def regenerate_cronograma():
+    """Regenerate the cronograma, counted in /metrics (in progress, result, last success)"""
+    REGENERATIONS_IN_PROGRESS.inc()
+    try:
+        latest = _run_cronograma_generator()
+    finally:
+        REGENERATIONS_IN_PROGRESS.dec()
+    REGENERATIONS_TOTAL.inc(result='ok' if latest else 'error')
+    if latest:
+        _last_regeneration['success'] = time.time()
+    return latest
+
+
+def _run_cronograma_generator():
     """Regenerate the cronograma by running the generator script"""
     try:
         # Import and use V7 module with ChatGPT
@@ -1355,24 +1786,41 @@ if __name__ == '__main__':
     print("  GET  /                        - Serve latest cronograma")
     print("  GET  /cronograma              - Serve latest cronograma")
     print("  GET  /health                  - Health check")
+    print("  GET  /metrics                 - Prometheus metrics (latency, upstream calls, caches, queue)")
+    print("  GET  /calendar.ics            - iCalendar feed, streamed (range=week|month, ETag/304)")
     print("  GET  /boe-subastas            - BOE Subastas Dashboard")
     print("  POST /regenerate              - Regenerate cronograma manually")
     print("  POST /copy-and-regenerate     - Copy event and regenerate")
     print("  POST /ignore-event            - Mark event as ignored")
     print("  POST /complete-task           - Complete task in Todoist and regenerate")
     print("  GET  /new-events              - Get list of new events")
+    print("  GET  /completed-tasks/stats   - Completed tasks per week and per label")
+    print("  POST /cronograma/simular      - What-if preview of a plan (add/remove/pin/duration)")
+    print("  GET  /debug/last-run          - Per-stage timings of the last generation")
     print("  POST /update-idealista        - Update Idealista data from Node-RED")
     print("  GET  /idealista-data          - Get current Idealista data")
+    print("  GET  /idealista-trends        - Idealista metric trends (daily/hourly)")
     print("  GET  /firefly-data            - Get Firefly III financial summary")
-    print("  POST /registrar-gasto         - Register expense via voice (Siri)")
+    print("  POST /registrar-gasto         - Register expense via voice (Siri, async=1 to enqueue)")
+    print("  POST /registrar-gastos-batch  - Register many expenses (texts, bank statement, CSV)")
+    print("  GET  /cola-gastos             - Async expense queue status")
     print("  POST /registrar-presupuesto   - Register budget via voice (Siri)")
     print("  GET  /categorias              - List available expense categories")
+    print("  POST /corregir-categoria      - Teach the category of a description")
     print("\n" + "=" * 80)
     
     # Run server
     # Use PORT environment variable from Railway, default to 8000 for local development
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = True
+
+    # Background worker that pushes queued expenses to Firefly III. With the
+    # reloader the module is imported by a watcher parent and by the serving
+    # child (WERKZEUG_RUN_MAIN set): only the child runs a worker.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_worker(procesar_gasto_encolado)
+
+    app.run(host='0.0.0.0', port=port, debug=debug)
 
 
 # ============================================